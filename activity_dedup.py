@@ -0,0 +1,195 @@
+## @package activity_dedup
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Find the .fit files recording the same activity, e.g. the garmin and the strava exports of one run. \par
+#
+#  @detail
+#    The fingerprint of a file is made from cheap data read by fit_scan: the file_id (device serial number
+#    and creation time) and the session (start time and duration of the activity), the records being
+#    skipped without decoding. Then comes a coarse trace of the positions at 9 fixed fractions of the
+#    duration: only the first record at or after each of these times is decoded, and the scan stops after
+#    the last one. A FIT file has no index, so the headers of the messages are still walked, but only 9
+#    records are decoded (a file without session has the time stamps of its records read). Two files are
+#    the same activity if they come from the same device at the same creation time, or if they start at
+#    about the same time, last about as long and follow the same coarse trace. Only one file of each
+#    activity is kept, the one from the preferred source. \par
+#
+
+import os
+import logging
+import datetime
+import numpy as np
+from fit_scan import fit_scan, manufacturer_names
+
+_start_tolerance = 120.     # seconds between the starts of two copies of one activity
+_duration_tolerance = 120.  # seconds between the durations, or 5% of the duration if larger
+_trace_tolerance = 250.     # meters between the points of the coarse traces
+_trace_points = 9           # number of points of the coarse trace, at 0, 1/8, ... 8/8 of the duration
+_semicircle_deg = 180. / 2**31
+
+_fingerprint_version = 2   # increase when fingerprint() changes (2: the trace from the records at the sampled times)
+_header_fields = [ "manufacturer", "serial_number", "time_created", "start_time", "total_elapsed_time" ]
+_trace_fields = [ "timestamp", "position_lat", "position_long" ]
+
+def fingerprint( ffitname ):
+  '''Get the fingerprint of a .fit file: a dictionary with
+      file, size, manufacturer, serial, time_created, start <datetime>, duration in seconds, trace (list of
+      (lat, long), NaN where the record has no position, empty without any position), version.
+    Quantities not found in the file are None.
+  '''
+  fprint = { "file": ffitname, "size": os.path.getsize( ffitname ), "manufacturer": None, "serial": None,
+             "time_created": None, "start": None, "duration": None, "trace": [ ], "version": _fingerprint_version }
+  scan = fit_scan( ffitname, check_crc = False )
+  for name, fields in scan.messages( [ "file_id", "session" ], _header_fields ):
+    if name == "file_id" and fprint[ "serial" ] is None:
+      fprint[ "manufacturer" ] = manufacturer_names.get( fields.get( "manufacturer" ), fields.get( "manufacturer" ) )
+      fprint[ "serial" ] = fields.get( "serial_number" )
+      fprint[ "time_created" ] = fields.get( "time_created" )
+    elif name == "session" and fprint[ "start" ] is None:
+      fprint[ "start" ] = fields.get( "start_time" )
+      fprint[ "duration" ] = fields.get( "total_elapsed_time" )
+
+  if fprint[ "start" ] is None or fprint[ "duration" ] is None:
+    # no session (e.g. a cut file): the first and the last time stamps of the records
+    times = [ fields[ "timestamp" ] for name, fields in scan.messages( [ "record" ], [ "timestamp" ] )
+              if fields.get( "timestamp" ) is not None ]
+    if len( times ) <= 0:
+      return fprint
+    if fprint[ "start" ] is None: fprint[ "start" ] = times[0]
+    if fprint[ "duration" ] is None: fprint[ "duration" ] = ( times[-1] - times[0] ).total_seconds()
+
+  # only the first record at or after each sampled time is decoded, the times in whole seconds as the records
+  targets = [ fprint[ "start" ] + datetime.timedelta( seconds = int( fprint[ "duration" ] * idx / ( _trace_points - 1. ) ) )
+              for idx in range( _trace_points ) ]
+  trace = [ ( np.nan, np.nan ) ] * _trace_points
+  found = 0
+  for name, fields in scan.messages( [ "record" ], _trace_fields, targets ):
+    if fields.get( "timestamp" ) is None: continue
+    while found < _trace_points and targets[ found ] <= fields[ "timestamp" ]:
+      if fields.get( "position_lat" ) is not None and fields.get( "position_long" ) is not None:
+        trace[ found ] = ( round( fields[ "position_lat" ] * _semicircle_deg, 5 ), round( fields[ "position_long" ] * _semicircle_deg, 5 ) )
+      found = found + 1
+  if any( np.isfinite( lat ) for lat, lon in trace ):
+    fprint[ "trace" ] = trace
+  return fprint
+
+def _trace_distance( trace_a, trace_b ):
+  '''Largest distance in meters between the matching points of two coarse traces, over the points with a
+    position in both. None if there is none.'''
+  lat_a, lon_a = np.array( trace_a, dtype = float ).T
+  lat_b, lon_b = np.array( trace_b, dtype = float ).T
+  dy = ( lat_a - lat_b ) * 111195.
+  dx = ( lon_a - lon_b ) * 111195. * np.cos( np.radians( 0.5 * ( lat_a + lat_b ) ) )
+  distance = np.hypot( dx, dy )
+  distance = distance[ np.isfinite( distance ) ]
+  return float( np.max( distance ) ) if distance.size > 0 else None
+
+def same_activity( fp_a, fp_b ):
+  '''Tell if two fingerprints are copies of the same activity.
+  '''
+  if fp_a[ "serial" ] is not None and fp_a[ "time_created" ] is not None:
+    if fp_a[ "serial" ] == fp_b[ "serial" ] and fp_a[ "time_created" ] == fp_b[ "time_created" ]:
+      return True
+  if fp_a[ "start" ] is None or fp_b[ "start" ] is None:
+    return False
+  if abs( ( fp_a[ "start" ] - fp_b[ "start" ] ).total_seconds() ) > _start_tolerance:
+    return False
+  if fp_a[ "duration" ] is not None and fp_b[ "duration" ] is not None:
+    if abs( fp_a[ "duration" ] - fp_b[ "duration" ] ) > max( _duration_tolerance, 0.05 * max( fp_a[ "duration" ], fp_b[ "duration" ] ) ):
+      return False
+  if len( fp_a[ "trace" ] ) == _trace_points and len( fp_b[ "trace" ] ) == _trace_points:
+    distance = _trace_distance( fp_a[ "trace" ], fp_b[ "trace" ] )
+    if distance is not None:
+      return distance < _trace_tolerance
+  # e.g. treadmill runs without positions: same start and same duration
+  return True
+
+def _rank( fprint, prefer, order ):
+  '''Sorting key of the copies of one activity, the smallest is kept.'''
+  text = ( fprint[ "file" ] + " " + str( fprint[ "manufacturer" ] ) ).lower()
+  for idx, pattern in enumerate( prefer ):
+    if pattern.lower() in text:
+      return ( idx, -fprint[ "size" ], order )
+  return ( len( prefer ), -fprint[ "size" ], order )
+
+def drop_duplicates( fitfiles_list, prefer = None, cache = None, known = None ):
+  '''Keep only one .fit file for each activity.
+
+    Parameters:
+    -- fitfiles_list  list of the input .fit files.
+    -- prefer         list of patterns, e.g. [ "garmin", "strava" ]: the copy whose file name or device
+                      manufacturer matches the earliest pattern is kept. Then the largest file, then the
+                      first one in the list.
+    -- cache          run_cache keeping the fingerprints between two jobs, None to scan all the files.
+    -- known          list of the files already read (e.g. by a server before new files come): always kept,
+                      and an input copy of one of them is dropped.
+
+    Return ( list of the kept files of fitfiles_list in the input order, list of ( dropped file, kept file ) ).
+  '''
+  prefer = prefer or [ ]
+  known = list( known or [ ] )
+  fitfiles_list = known + list( fitfiles_list )
+  fprints = [ ]
+  for ffitname in fitfiles_list:
+    fprint = cache.get( ffitname, "fingerprint" ) if cache is not None else None
+    if fprint is None or fprint.get( "version" ) != _fingerprint_version:
+      try:
+        fprint = fingerprint( ffitname )
+      except Exception as err:
+        # a broken file is kept, its decoding will report the error
+        logging.warning( ' Input ' + ffitname + ' has no fingerprint: ' + str( err ) )
+        fprint = None
+      if fprint is not None and cache is not None:
+        cache.put( ffitname, "fingerprint", fprint )
+    fprints.append( fprint )
+
+  #
+  # union of the copies: the same device and creation time, or close starts (sorted, so the sweep is n log n)
+  #
+  group = list( range( len( fitfiles_list ) ) )
+  def find( idx ):
+    while group[ idx ] != idx:
+      group[ idx ] = group[ group[ idx ] ]
+      idx = group[ idx ]
+    return idx
+  def union( idx, jdx ):
+    group[ find( idx ) ] = find( jdx )
+
+  by_device = { }
+  for idx, fprint in enumerate( fprints ):
+    if fprint is None or fprint[ "serial" ] is None or fprint[ "time_created" ] is None: continue
+    key = ( fprint[ "serial" ], fprint[ "time_created" ] )
+    if key in by_device: union( idx, by_device[ key ] )
+    else: by_device[ key ] = idx
+
+  started = sorted( [ idx for idx, fprint in enumerate( fprints ) if fprint is not None and fprint[ "start" ] is not None ],
+                    key = lambda idx: fprints[ idx ][ "start" ] )
+  for pos, idx in enumerate( started ):
+    prev = pos - 1
+    while prev >= 0 and ( fprints[ idx ][ "start" ] - fprints[ started[ prev ] ][ "start" ] ).total_seconds() <= _start_tolerance:
+      if same_activity( fprints[ idx ], fprints[ started[ prev ] ] ):
+        union( idx, started[ prev ] )
+      prev = prev - 1
+
+  def order( idx ):
+    # a known file first, then the preferred copy
+    return ( idx >= len( known ), _rank( fprints[ idx ], prefer, idx ) )
+
+  best = { } # group -> index of the kept file
+  for idx, fprint in enumerate( fprints ):
+    if fprint is None: continue
+    root = find( idx )
+    if root not in best or order( idx ) < order( best[ root ] ):
+      best[ root ] = idx
+
+  kept = [ ]
+  dropped = [ ]
+  for idx, ffitname in enumerate( fitfiles_list ):
+    if idx < len( known ): continue
+    if fprints[ idx ] is None or best[ find( idx ) ] == idx:
+      kept.append( ffitname )
+    else:
+      dropped.append( ( ffitname, fitfiles_list[ best[ find( idx ) ] ] ) )
+      logging.warning( ' Input ' + ffitname + ' is a copy of ' + fitfiles_list[ best[ find( idx ) ] ] + '. Skip! ')
+  return kept, dropped
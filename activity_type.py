@@ -0,0 +1,112 @@
+## @package activity_type
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Tell the type of activity of a .fit file (running, cycling, ...) before decoding its records. \par
+#
+#  @detail
+#    The sport is written by the device in the "sport" message, near the start of the file, and again in the
+#    "session" and "lap" messages. fit_scan reads only these messages and jumps over the records, so the
+#    rides, swims, ... of a mixed archive are rejected for the cost of a walk through the message headers.
+#    Files without a sport (or with the "generic" one) can be classified from their speed profile instead:
+#    only the speed field of the records is decoded, still without fitparse. \par
+#
+
+import logging
+import numpy as np
+from fit_scan import fit_scan, sport_names
+
+#
+# thresholds of the speed-profile classifier, on the median and the 95th percentile of the moving speed (m/s)
+#
+_moving_speed = 0.5
+_walking_median = 1.9
+_running_median = 6.0
+_running_top = 8.0
+
+def sport_from_header( ffitname ):
+  '''Get the sport written in the sport, session or lap messages, without decoding the records.
+
+    Return ( sport name, message it is taken from ), ( None, None ) if no sport is written or it is "generic".
+  '''
+  found = ( None, None )
+  for name, fields in fit_scan( ffitname, check_crc = False ).messages( [ "sport", "session", "lap" ], [ "sport" ] ):
+    sport = sport_names.get( fields.get( "sport" ), fields.get( "sport" ) )
+    if sport is None or sport == "generic":
+      continue
+    if name in ( "sport", "session" ):
+      # the sport message comes before the records: stop there, do not walk the rest of the file
+      return ( sport, name )
+    if found[0] is None:
+      found = ( sport, name )
+  return found
+
+def sport_from_speed( ffitname ):
+  '''Guess the sport from the speed profile of the records: "walking", "running", "cycling", None if no speed.
+  '''
+  speeds = [ ]
+  for name, fields in fit_scan( ffitname ).messages( [ "record" ], [ "speed", "enhanced_speed" ] ):
+    speed = fields.get( "enhanced_speed" )
+    if speed is None: speed = fields.get( "speed" )
+    if speed is not None: speeds.append( speed )
+  speeds = np.array( speeds, dtype = float )
+  speeds = speeds[ speeds > _moving_speed ]
+  if speeds.size < 10:
+    return None
+  median, top = np.percentile( speeds, [ 50., 95. ] )
+  if median < _walking_median:
+    return "walking"
+  if median <= _running_median and top <= _running_top:
+    return "running"
+  return "cycling"
+
+def activity_type( ffitname, guess = True ):
+  '''Get the type of activity of a .fit file.
+
+    Parameters:
+    -- ffitname  input file name.fit.
+    -- guess     classify from the speed profile when the file has no sport.
+
+    Return ( sport name, source ): source is the message the sport is taken from, or "speed" when it is
+    guessed. ( None, None ) if unknown.
+  '''
+  sport, source = sport_from_header( ffitname )
+  if sport is None and guess:
+    sport = sport_from_speed( ffitname )
+    if sport is not None:
+      source = "speed"
+  return ( sport, source )
+
+def select_sports( fitfiles_list, sports, guess = True, cache = None ):
+  '''Split the inputs by their type of activity, before decoding them.
+
+    Parameters:
+    -- fitfiles_list  list of the input .fit files.
+    -- sports         list of the sport names to keep, e.g. [ "running" ].
+    -- guess          classify from the speed profile the files without a sport.
+    -- cache          run_cache keeping the sport of each file between two jobs.
+
+    Return ( list of the kept files, list of ( rejected file, sport ) ). A file of unknown type is kept,
+    and so is a file which can not be scanned: its decoding will report the error.
+  '''
+  kept = [ ]
+  rejected = [ ]
+  for ffitname in fitfiles_list:
+    product = "sport_guess" if guess else "sport"
+    found = cache.get( ffitname, product ) if cache is not None else None
+    if found is None:
+      try:
+        found = activity_type( ffitname, guess )
+      except Exception as err:
+        logging.warning( ' Input ' + ffitname + ' has no activity type: ' + str( err ) )
+        kept.append( ffitname )
+        continue
+      if cache is not None:
+        cache.put( ffitname, product, found )
+    sport, source = found
+    if sport is None or sport in sports:
+      kept.append( ffitname )
+    else:
+      rejected.append( ( ffitname, sport ) )
+      logging.warning( ' Input ' + ffitname + ' is ' + str( sport ) + ' (from ' + str( source ) + '), not ' + ', '.join( sports ) + '. Skip! ')
+  return kept, rejected
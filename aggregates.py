@@ -0,0 +1,271 @@
+## @package aggregates
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Totals of a series of runs kept as a small mergeable state: count, sum, sum of squares, minimum and
+#         maximum with the run holding them, for each per-run quantity of the summary. \par
+#
+#  @detail
+#    Adding a run to the state is O(1) per quantity, and two states of disjoint runs (two partial archives,
+#    two workers, two athletes) are merged by adding their counts and sums and keeping the smaller minimum and
+#    the larger maximum. The summary of the series (anal.write_summary) is written from the state only.
+#    The state is kept in a JSON file with the stamp of each run and the source of its summary in it, so that
+#    the next job only adds the new runs. A minimum or a maximum can not be taken out again: when a run of the
+#    state is modified, has its summary from another source (indexed from its session, then decoded) or is no
+#    longer in the series, the state is made again from all the summaries. \par
+#
+
+import os
+import json
+import logging
+import datetime
+import numpy as np
+
+_epoch = datetime.datetime( 1970, 1, 1 )
+
+#
+# quantities of run_record.getSummary() kept, with the measurement they need
+#
+summary_fields = [
+  ( "StartTime", "time" ), ( "TotalTimePassed", "time" ), ( "TotalTimeMoving", "time" ),
+  ( "AscendMeters", "altitude" ), ( "DescendMeters", "altitude" ),
+  ( "TotalDistanceKm", "distance" ), ( "TotalDistanceMile", "distance" ),
+  ( "FastestKmTime", "speed" ), ( "MinimumSpeed", "speed" ), ( "MaximumSpeed", "speed" ), ( "AverageSpeed", "speed" ),
+  ( "MinimumPaceKm", "speed" ), ( "MaximumPaceKm", "speed" ), ( "AveragePaceKm", "speed" ),
+  ( "MinimumPaceMile", "speed" ), ( "MaximumPaceMile", "speed" ), ( "AveragePaceMile", "speed" ),
+  ( "MinimumCadence", "cadence" ), ( "MaximumCadence", "cadence" ), ( "AverageCadence", "cadence" ),
+  ( "MinimumHeartRate", "heart_rate" ), ( "MaximumHeartRate", "heart_rate" ), ( "AverageHeartRate", "heart_rate" ),
+]
+
+class aggregate:
+  '''Document for class aggregate
+
+    Purpose: mergeable statistics of one quantity over runs: count, sum, sum of squares, minimum and maximum
+    with the id of the run holding them. <timedelta> and <datetime> values are kept as seconds and given back
+    in their type.
+    Example:
+      speed = aggregate()
+      speed.add( 3.1, "a.fit" )
+      speed.merge( other )
+      print( speed.getMean(), speed.getMax(), speed.getArgMax() )
+  '''
+
+  def __init__(self, kind = None ):
+    self._kind = kind # None: number, "duration": <timedelta>, "time": <datetime>
+    self._count = 0
+    self._sum = 0.
+    self._sumsq = 0.
+    self._min = None
+    self._max = None
+    self._argmin = None
+    self._argmax = None
+
+  def _number(self, value ):
+    if isinstance( value, datetime.timedelta ):
+      self._kind = "duration"
+      return value.total_seconds()
+    if isinstance( value, datetime.datetime ):
+      self._kind = "time"
+      return ( value - _epoch ).total_seconds()
+    if isinstance( value, np.generic ):
+      return value.item()
+    return value
+
+  def _value(self, number ):
+    if number is None or self._kind is None:
+      return number
+    if self._kind == "duration":
+      return datetime.timedelta( seconds = number )
+    return _epoch + datetime.timedelta( seconds = number )
+
+  def add(self, value, run = None ):
+    '''Add the value of one run (None is skipped), run is its id (e.g. the file name).'''
+    if value is None:
+      return None
+    number = self._number( value )
+    self._count += 1
+    self._sum += number
+    self._sumsq += float( number ) * number
+    if self._min is None or number < self._min:
+      self._min, self._argmin = number, run
+    if self._max is None or number > self._max:
+      self._max, self._argmax = number, run
+
+  def merge(self, other ):
+    '''Add the statistics of another aggregate of other runs.'''
+    if other._count <= 0:
+      return self
+    self._kind = self._kind or other._kind
+    self._count += other._count
+    self._sum += other._sum
+    self._sumsq += other._sumsq
+    if self._min is None or other._min < self._min:
+      self._min, self._argmin = other._min, other._argmin
+    if self._max is None or other._max > self._max:
+      self._max, self._argmax = other._max, other._argmax
+    return self
+
+  def getState(self):
+    ''' Return the statistics as a JSON dictionary '''
+    return { "kind": self._kind, "count": self._count, "sum": self._sum, "sumsq": self._sumsq,
+             "min": self._min, "max": self._max, "argmin": self._argmin, "argmax": self._argmax }
+
+  @staticmethod
+  def fromState( state ):
+    ''' Return the aggregate of a getState() dictionary '''
+    new = aggregate( state[ "kind" ] )
+    new._count, new._sum, new._sumsq = state[ "count" ], state[ "sum" ], state[ "sumsq" ]
+    new._min, new._max, new._argmin, new._argmax = state[ "min" ], state[ "max" ], state[ "argmin" ], state[ "argmax" ]
+    return new
+
+  def getCount(self):
+    return self._count
+
+  def getSum(self):
+    ''' Return the sum of the values, in their type (<timedelta> for durations) '''
+    return self._value( self._sum ) if self._kind != "time" else None
+
+  def getMean(self):
+    ''' Return the mean of the values in their type, None if empty '''
+    return self._value( self._sum / float( self._count ) ) if self._count > 0 else None
+
+  def getStd(self):
+    ''' Return the standard deviation of the values in seconds for durations and times, None if empty '''
+    if self._count <= 0:
+      return None
+    mean = self._sum / float( self._count )
+    return float( np.sqrt( max( self._sumsq / self._count - mean * mean, 0. ) ) )
+
+  def getMin(self):
+    return self._value( self._min )
+
+  def getMax(self):
+    return self._value( self._max )
+
+  def getArgMin(self):
+    ''' Return the id of the run with the smallest value '''
+    return self._argmin
+
+  def getArgMax(self):
+    ''' Return the id of the run with the largest value '''
+    return self._argmax
+
+class summary_state:
+  '''Document for class summary_state
+
+    Purpose: the aggregates of all the quantities of summary_fields over a series of runs, kept in a JSON file.
+    Example:
+      state = summary_state( "out/summary_state.json" )
+      if not state.hasRun( "a.fit", stamp, "full/4" ):
+        state.addRun( summary, stamp, "full/4" )
+      state.save()
+      print( state.get( "TotalDistanceKm" ).getSum() )
+  '''
+
+  _version = 2 # increase when the content of the state changes (2: source of the summary of each run)
+
+  def __init__(self, state_name = None ):
+    '''Constructor of class summary_state.
+      Parameter state_name: the JSON file of the state, read if found. None: only kept in memory.
+    '''
+    self._state_name = state_name
+    self.clear()
+    if state_name is not None and os.path.isfile( state_name ):
+      self._read()
+
+  def clear(self):
+    '''Forget all the runs.'''
+    self._runs = { } # run id (file name) -> [ file stamp, source of the summary ]
+    self._aggregates = dict( ( name, aggregate() ) for name, measure in summary_fields )
+
+  def _read(self):
+    try:
+      with open( self._state_name ) as fp:
+        state = json.load( fp )
+      if state.get( "version" ) != self._version: raise KeyError( "version" )
+      runs = state[ "runs" ]
+      aggregates = dict( ( name, aggregate.fromState( state[ "aggregates" ][ name ] ) ) for name, measure in summary_fields )
+    except ( ValueError, KeyError ):
+      logging.warning( ' Summary state ' + self._state_name + ' is broken or of another version. Start from scratch. ')
+      return None
+    self._runs, self._aggregates = runs, aggregates
+
+  def save(self):
+    '''Write the state to its JSON file, through a temporary file.'''
+    if self._state_name is None:
+      return None
+    state = { "version": self._version, "runs": self._runs, "aggregates": dict( ( name, agg.getState() ) for name, agg in self._aggregates.items() ) }
+    with open( self._state_name + ".tmp", "w" ) as fp:
+      json.dump( state, fp )
+    os.rename( self._state_name + ".tmp", self._state_name )
+
+  def hasRun(self, run, stamp = None, source = None ):
+    '''Whether the run is in the state, for the file with this stamp (run_cache.file_stamp) and a summary from
+      this source (read_sequence.getSources()). None: not checked.'''
+    if run not in self._runs:
+      return False
+    kept_stamp, kept_source = self._runs[ run ]
+    return ( stamp is None or kept_stamp == list( stamp ) ) and ( source is None or kept_source == source )
+
+  def getRuns(self):
+    ''' Return the ids of the runs in the state '''
+    return list( self._runs )
+
+  def addRun(self, summary, stamp = None, source = None ):
+    '''Add the quantities of one run (run_record.getSummary()), its id is its "FileName".'''
+    run = summary[ "FileName" ]
+    self._runs[ run ] = [ None if stamp is None else list( stamp ), source ]
+    for name, measure in summary_fields:
+      self._aggregates[ name ].add( summary.get( name ), run )
+
+  def merge(self, other ):
+    '''Add the runs of another state. The runs must be different: None (nothing merged) if one is in both.'''
+    common = set( self._runs ) & set( other._runs )
+    if common:
+      logging.error( ' Summary states with %d runs in common can not be merged, e.g. %s. ', len( common ), sorted( common )[0] )
+      return None
+    self._runs.update( other._runs )
+    for name, agg in other._aggregates.items():
+      self._aggregates[ name ].merge( agg )
+    return self
+
+  def size(self):
+    return len( self._runs )
+
+  def get(self, name ):
+    ''' Return the aggregate of a quantity of summary_fields '''
+    return self._aggregates[ name ]
+
+  def getMeasuredList(self):
+    ''' Return the measurements of summary_fields with at least one run '''
+    measured = [ ]
+    for name, measure in summary_fields:
+      if self._aggregates[ name ].getCount() > 0 and measure not in measured:
+        measured.append( measure )
+    return measured
+
+def update_state( state, summaries, stamps, sources = None ):
+  '''Bring the state to the runs of a series: add the new runs only, or make it again from all the summaries
+    if a run of the state is modified, has its summary from another source or is no longer in the series.
+
+    Parameters:
+    -- summaries  list of run_record.getSummary() of the series.
+    -- stamps     list of the file stamp of each run, None if unknown.
+    -- sources    list of the source of the summary of each run (read_sequence.getSources(), e.g. a run
+                  indexed from its session, then decoded), None if unknown.
+
+    Return the number of runs added.
+  '''
+  if sources is None:
+    sources = [ None ] * len( summaries )
+  current = dict( ( summary[ "FileName" ], ( stamp, source ) ) for summary, stamp, source in zip( summaries, stamps, sources ) )
+  stale = [ run for run in state.getRuns() if run not in current or not state.hasRun( run, *current[ run ] ) ]
+  if stale:
+    logging.info( ' Summary state: %d runs modified or gone, made again from all the runs. ', len( stale ) )
+    state.clear()
+  added = 0
+  for summary, stamp, source in zip( summaries, stamps, sources ):
+    if state.hasRun( summary[ "FileName" ] ): continue
+    state.addRun( summary, stamp, source )
+    added += 1
+  return added
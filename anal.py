@@ -15,9 +15,19 @@ import logging
 import sys                    
 from run_record import *
 from read_sequence import *
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+from export_summary import write_table, export_formats
+from compare_runs import align_traces, ghost_gaps, percentile_band
+from training_load import training_load, stress_score
+from run_cache import file_stamp
+from race_predictor import window_best, fit_models, predict, race_distances
+from intervals import is_interval_session
+from elevation import dem_tiles
+from aggregates import summary_state, update_state
+from overlay import overlays, overlay_lines, draw_overlay
+import argparse
+from lazy_import import pyplot as plt, mdates # matplotlib is only imported when a plot is made
 import datetime
+from collections import OrderedDict
   
 #import seaborn as sns; sns.set(color_codes=True)
 import numpy as np
@@ -41,11 +51,22 @@ def draw_xyplot(xlist, ylist, xlab, ylab, title, out, leg, legloc = 'upper right
     -- plot_type  "Normal":  plot()
     --            "Hist":    hist()
     --            "Scatter": scatter()
+    --            "LogX":    logarithmic x-axis
     -- xmin   minimum of x-axis
     -- xmax   maximum of x-axis
     -- ymin   minimum of y-axis
     -- ymax   maximum of y-axis
+
+    The runs without the quantity (None in xlist or ylist: not measured) are left out.
   '''
+  if ylist is None:
+    xlist = [ x for x in xlist if x is not None ]
+  else:
+    pairs = [ ( x, y ) for x, y in zip( xlist, ylist ) if x is not None and y is not None ]
+    xlist, ylist = [ x for x, y in pairs ], [ y for x, y in pairs ]
+  if len( xlist ) <= 0:
+    logging.warning( ' No run with the quantities of ' + out + '. No plot. ')
+    return None
 
   plt.clf()
   plt.gcf().set_size_inches(xsize_inch, ysize_inch) # default 8., 6.
@@ -58,6 +79,8 @@ def draw_xyplot(xlist, ylist, xlab, ylab, title, out, leg, legloc = 'upper right
     plt.plot( xlist, ylist )
   if "Datetime" in plot_type:
     plt.gcf().autofmt_xdate()
+  if "LogX" in plot_type:
+    plt.xscale( 'log' )
 
     #plt.gcf().autofmt_xdate()
     #xdate = [ datetime.strptime(d,'%m/%d/%Y').date() for d in xlist]
@@ -79,7 +102,7 @@ def draw_xyplot(xlist, ylist, xlab, ylab, title, out, leg, legloc = 'upper right
   plt.title( title )
   #plt.show()
 
-  if dofit and "Hist" not in plot_type:
+  if dofit and "Hist" not in plot_type and len( set( xlist ) ) > 1:
     # Add correlation line
     axes = plt.gca()
     m, b = np.polyfit(xlist, ylist, 1)
@@ -89,55 +112,113 @@ def draw_xyplot(xlist, ylist, xlab, ylab, title, out, leg, legloc = 'upper right
   plt.savefig( out )
 
 def write_summary(seq, outdir):
-  if seq.size() <= 1:
-    logging.error( ' Number of runs <= 1. Return! ')
+  '''Write the summary of the series of runs, from the aggregates of their quantities (see aggregates), kept
+    in outdir/summary_state.json: only the new runs are added to it. The state is kept from one run on (a
+    club rollup merges it), the text only from two runs on.
+
+    Return the summary_state, None if no run.
+  '''
+  if seq.size() <= 0:
+    logging.error( ' No run for the summary. Return! ')
     return None
 
+  state = summary_state( outdir + "/summary_state.json" )
+  stamps = [ file_stamp( summary[ "FileName" ] ) if os.path.isfile( summary[ "FileName" ] ) else None for summary in seq.getSummaries() ]
+  update_state( state, seq.getSummaries(), stamps, seq.getSources() )
+  state.save()
+  if seq.size() <= 1:
+    logging.error( ' Number of runs <= 1. No summary text! ')
+    return state
+
   statime = seq.getStartTime()[0]
   endtime = seq.getStartTime()[ seq.size() - 1 ]
+  render_summary( state, outdir+"/"+statime.strftime('%Y%m%d') + "_to_" +endtime.strftime('%Y%m%d') + "_summary.txt" )
+  return state
+
+def render_summary(state, outname):
+  '''Write the text summary of the runs of a summary_state (aggregates), e.g. merged from several archives.'''
+  measured = state.getMeasuredList()
+  agg = state.get
+  f = open( outname, "w")
+  if "time" in measured:
+    f.write( "Run time: %s to %s \n" % ( agg( "StartTime" ).getMin().strftime('%Y.%m.%d'), agg( "StartTime" ).getMax().strftime('%Y.%m.%d') ) )
+    f.write( "Number of runs: %d \n" % state.size() )
+    f.write( " the average total time elapsed in h:m:s is: %s\n" % agg( "TotalTimePassed" ).getMean() )
+    f.write( " the average total time moving in h:m:s is: %s\n" % agg( "TotalTimeMoving" ).getMean() )
+  if "altitude" in measured:
+    f.write( " the average number of meters assended: %.1f meters. \n" % agg( "AscendMeters" ).getMean() )
+    f.write( " the average number of meters desended: %.1f meters. \n" % agg( "DescendMeters" ).getMean() )
+  if "speed" in measured:
+    f.write( " the time of fastest 1Km in h:m:s is:  %s\n" %  agg( "FastestKmTime" ).getMin() )
+    f.write( " the slowest speed in: %.2f m/s.  \n" % agg( "MinimumSpeed" ).getMin() )
+    f.write( " the fastest speed in: %.2f m/s.  \n" % agg( "MaximumSpeed" ).getMax() )
+    f.write( " the average speed in: %.2f m/s.  \n" % agg( "AverageSpeed" ).getMean() )
+    f.write( " the slowest pace in h:m:s per Km:  %s\n" % agg( "MinimumPaceKm" ).getMax() )
+    f.write( " the fastest pace in h:m:s per Km:  %s\n" % agg( "MaximumPaceKm" ).getMin() )
+    f.write( " the average pace in h:m:s per Km:  %s\n" % agg( "AveragePaceKm" ).getMean() )
+    f.write( " the slowest pace in h:m:s per mile:  %s\n" % agg( "MinimumPaceMile" ).getMax() )
+    f.write( " the fastest pace in h:m:s per mile:  %s\n" % agg( "MaximumPaceMile" ).getMin() )
+    f.write( " the average pace in h:m:s per mile:  %s\n" % agg( "AveragePaceMile" ).getMean() )
+  if "cadence" in measured:
+    f.write( " the minimum cadence in rpm:  %s\n" % agg( "MinimumCadence" ).getMin() )
+    f.write( " the maximum cadence in rpm:  %s\n" % agg( "MaximumCadence" ).getMax() )
+    f.write( " the best average cadence in rpm:  %s\n" % agg( "AverageCadence" ).getMax() )
+    f.write( " the worst average cadence in rpm:  %s\n" % agg( "AverageCadence" ).getMin() )
+    f.write( " the overall average cadence in rpm:  %.1f\n" % agg( "AverageCadence" ).getMean() )
+  if "heart_rate" in measured:
+    f.write( " the minimum heart rate in bpm :  %s\n" % agg( "MinimumHeartRate" ).getMin() )
+    f.write( " the maximum heart rate in bpm :  %s\n" % agg( "MaximumHeartRate" ).getMax() )
+    f.write( " the lowest average heart rate in bpm :  %s\n" % agg( "AverageHeartRate" ).getMin() )
+    f.write( " the highest average heart rate in bpm :  %s\n" % agg( "AverageHeartRate" ).getMax() )
+    f.write( " the overall average heart rate in bpm :  %.1f\n" % agg( "AverageHeartRate" ).getMean() )
+  if "distance" in measured:
+    f.write( " the overall total distance is: %.1f miles.  \n" % agg( "TotalDistanceMile" ).getSum() )
+    f.write( " the average distance per run is: %.1f miles.  \n" % agg( "TotalDistanceMile" ).getMean() )
+    f.write( " the longest distance per run is: %.1f miles.  \n" % agg( "TotalDistanceMile" ).getMax() )
+    f.write( " the shortest distance per run is: %.1f miles.  \n" % agg( "TotalDistanceMile" ).getMin() )
+    f.write( " the overall total distance is: %.1f km.  \n" % agg( "TotalDistanceKm" ).getSum() )
+    f.write( " the average distance per run is: %.1f km.  \n" % agg( "TotalDistanceKm" ).getMean() )
+    f.write( " the longest distance per run is: %.1f km.  \n" % agg( "TotalDistanceKm" ).getMax() )
+    f.write( " the shortest distance per run is: %.1f km.  \n" % agg( "TotalDistanceKm" ).getMin() )
 
-  f = open( outdir+"/"+statime.strftime('%Y%m%d') + "_to_" +endtime.strftime('%Y%m%d') + "_summary.txt", "w")
-  if "time" in seq.getMeasuredList():
-    f.write( "Run time: %s to %s \n" % ( statime.strftime('%Y.%m.%d'), endtime.strftime('%Y.%m.%d') ) )
-    f.write( "Number of runs: %d \n" % seq.size() )
-    f.write( " the average total time elapsed in h:m:s is: %s\n" % datetime.timedelta( seconds= sum(seq.getTotalTimePassed(), datetime.timedelta()).total_seconds() / seq.size() ) )
-    f.write( " the average total time moving in h:m:s is: %s\n" % datetime.timedelta( seconds= sum(seq.getTotalTimeMoving(), datetime.timedelta()).total_seconds() / seq.size() ) )
-  if "altitude" in seq.getMeasuredList():
-    f.write( " the average number of meters assended: %.1f meters. \n" % ( sum( seq.getAscendMeters() ) / seq.size() ) )
-    f.write( " the average number of meters desended: %.1f meters. \n" % ( sum( seq.getDescendMeters() ) / seq.size() ) )
-  if "speed" in seq.getMeasuredList():
-    f.write( " the time of fastest 1Km in h:m:s is:  %s\n" %  min(seq.getFastestKmTime()) )
-    f.write( " the slowest speed in: %.2f m/s.  \n" % min(seq.getMinimumSpeed()) )
-    f.write( " the fastest speed in: %.2f m/s.  \n" % max(seq.getMaximumSpeed()) )
-    f.write( " the average speed in: %.2f m/s.  \n" % (sum(seq.getAverageSpeed()) / seq.size() ) )
-    f.write( " the slowest pace in h:m:s per Km:  %s\n" % max(seq.getMinimumPaceKm()) )
-    f.write( " the fastest pace in h:m:s per Km:  %s\n" % min(seq.getMaximumPaceKm()) )
-    f.write( " the average pace in h:m:s per Km:  %s\n" % datetime.timedelta( seconds= sum(seq.getfltAveragePaceKm()) * 60. ) ) 
-    f.write( " the slowest pace in h:m:s per mile:  %s\n" % max(seq.getMinimumPaceMile() ) )
-    f.write( " the fastest pace in h:m:s per mile:  %s\n" % min(seq.getMaximumPaceMile() ) )
-    f.write( " the average pace in h:m:s per mile:  %s\n" % datetime.timedelta( seconds= sum(seq.getfltAveragePaceMile()) * 60. ) ) 
-  if "cadence" in seq.getMeasuredList():
-    f.write( " the minimum cadence in rpm:  %s\n" % min( seq.getMinimumCadence() ) )
-    f.write( " the maximum cadence in rpm:  %s\n" % max( seq.getMaximumCadence() ) )
-    f.write( " the best average cadence in rpm:  %s\n" % max(seq.getAverageCadence() ) )
-    f.write( " the worst average cadence in rpm:  %s\n" % min(seq.getAverageCadence() ) )
-    f.write( " the overall average cadence in rpm:  %s\n" % (sum(seq.getAverageCadence() ) / seq.size() ) )
-  if "heart_rate" in seq.getMeasuredList():
-    f.write( " the minimum heart rate in bpm :  %s\n" % min(seq.getMinimumHeartRate()) )
-    f.write( " the maximum heart rate in bpm :  %s\n" % max(seq.getMaximumHeartRate()) )
-    f.write( " the lowest average heart rate in bpm :  %s\n" % min(seq.getAverageHeartRate()) )
-    f.write( " the highest average heart rate in bpm :  %s\n" % max(seq.getAverageHeartRate()) )
-    f.write( " the overall average heart rate in bpm :  %s\n" % (sum(seq.getAverageHeartRate()) / seq.size() ) )
-  if "distance" in seq.getMeasuredList():
-    f.write( " the overall total distance is: %.1f miles.  \n" % (sum(seq.getTotalDistanceMile()) ) )
-    f.write( " the average distance per run is: %.1f miles.  \n" % (sum(seq.getTotalDistanceMile()) / seq.size() ) )
-    f.write( " the longest distance per run is: %.1f miles.  \n" % max(seq.getTotalDistanceMile()) )
-    f.write( " the shortest distance per run is: %.1f miles.  \n" % min(seq.getTotalDistanceMile()) )
-    f.write( " the overall total distance is: %.1f km.  \n" % (sum(seq.getTotalDistanceKm()) ) )
-    f.write( " the average distance per run is: %.1f km.  \n" % (sum(seq.getTotalDistanceKm()) / seq.size() ) )
-    f.write( " the longest distance per run is: %.1f km.  \n" % max(seq.getTotalDistanceKm()) )
-    f.write( " the shortest distance per run is: %.1f km.  \n" % min(seq.getTotalDistanceKm()) )
+  f.close()
 
+def write_export(seq, outdir, fmt):
+  '''Write the summaries of all the runs into one machine-readable table, one row per run.
+
+    Parameters:
+    -- fmt  "csv", "jsonl" or "parquet".
+  '''
+  if seq.size() <= 0:
+    logging.error( ' No run to export. Return! ')
+    return None
+
+  statime = seq.getStartTime()[0]
+  endtime = seq.getStartTime()[ seq.size() - 1 ]
+  outname = outdir+"/"+statime.strftime('%Y%m%d') + "_to_" +endtime.strftime('%Y%m%d') + "_runs" + export_formats.get( fmt, "" )
+  summaries = seq.getSummaries()
+  if seq.getCourses() is not None:
+    # the course is a column of the table, e.g. to select the runs of one course
+    summaries = [ OrderedDict( summary, Course = course ) for summary, course in zip( summaries, seq.getCourses() ) ]
+  return write_table( summaries, outname, fmt )
+
+def write_mean_max(seq, outdir):
+  '''Write the table of the all-time mean-maximal speed for each duration, and the run holding it.
+  '''
+  if seq.size() <= 0 or len( seq.getMeanMaxSpeed() ) <= 0:
+    logging.error( ' No mean-maximal curve found. Return! ')
+    return None
+
+  statime = seq.getStartTime()[0]
+  endtime = seq.getStartTime()[ seq.size() - 1 ]
+  envelope = seq.getMeanMaxEnvelope()
+
+  f = open( outdir+"/"+statime.strftime('%Y%m%d') + "_to_" +endtime.strftime('%Y%m%d') + "_mean_max.txt", "w")
+  f.write( "# duration(h:m:s)  best speed(m/s)  pace(h:m:s per Km)  run date\n" )
+  for dur, speed, run in zip( envelope.getDurations(), envelope.getBestSpeed(), envelope.getBestRun() ):
+    if np.isnan( speed ): continue
+    f.write( " %s  %.2f  %s  %s\n" % ( datetime.timedelta( seconds = int( dur ) ), speed,
+      datetime.timedelta( seconds = int( 1000. / speed ) ), run ) )
   f.close()
  
 
@@ -210,40 +291,506 @@ def draw(seq, outdir):
     draw_xyplot( seq.getAverageCadence(), seq.getfltAveragePaceKm(),
       xlab = "Cadence (RPM)", ylab = "Pace (minutes per Km)", title = "",
       out = outdir+"/"+outtime_tag+"_pace_v_cadence.pdf", leg = None, plot_type = "Scatter", xmin = 75, xmax = 95, dofit = True)
+
+  # 
+  # Plot the aerobic efficiency vs time: efficiency factor, decoupling and heart rate drift
+  # 
+  if "heart_rate" in seq.getMeasuredList() and "time" in seq.getMeasuredList():
+    metrics = seq.getEfficiency()
+    for name, ylab, tag in [ ( "EfficiencyFactor", "Efficiency Factor (m/min per BPM)", "_efficiency_v_date.pdf" ),
+                             ( "Decoupling", "Aerobic Decoupling (%)", "_decoupling_v_date.pdf" ),
+                             ( "HeartRateDrift", "Heart Rate Drift at Steady Pace (BPM per hour)", "_hrdrift_v_date.pdf" ) ]:
+      points = [ ( start, metric[ name ] ) for start, metric in zip( seq.getStartTime(), metrics ) if metric[ name ] is not None ]
+      if len( points ) <= 1: continue
+      draw_xyplot( [ p[0] for p in points ], [ p[1] for p in points ],
+        xlab = "running date", ylab = ylab, title = "",
+        out = outdir+"/"+outtime_tag+tag, leg = None, plot_type = "Datetime_Scatter")
+
+  # 
+  # Plot pace vs time for the runs of the most frequent courses (read_sequence.findCourses())
+  # 
+  if seq.getCourses() is not None and "speed" in seq.getMeasuredList() and "time" in seq.getMeasuredList():
+    runs = { }
+    for idx, course in enumerate( seq.getCourses() ):
+      if course is not None: runs.setdefault( course, [ ] ).append( idx )
+    frequent = sorted( [ course for course in runs if len( runs[ course ] ) > 1 ], key = lambda c: -len( runs[ c ] ) )[ :8 ]
+    if len( frequent ) > 0:
+      plt.clf()
+      plt.gcf().set_size_inches(10, 8)
+      for course in frequent:
+        plt.plot( [ seq.getStartTime()[ idx ] for idx in runs[ course ] ], [ seq.getfltAveragePaceKm()[ idx ] for idx in runs[ course ] ],
+          marker = 'o', linewidth = 1, label = "course %d (%d runs)" % ( course, len( runs[ course ] ) ) )
+      plt.gcf().autofmt_xdate()
+      plt.xlabel( "running date" )
+      plt.ylabel( "Pace (minutes per Km)" )
+      plt.legend( loc = 'upper right' )
+      plt.savefig( outdir+"/"+outtime_tag+"_pace_v_date_by_course.pdf" )
+
+  # 
+  # Plot the all-time mean-maximal speed vs duration
+  # 
+  if len( seq.getMeanMaxSpeed() ) > 0:
+    envelope = seq.getMeanMaxEnvelope()
+    draw_xyplot( envelope.getDurations(), envelope.getBestSpeed(),
+      xlab = "Duration (seconds)", ylab = "Best Average Speed (m/s)", title = "",
+      out = outdir+"/"+outtime_tag+"_mean_max.pdf", leg = None, plot_type = "LogX")
   
+def draw_comparison(seq, outdir, step = 10., runs = None):
+  '''Compare the runs at the same positions along the route: the time gap of each run to the median run
+    (the "ghost"), with the latest run highlighted, and the median pace with the 10-90% band.
+
+    Parameters:
+    -- step  distance in meters between two compared positions.
+    -- runs  indices of the runs to compare (e.g. the runs of one course), all the runs if None.
+  '''
+  traces = seq.getTraces()
+  if runs is not None:
+    traces = [ traces[ idx ] for idx in runs ]
+  aligned = align_traces( traces, step = step )
+  if aligned is None or aligned[ "time" ].shape[0] <= 1:
+    logging.error( ' Number of runs with distance <= 1. No comparison. Return! ')
+    return None
+
+  firsttime = seq.getStartTime()[0]
+  lasttime = seq.getStartTime()[ seq.size() - 1 ]
+  outtime_tag = firsttime.strftime('%Y%m%d_') + lasttime.strftime('%Y%m%d')
+  distkm = aligned[ "distance" ] / 1000.
+
+  gaps = ghost_gaps( aligned )
+  plt.clf()
+  plt.gcf().set_size_inches(10, 8)
+  for gap in gaps[ :-1 ]:
+    plt.plot( distkm, gap, color = 'grey', alpha = 0.4, linewidth = 1 )
+  plt.plot( distkm, gaps[-1], color = 'red', linewidth = 2, label = 'latest run' )
+  plt.axhline( 0., color = 'black', linestyle = '--', linewidth = 1 )
+  plt.xlabel( "Distance (Km)" )
+  plt.ylabel( "Time Behind the Median Run (seconds)" )
+  plt.legend( loc = 'upper left' )
+  plt.savefig( outdir+"/"+outtime_tag+"_ghost_gap.pdf" )
+
+  low, median, high = percentile_band( aligned[ "pace" ], ( 10., 50., 90. ) )
+  plt.clf()
+  plt.gcf().set_size_inches(10, 8)
+  plt.fill_between( distkm, low, high, where = ~np.isnan( low ), color = 'lightblue', label = '10% - 90%' )
+  plt.plot( distkm, median, color = 'blue', linewidth = 2, label = 'median' )
+  plt.plot( distkm, aligned[ "pace" ][-1], color = 'red', linewidth = 1, label = 'latest run' )
+  plt.xlabel( "Distance (Km)" )
+  plt.ylabel( "Pace (minutes per Km)" )
+  plt.legend( loc = 'upper right' )
+  plt.savefig( outdir+"/"+outtime_tag+"_pace_band.pdf" )
+
+def draw_pooled(seq, outdir):
+  '''Plot the distributions of heart rate, pace and cadence over the moving records of all the runs, with
+    their 10%, 50% and 90% quantiles, and the joint distributions of pace vs heart rate and pace vs cadence.
+  '''
+  if seq.size() <= 0:
+    return None
+  pooled = seq.getPooledHistograms()
+  firsttime = seq.getStartTime()[0]
+  lasttime = seq.getStartTime()[ seq.size() - 1 ]
+  outtime_tag = firsttime.strftime('%Y%m%d_') + lasttime.strftime('%Y%m%d')
+
+  for name, xlab, tag in [ ( "heart_rate", "Heart Rate (BPM), all records", "_pooled_heartrate.pdf" ),
+                           ( "pace", "Pace (minutes per Km), all records", "_pooled_pace.pdf" ),
+                           ( "cadence", "Cadence (RPM), all records", "_pooled_cadence.pdf" ) ]:
+    hist = pooled[ name ]
+    if hist.getTotal() <= 0.: continue
+    edges = hist.getEdges()
+    plt.clf()
+    plt.gcf().set_size_inches(10, 8)
+    plt.bar( edges[ :-1 ], hist.getCounts() / 60., width = np.diff( edges ), align = 'edge', color = '#0504aa', alpha = 0.5 )
+    for q, style in [ ( 0.1, ':' ), ( 0.5, '--' ), ( 0.9, ':' ) ]:
+      value = pooled[ name + "_quantile" ].getQuantile( q )
+      plt.axvline( value, color = 'red', linestyle = style, label = '%d%%: %.1f' % ( q * 100, value ) )
+    plt.xlabel( xlab )
+    plt.ylabel( "Minutes" )
+    plt.legend( loc = 'upper right' )
+    plt.savefig( outdir+"/"+outtime_tag+tag )
+
+  for name, ylab, tag in [ ( "pace_v_heart_rate", "Heart Rate (BPM)", "_pooled_pace_v_heartrate.pdf" ),
+                           ( "pace_v_cadence", "Cadence (RPM)", "_pooled_pace_v_cadence.pdf" ) ]:
+    hist = pooled[ name ]
+    if hist.getCounts().sum() <= 0.: continue
+    plt.clf()
+    plt.gcf().set_size_inches(10, 8)
+    plt.pcolormesh( hist.getXEdges(), hist.getYEdges(), np.ma.masked_equal( hist.getCounts().T / 60., 0. ), cmap = 'viridis' )
+    plt.colorbar( label = "Minutes" )
+    plt.xlabel( "Pace (minutes per Km)" )
+    plt.ylabel( ylab )
+    plt.savefig( outdir+"/"+outtime_tag+tag )
+
+def write_training_load(seq, outdir, rest_hr = 60., max_hr = 190.):
+  '''Add the stress score of the new (or modified) runs to the training load kept in outdir, take out the runs
+    no longer in the series, and write the daily acute and chronic loads. The runs already scored are not
+    read again.
+
+    Parameters:
+    -- rest_hr, max_hr  heart rate at rest and maximum heart rate, for the TRIMP.
+
+    Return the training_load, None if no run.
+  '''
+  if seq.size() <= 0:
+    logging.error( ' No run for the training load. Return! ')
+    return None
+
+  # threshold speed of the pace score: the best speed held for one hour, or for the longest duration if shorter
+  threshold_speed = None
+  if len( seq.getMeanMaxSpeed() ) > 0:
+    envelope = seq.getMeanMaxEnvelope()
+    durations = np.asarray( envelope.getDurations() )
+    best = np.asarray( envelope.getBestSpeed() )
+    held = np.isfinite( best ) & ( durations <= 3600 )
+    # rounded: a pace score is made again only when the threshold really moves
+    if np.any( held ): threshold_speed = round( float( best[ held ][ np.argmax( durations[ held ] ) ] ), 3 )
+
+  # a score is made again when the file, the source of its summary (index -> full) or its threshold changes
+  load = training_load( outdir + "/training_load.json", rest_hr = rest_hr, max_hr = max_hr )
+  # the runs no longer in the series (deleted, copies dropped, other sports) are taken out of the loads
+  current = set( summary[ "FileName" ] for summary in seq.getSummaries() )
+  for fname in load.getRuns():
+    if fname not in current: load.removeRun( fname )
+  for summary, source in zip( seq.getSummaries(), seq.getSources() ):
+    fname = summary[ "FileName" ]
+    stamp = file_stamp( fname ) if os.path.isfile( fname ) else None
+    if load.hasRun( fname, stamp, source, threshold_speed ): continue
+    traces = seq.getCache().get( fname, "traces" )
+    # the heart rate score first, it does not depend on the threshold speed
+    score, threshold = stress_score( traces, summary, rest_hr, max_hr ), None
+    if score is None and threshold_speed is not None:
+      score, threshold = stress_score( traces, summary, rest_hr, max_hr, threshold_speed ), threshold_speed
+    load.addRun( fname, summary[ "StartTime" ], score, stamp, source, threshold )
+  load.save()
+
+  days = load.getDays()
+  if len( days ) <= 0:
+    return load
+  f = open( outdir+"/"+days[0].strftime('%Y%m%d') + "_to_" +days[-1].strftime('%Y%m%d') + "_training_load.txt", "w")
+  f.write( "# day  load  acute(fatigue)  chronic(fitness)  balance(form)\n" )
+  for day, daily, acute, chronic in zip( days, load.getDailyLoad(), load.getAcuteLoad(), load.getChronicLoad() ):
+    f.write( " %s  %.1f  %.1f  %.1f  %.1f\n" % ( day.strftime('%Y.%m.%d'), daily, acute, chronic, chronic - acute ) )
+  f.close()
+  return load
+
+def write_intervals(seq, outdir):
+  '''Write the work and recovery reps of the interval sessions among the runs (see intervals).'''
+  if seq.size() <= 0:
+    return None
+  sessions = [ ( start, reps ) for start, reps in zip( seq.getStartTime(), seq.getIntervals() ) if is_interval_session( reps ) ]
+  statime = seq.getStartTime()[0]
+  endtime = seq.getStartTime()[ seq.size() - 1 ]
+  f = open( outdir+"/"+statime.strftime('%Y%m%d') + "_to_" +endtime.strftime('%Y%m%d') + "_intervals.txt", "w")
+  f.write( "Number of interval sessions: %d of %d runs \n" % ( len( sessions ), seq.size() ) )
+  for start, reps in sessions:
+    work = [ rep for rep in reps if rep[ "Kind" ] == "work" ]
+    f.write( "%s: %d work reps, average %.0f m in %s \n" % ( start.strftime('%Y.%m.%d at %Hh%M'), len( work ),
+      sum( rep[ "Meters" ] for rep in work ) / len( work ),
+      datetime.timedelta( seconds = int( sum( rep[ "Seconds" ] for rep in work ) / len( work ) ) ) ) )
+    for rep in reps:
+      f.write( "   %-8s  %s  %.0f m  %s per Km  %s bpm\n" % ( rep[ "Kind" ] + ( " %d" % rep[ "Rep" ] if rep[ "Rep" ] else "" ),
+        datetime.timedelta( seconds = int( rep[ "Seconds" ] ) ), rep[ "Meters" ],
+        datetime.timedelta( seconds = int( rep[ "PaceKm" ] * 60. ) ) if rep[ "PaceKm" ] else "-",
+        "%.0f" % rep[ "AverageHeartRate" ] if rep[ "AverageHeartRate" ] else "-" ) )
+  f.close()
+  return sessions
+
+def write_race_prediction(seq, outdir, weeks = 6):
+  '''Write the predicted race times at the date of each run, from the best efforts of the runs of the weeks
+    before it (see race_predictor).
+
+    Parameters:
+    -- weeks  length in weeks of the window of runs used for each prediction.
+
+    Return: ( list of run dates, dictionary of race name -> array of predicted seconds, models ), None if no run
+            has a distance.
+  '''
+  efforts = seq.getBestEfforts()
+  kept = [ idx for idx, effort in enumerate( efforts ) if effort is not None ]
+  if len( kept ) <= 0:
+    logging.error( ' No best effort found. No race prediction. Return! ')
+    return None
+
+  dates = [ seq.getStartTime()[ idx ] for idx in kept ]
+  order = sorted( range( len( kept ) ), key = lambda k: dates[ k ] )
+  dates = [ dates[ k ] for k in order ]
+  matrix = np.array( [ efforts[ kept[ k ] ] for k in order ] )
+  models = fit_models( window_best( matrix, dates, weeks ) )
+  predicted = predict( models )
+
+  f = open( outdir+"/"+dates[0].strftime('%Y%m%d') + "_to_" +dates[-1].strftime('%Y%m%d') + "_race_prediction.txt", "w")
+  f.write( "# prediction from the best efforts of the last %d weeks, in h:m:s\n" % weeks )
+  f.write( "# date  " + "  ".join( name for name, dist in race_distances ) + "  critical speed(m/s)  D'(m)\n" )
+  for idx, date in enumerate( dates ):
+    times = [ "%s" % datetime.timedelta( seconds = int( predicted[ name ][ idx ] ) ) if np.isfinite( predicted[ name ][ idx ] ) else "-"
+              for name, dist in race_distances ]
+    f.write( " %s  %s  %.2f  %.0f\n" % ( date.strftime('%Y.%m.%d'), "  ".join( times ),
+      models[ "CriticalSpeed" ][ idx ], models[ "Dprime" ][ idx ] ) )
+  f.close()
+  return dates, predicted, models
+
+def draw_race_prediction(prediction, outdir):
+  '''Plot the trend of the predicted race times vs date, in minutes per Km to share one axis.'''
+  if prediction is None or len( prediction[0] ) <= 1:
+    return None
+  dates, predicted, models = prediction
+  plt.clf()
+  plt.gcf().set_size_inches(10, 8)
+  for name, distance in race_distances:
+    plt.plot( dates, predicted[ name ] / 60. / ( distance / 1000. ), marker = 'o', linewidth = 1, label = name )
+  plt.gcf().autofmt_xdate()
+  plt.xlabel( "running date" )
+  plt.ylabel( "Predicted Race Pace (minutes per Km)" )
+  plt.legend( loc = 'upper right' )
+  plt.savefig( outdir+"/"+dates[0].strftime('%Y%m%d_') + dates[-1].strftime('%Y%m%d') + "_race_prediction.pdf" )
+
+def draw_training_load(load, outdir):
+  '''Plot the daily acute and chronic loads and their balance vs date.'''
+  if load is None or len( load.getDays() ) <= 1:
+    return None
+  days = load.getDays()
+  plt.clf()
+  plt.gcf().set_size_inches(10, 8)
+  plt.bar( days, load.getDailyLoad(), color = 'lightgrey', label = 'daily load' )
+  plt.plot( days, load.getAcuteLoad(), color = 'red', linewidth = 2, label = 'acute load (fatigue)' )
+  plt.plot( days, load.getChronicLoad(), color = 'blue', linewidth = 2, label = 'chronic load (fitness)' )
+  plt.plot( days, load.getBalance(), color = 'green', linewidth = 1, label = 'balance (form)' )
+  plt.axhline( 0., color = 'black', linestyle = '--', linewidth = 1 )
+  plt.gcf().autofmt_xdate()
+  plt.xlabel( "date" )
+  plt.ylabel( "Training Load" )
+  plt.legend( loc = 'upper left' )
+  plt.savefig( outdir+"/"+days[0].strftime('%Y%m%d_') + days[-1].strftime('%Y%m%d') + "_training_load.pdf" )
+
+def draw_routes(seq, outdir):
+  '''Plot the simplified routes of all the runs on one map (longitude vs latitude).'''
+  routes = [ ( start, route ) for start, route in zip( seq.getStartTime(), seq.getRoutes() ) if route is not None ]
+  if len( routes ) <= 0:
+    logging.error( ' No route found. No map. Return! ')
+    return None
+  plt.clf()
+  plt.gcf().set_size_inches(10, 10)
+  for start, route in routes:
+    plt.plot( route[ :, 1 ], route[ :, 0 ], linewidth = 1, alpha = 0.6 )
+  # meters east as long as meters north
+  plt.gca().set_aspect( 1. / np.cos( np.radians( np.mean( [ route[ :, 0 ].mean() for start, route in routes ] ) ) ) )
+  plt.xlabel( "longitude (degrees)" )
+  plt.ylabel( "latitude (degrees)" )
+  plt.title( "%d routes, %d points" % ( len( routes ), sum( len( route ) for start, route in routes ) ) )
+  plt.savefig( outdir+"/"+routes[0][0].strftime('%Y%m%d_') + routes[-1][0].strftime('%Y%m%d') + "_routes.pdf" )
+
+def draw_overlays(seq, outdir):
+  '''Plot the full traces of all the runs over each other (see overlay), one figure for each of
+    overlay.overlays, the color of a run from its date. The traces are read one run at a time, only their
+    downsampled lines are kept.
+  '''
+  if seq.size() <= 0:
+    return None
+  lines_of = dict( ( name, [ ] ) for name in overlays )
+  found = 0
+  for idx in range( seq.size() ):
+    trace = seq.getTrace( idx )
+    if trace is not None: found += 1
+    for name in overlays:
+      lines_of[ name ].extend( overlay_lines( [ trace ], name ) )
+  if found <= 0:
+    logging.error( ' No trace found. No overlay. Return! ')
+    return None
+  starts = seq.getStartTime()
+  days = [ ( start - starts[0] ).total_seconds() / 86400. for start in starts ]
+  outtime_tag = starts[0].strftime('%Y%m%d_') + starts[ -1 ].strftime('%Y%m%d')
+  for name, ( function, xlab, ylab ) in overlays.items():
+    lines = lines_of[ name ]
+    drawn = draw_overlay( lines, outdir+"/"+outtime_tag+"_overlay_"+name+".pdf", xlab, ylab,
+      title = "%d runs" % sum( line is not None for line in lines ), values = days,
+      value_label = "days since " + starts[0].strftime('%Y.%m.%d') )
+    if drawn <= 0:
+      logging.warning( ' No run with the measures of the overlay ' + name + '. Skip! ')
+
+def write_courses(seq, outdir):
+  '''Group the runs by course (see route_clusters), kept in outdir/courses.json, and write the courses of
+    more than one run.
+
+    Return the list of the course id of each run, None without route.
+  '''
+  if seq.size() <= 0:
+    return None
+  courses = seq.findCourses( outdir + "/courses.json" )
+  runs = { }
+  for idx, course in enumerate( courses ):
+    if course is not None: runs.setdefault( course, [ ] ).append( idx )
+  statime = seq.getStartTime()[0]
+  endtime = seq.getStartTime()[ seq.size() - 1 ]
+  f = open( outdir+"/"+statime.strftime('%Y%m%d') + "_to_" +endtime.strftime('%Y%m%d') + "_courses.txt", "w")
+  f.write( "Number of courses: %d, runs without route: %d \n" % ( len( runs ), courses.count( None ) ) )
+  f.write( "# course  runs  average km  best pace(per Km)  first run  last run\n" )
+  for course in sorted( runs, key = lambda c: -len( runs[ c ] ) ):
+    if len( runs[ course ] ) <= 1: continue
+    dates = sorted( seq.getStartTime()[ idx ] for idx in runs[ course ] )
+    f.write( " %d  %d  %.2f  %s  %s  %s\n" % ( course, len( runs[ course ] ),
+      np.mean( [ seq.getTotalDistanceKm()[ idx ] for idx in runs[ course ] ] ),
+      datetime.timedelta( seconds = int( 60. * min( seq.getfltAveragePaceKm()[ idx ] for idx in runs[ course ] ) ) ),
+      dates[0].strftime('%Y.%m.%d'), dates[-1].strftime('%Y.%m.%d') ) )
+  f.close()
+  return courses
+
+def write_elevation(seq, outdir, dem):
+  '''Write the ascent and descent of each run from the device altitude and from the ground elevation of its
+    positions (see elevation), and their averages.
+
+    Parameters:
+    -- dem  elevation.dem_tiles of the folder of the .hgt tiles.
+
+    Return: list of ( start time, device ascent, ground ascent ) of the runs with both, None if none.
+  '''
+  if seq.size() <= 0:
+    return None
+  climbs = seq.getCorrectedClimb( dem )
+  logging.info( ' Number of elevation tiles read: %d ', dem.getReads() )
+  # the runs without altitude have None
+  device_climbs = [ ( ascent, descent ) if ascent is not None and descent is not None else None
+                    for ascent, descent in zip( seq.getAscendMeters(), seq.getDescendMeters() ) ] \
+                  if "altitude" in seq.getMeasuredList() else [ None ] * seq.size()
+  measured = [ climb for climb in device_climbs if climb is not None ]
+  statime = seq.getStartTime()[0]
+  endtime = seq.getStartTime()[ seq.size() - 1 ]
+  f = open( outdir+"/"+statime.strftime('%Y%m%d') + "_to_" +endtime.strftime('%Y%m%d') + "_elevation.txt", "w")
+  corrected = [ climb for climb in climbs if climb is not None ]
+  f.write( "Number of runs with ground elevation: %d of %d \n" % ( len( corrected ), seq.size() ) )
+  if measured:
+    f.write( " the average number of meters assended (device): %.1f meters. \n" % ( sum( c[0] for c in measured ) / len( measured ) ) )
+  if corrected:
+    f.write( " the average number of meters assended (ground): %.1f meters. \n" % ( sum( c[ "AscendMeters" ] for c in corrected ) / len( corrected ) ) )
+    f.write( " the average number of meters desended (ground): %.1f meters. \n" % ( sum( c[ "DescendMeters" ] for c in corrected ) / len( corrected ) ) )
+  f.write( "# run date  ascent device  descent device  ascent ground  descent ground  positions with ground(%)\n" )
+  points = [ ]
+  for idx, ( start, climb ) in enumerate( zip( seq.getStartTime(), climbs ) ):
+    device = device_climbs[ idx ]
+    f.write( " %s  %s  %s  %s\n" % ( start.strftime('%Y.%m.%d %Hh%M'),
+      "%.0f  %.0f" % device if device is not None else "-  -",
+      "%.0f  %.0f" % ( climb[ "AscendMeters" ], climb[ "DescendMeters" ] ) if climb is not None else "-  -",
+      "%.0f" % ( 100. * climb[ "Coverage" ] ) if climb is not None else "-" ) )
+    if device is not None and climb is not None:
+      points.append( ( start, device[0], climb[ "AscendMeters" ] ) )
+  f.close()
+  return points if points else None
+
+def draw_elevation(points, outdir):
+  '''Plot the ascent of each run vs date from the device altitude and from the ground elevation.'''
+  if points is None or len( points ) <= 1:
+    return None
+  plt.clf()
+  plt.gcf().set_size_inches(10, 8)
+  plt.plot( [ p[0] for p in points ], [ p[1] for p in points ], 'o', color = 'grey', label = 'device altitude' )
+  plt.plot( [ p[0] for p in points ], [ p[2] for p in points ], 'o', color = 'green', label = 'ground elevation' )
+  plt.gcf().autofmt_xdate()
+  plt.xlabel( "running date" )
+  plt.ylabel( "Ascend per Run (meters)" )
+  plt.legend( loc = 'upper right' )
+  plt.savefig( outdir+"/"+points[0][0].strftime('%Y%m%d_') + points[-1][0].strftime('%Y%m%d') + "_ascent_ground_v_device.pdf" )
+
+def write_outputs(seq, outdir, exports = [ ], plots = True, compare = False, rest_hr = 60., max_hr = 190., weeks = 6, dem = None):
+  '''Write all the summaries of a series of runs to outdir, and the plots unless plots is False.
+
+    Parameters:
+    -- exports          formats of the per-run table (see write_export).
+    -- compare          also plot the comparison of the runs at the same distances.
+    -- rest_hr, max_hr  heart rates for the training load.
+    -- weeks            window of the race prediction.
+    -- dem              folder of the .hgt elevation tiles, for the ascent from the ground elevation. None: not done.
+
+    Return: ( training_load, race prediction ), see write_training_load and write_race_prediction.
+  '''
+  write_summary(seq, outdir )
+  write_mean_max(seq, outdir )
+  if not seq.isIndexMode():
+    write_courses(seq, outdir )
+  for fmt in exports:
+    write_export(seq, outdir, fmt )
+  load = write_training_load(seq, outdir, rest_hr = rest_hr, max_hr = max_hr )
+  prediction = write_race_prediction(seq, outdir, weeks = weeks )
+  write_intervals(seq, outdir )
+  climbs = None
+  if dem is not None and not seq.isIndexMode():
+    climbs = write_elevation(seq, outdir, dem_tiles( dem ) )
+
+  if not plots:
+    return load, prediction
+  print 'Start making plots to: ', outdir, '.'
+  draw(seq, outdir )
+  draw_pooled(seq, outdir )
+  draw_routes(seq, outdir )
+  draw_overlays(seq, outdir )
+  draw_training_load(load, outdir )
+  draw_race_prediction(prediction, outdir )
+  draw_elevation(climbs, outdir )
+  if compare:
+    # the runs of the most frequent course, if the courses are known
+    courses = [ course for course in ( seq.getCourses() or [ ] ) if course is not None ]
+    frequent = max( set( courses ), key = courses.count ) if courses else None
+    draw_comparison(seq, outdir, runs = None if frequent is None or courses.count( frequent ) <= 1 else
+      [ idx for idx, course in enumerate( seq.getCourses() ) if course == frequent ] )
+  return load, prediction
+
 def main():
   '''
-    Example: python read_sequence.py input.txt out_dir 
+    Example: python anal.py input.txt out_dir [--export csv]
     Note:    this example is tested with python version 2.7
-    Argu:  input.txt contains the list of all *fit* inputs.
+    Argu:  input.txt contains the list of all *fit* inputs, or a folder of *fit* files.
            out_dir   the output folder.
+           --export  also write the per-run summaries as one table: csv, jsonl or parquet.
+           The outcome of each input is kept in out_dir/journal.jsonl: an interrupted job started again
+           only decodes the inputs not done yet. Each input is decoded in its own process with --timeout.
+           --no-plots only write the summaries, matplotlib is then never imported.
+           --sports   e.g. running: the other activities are rejected from their header, before decoding.
+           --index    per-run summaries from the session messages only, the records are not decoded.
+           --compare  also compare the runs of the most frequent course at the same distances.
+           The runs are grouped by course from their routes (out_dir/courses.json), new runs only are assigned.
+           The training load (out_dir/training_load.json) is updated with the new runs only.
+           --weeks    the race times are predicted from the best efforts of the runs of the last weeks.
+           --dem      folder of SRTM .hgt tiles: the ascent of each run is also taken from the ground elevation.
   '''
 
-  if len(sys.argv) < 2:
-    print 'Usage: ', sys.argv[0], ' in_dir [out_dir] ' 
-    return 0
-
-  outdir = '.'
-  if len(sys.argv) >= 3:
-    outdir = sys.argv[2]
-
+  parser = argparse.ArgumentParser( description = 'Analyze a series of runs from *fit* files.' )
+  parser.add_argument( 'input', help = 'folder of *fit* files, or a text file with one *fit* input per line' )
+  parser.add_argument( 'outdir', nargs = '?', default = '.', help = 'output folder' )
+  parser.add_argument( '--export', action = 'append', default = [ ], choices = sorted( export_formats ),
+    help = 'write the per-run summaries as one table, can be given more than once' )
+  parser.add_argument( '--no-plots', action = 'store_true', help = 'only write the summaries, never import matplotlib' )
+  parser.add_argument( '--index', action = 'store_true', help = 'take the summaries from the session messages, do not decode the records' )
+  parser.add_argument( '--compare', action = 'store_true', help = 'plot the gap to the median run and the pace band vs distance' )
+  parser.add_argument( '--sports', default = '', help = 'comma separated sports to keep, e.g. running; the others are never decoded' )
+  parser.add_argument( '--no-sport-guess', action = 'store_true', help = 'keep the inputs with no sport written, do not guess it from the speed' )
+  parser.add_argument( '--keep-duplicates', action = 'store_true', help = 'keep all the copies of an activity' )
+  parser.add_argument( '--prefer', default = '', help = 'comma separated sources to keep first among copies, e.g. garmin,strava' )
+  parser.add_argument( '--jobs', type = int, default = 1, help = 'number of inputs decoded at the same time' )
+  parser.add_argument( '--timeout', type = float, default = 120., help = 'time limit in seconds to decode one input' )
+  parser.add_argument( '--rest-hr', type = float, default = 60., help = 'heart rate at rest, for the training load' )
+  parser.add_argument( '--max-hr', type = float, default = 190., help = 'maximum heart rate, for the training load' )
+  parser.add_argument( '--weeks', type = int, default = 6, help = 'weeks of best efforts used for the race prediction' )
+  parser.add_argument( '--dem', default = None, help = 'folder of SRTM .hgt elevation tiles, for the ascent from the ground elevation' )
+  parser.add_argument( '--restart', action = 'store_true', help = 'forget the journal of the previous job' )
+  parser.add_argument( '--retry-errors', action = 'store_true', help = 'decode again the inputs which failed before' )
+  args = parser.parse_args()
+
+  outdir = args.outdir
   if outdir == "": outdir = "."
   elif not os.path.isdir( outdir ):
     logging.warning('Output folder: ' + outdir + ' NOT found. Create one now! ')
     os.makedirs( outdir )
 
 
-  rrf = read_sequence( sys.argv[1] )
-  print 'Reading input: ', sys.argv[1], '.'
+  rrf = read_sequence( args.input, cache_dir = outdir + "/cache", journal_name = outdir + "/journal.jsonl",
+    restart = args.restart, retry_errors = args.retry_errors, timeout = args.timeout, jobs = args.jobs,
+    dedup = not args.keep_duplicates, prefer_sources = [ p for p in args.prefer.split( ',' ) if p ],
+    sports = [ p for p in args.sports.split( ',' ) if p ] or None, guess_sport = not args.no_sport_guess,
+    index_mode = args.index and not args.compare ) # the comparison needs the records
+  print 'Reading input: ', args.input, '.'
   if rrf.size() <= 0:
-    print 'input ', sys.argv[1], ' not correct.'
+    print 'input ', args.input, ' not correct.'
     return None
 
   print 'Start writing summary to: ', outdir, '!'
-  write_summary(rrf, outdir )
-
-  print 'Start making plots to: ', outdir, '.'
-  draw(rrf, outdir )
+  write_outputs(rrf, outdir, exports = args.export, plots = not args.no_plots, compare = args.compare,
+    rest_hr = args.rest_hr, max_hr = args.max_hr, weeks = args.weeks, dem = args.dem )
       
 
 if __name__ == '__main__' : 
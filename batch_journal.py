@@ -0,0 +1,91 @@
+## @package batch_journal
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Journal of the outcome of each input file in a batch job, used to resume an interrupted job. \par
+#
+#  @detail
+#    Every processed .fit file gets one line in a JSON lines file as soon as it is done: "ok" if the run is
+#    kept, "rejected" if it fails the selection, "error" (with the traceback) or "timeout" if it could not be
+#    decoded. A job started again with the same journal skips the files already done, as long as they are
+#    not modified in between. \par
+#
+
+import os
+import json
+import time
+import logging
+from run_cache import file_stamp
+
+class batch_journal:
+  '''Document for class batch_journal
+
+    Purpose: record the outcome of each input file of a batch job, and find the outcome of a previous job.
+    Example:
+      journal = batch_journal( "out/journal.jsonl" )
+      if journal.getStatus( "a.fit" ) is None:
+        ... process a.fit ...
+        journal.record( "a.fit", "ok" )
+  '''
+
+  statuses = ( "ok", "rejected", "error", "timeout" )
+
+  def __init__(self, journal_name, restart = False ):
+    '''Constructor of class batch_journal.
+      Parameter journal_name: the JSON lines file of the journal, created if not found.
+      Parameter restart: forget the outcomes of the previous jobs.
+    '''
+    self._journal_name = journal_name
+    self._entries = { } # file name -> last entry of the file
+    if restart and os.path.isfile( journal_name ):
+      os.remove( journal_name )
+    if os.path.isfile( journal_name ):
+      with open( journal_name ) as fp:
+        for line in fp:
+          try:
+            entry = json.loads( line )
+          except ValueError:
+            # the last line of a killed job may be cut in the middle
+            logging.warning( ' Journal ' + journal_name + ' has a broken line. Ignore it. ')
+            continue
+          self._entries[ entry[ "file" ] ] = entry
+    self._fp = open( journal_name, "a" )
+
+  def getStatus(self, ffitname ):
+    '''Get the outcome of the file from a previous job, None if not done or modified since.
+    '''
+    entry = self._entries.get( ffitname )
+    if entry is None or not os.path.isfile( ffitname ):
+      return None
+    if tuple( entry[ "stamp" ] ) != file_stamp( ffitname ):
+      return None
+    return entry[ "status" ]
+
+  def getMessage(self, ffitname ):
+    '''Get the message (e.g. the traceback of an error) recorded with the outcome of the file.
+    '''
+    entry = self._entries.get( ffitname )
+    return None if entry is None else entry.get( "message" )
+
+  def record(self, ffitname, status, message = None ):
+    '''Record the outcome of one file, written to disk right away.
+    '''
+    if status not in self.statuses:
+      logging.error( ' Unknown status ' + status + ' of input ' + ffitname + '. Use one of: ' + ', '.join( self.statuses ) )
+      return None
+    if self._fp.closed:
+      # e.g. a run added to a read_sequence after its first batch
+      self._fp = open( self._journal_name, "a" )
+    entry = { "file": ffitname, "status": status, "message": message, "time": time.time(),
+              "stamp": list( file_stamp( ffitname ) ) if os.path.isfile( ffitname ) else None }
+    self._entries[ ffitname ] = entry
+    self._fp.write( json.dumps( entry ) + "\n" )
+    self._fp.flush()
+
+  def count(self, status ):
+    '''Get the number of files with the given outcome.
+    '''
+    return sum( 1 for entry in self._entries.values() if entry[ "status" ] == status )
+
+  def close(self):
+    self._fp.close()
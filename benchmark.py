@@ -0,0 +1,77 @@
+## @package benchmark
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Timing of the start-up and of the main jobs, to follow the speed of the analysis. \par
+#
+#  @detail
+#    Each case runs in a fresh interpreter, since the import time is a large part of a short job, and is
+#    repeated a few times to keep the fastest one. \par
+#
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+#
+# case name -> python code timed in a fresh interpreter
+#
+_import_cases = [
+  ( "import run_record",                      "import run_record" ),
+  ( "import read_fit (no plot)",              "import read_fit" ),
+  ( "import anal (no plot)",                  "import anal" ),
+  ( "import anal + matplotlib.pyplot",        "import anal; anal.plt.figure" ),
+]
+
+def _time_code( code, repeat ):
+  '''Fastest wall time in seconds of the code in a fresh interpreter.'''
+  best = None
+  here = os.path.dirname( os.path.abspath( __file__ ) )
+  for idx in range( repeat ):
+    start = time.time()
+    subprocess.check_call( [ sys.executable, "-c", code ], cwd = here )
+    elapsed = time.time() - start
+    if best is None or elapsed < best: best = elapsed
+  return best
+
+def _time_job( script, inputs, options, repeat ):
+  '''Fastest wall time in seconds of a job writing to a new temporary folder.'''
+  best = None
+  here = os.path.dirname( os.path.abspath( __file__ ) )
+  for idx in range( repeat ):
+    outdir = tempfile.mkdtemp()
+    start = time.time()
+    with open( os.devnull, "w" ) as devnull:
+      subprocess.check_call( [ sys.executable, os.path.join( here, script ), inputs, outdir ] + options,
+        stdout = devnull, stderr = devnull )
+    elapsed = time.time() - start
+    shutil.rmtree( outdir )
+    if best is None or elapsed < best: best = elapsed
+  return best
+
+def main():
+  '''
+    Example: python benchmark.py [--fit data/test.fit] [--repeat 5]
+  '''
+  parser = argparse.ArgumentParser( description = 'Timing of the start-up and of the main jobs.' )
+  parser.add_argument( '--fit', default = 'data/test.fit', help = 'the *fit* input of the single run jobs' )
+  parser.add_argument( '--repeat', type = int, default = 5, help = 'number of times each case is run' )
+  args = parser.parse_args()
+
+  results = [ ]
+  for name, code in _import_cases:
+    results.append( ( name, _time_code( code, args.repeat ) ) )
+  fit = os.path.abspath( args.fit )
+  results.append( ( "read_fit.py --no-plots", _time_job( "read_fit.py", fit, [ "--no-plots" ], args.repeat ) ) )
+  results.append( ( "read_fit.py with plots", _time_job( "read_fit.py", fit, [ ], args.repeat ) ) )
+
+  for name, elapsed in results:
+    print( " %-40s %8.1f ms" % ( name, elapsed * 1000. ) )
+
+if __name__ == '__main__' :
+
+  main()
@@ -0,0 +1,76 @@
+## @package check_outputs
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Check that all the outputs of anal.py are made for a series of runs which did not all measure the
+#         same quantities. \par
+#
+#  @detail
+#    The quantities a run did not measure are None in its summary and in the lists of read_sequence. A
+#    series of two runs is made from the summary of a .fit file: the first run with heart rate and altitude,
+#    the second one a day later without them (no heart rate strap, no barometer). The summaries, the plots
+#    and the elevation table are written for it to a temporary folder. \par
+#
+#    Example: python2.7 check_outputs.py data/test.fit
+#
+
+import os
+import sys
+import shutil
+import datetime
+import tempfile
+import traceback
+from run_record import run_record
+from read_sequence import read_sequence
+from elevation import dem_tiles
+import anal
+
+def mixed_series( ffitname, folder ):
+  '''read_sequence of two runs from the summary of ffitname: with heart rate and altitude, then without.'''
+  summary = run_record( ffitname ).getSummary()
+  measured = dict( summary )
+  measured.update( { "FileName": os.path.join( folder, "measured.fit" ),
+                     "MinimumHeartRate": 120., "MaximumHeartRate": 172., "AverageHeartRate": 151. } )
+  if measured.get( "AscendMeters" ) is None:
+    measured.update( { "AverageAltitude": 250., "AscendMeters": 60., "DescendMeters": 60. } )
+  missing = dict( summary )
+  missing.update( { "FileName": os.path.join( folder, "missing.fit" ),
+                    "StartTime": summary[ "StartTime" ] + datetime.timedelta( days = 1 ),
+                    "EndTime": summary[ "EndTime" ] + datetime.timedelta( days = 1 ) } )
+  for name in [ "MinimumHeartRate", "MaximumHeartRate", "AverageHeartRate", "AverageAltitude", "AscendMeters", "DescendMeters" ]:
+    missing[ name ] = None
+  # the cache keys on the files: both runs are copies of ffitname
+  for run in [ measured, missing ]:
+    shutil.copy( ffitname, run[ "FileName" ] )
+  empty = os.path.join( folder, "inputs" )
+  os.makedirs( empty )
+  seq = read_sequence( empty )
+  # the first run fixes the measured list, as in a decoded series
+  seq._addSummary( measured, source = "full" )
+  seq._addSummary( missing, source = "full" )
+  return seq
+
+def main():
+  '''Write all the outputs of a mixed series, return the number of failed steps.'''
+  ffitname = sys.argv[1] if len( sys.argv ) > 1 else "data/test.fit"
+  folder = tempfile.mkdtemp( prefix = "check_outputs_" )
+  failed = 0
+  try:
+    seq = mixed_series( ffitname, folder )
+    for name, step in [ ( "summary", lambda: anal.write_summary( seq, folder ) ),
+                        ( "training load", lambda: anal.write_training_load( seq, folder ) ),
+                        ( "plots", lambda: anal.draw( seq, folder ) ),
+                        ( "elevation", lambda: anal.write_elevation( seq, folder, dem_tiles( folder ) ) ) ]:
+      try:
+        step()
+        print " %-15s OK" % name
+      except Exception:
+        failed += 1
+        print " %-15s FAILED" % name
+        traceback.print_exc()
+  finally:
+    shutil.rmtree( folder )
+  return failed
+
+if __name__ == '__main__' :
+  sys.exit( main() )
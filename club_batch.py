@@ -0,0 +1,540 @@
+## @package club_batch
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Analyze the archives of all the athletes of a club at once: the outputs of anal.py for each athlete,
+#         and a club rollup, with the work shared by processes of one or of several machines. \par
+#
+#  @detail
+#    The club folder holds one folder of *fit* files per athlete. The work is a plan of tasks kept in a queue
+#    folder, which only needs a file system shared by all the workers (e.g. NFS):
+#      * decode shards: the files of all the athletes, split into shards of about the same number of bytes
+#        (longest processing time first: the largest file goes to the lightest shard), so the files of one
+#        athlete with a big archive are spread over many shards. A shard decodes its files into the cache of
+#        their athlete, with the per-file products (best efforts, intervals, histograms, efficiency), and
+#        writes the outcomes to a journal of its own.
+#      * athlete reports, once all the shards holding files of the athlete are done: the journals of the
+#        shards are added to the journal of the athlete and anal.write_outputs() runs from the cache.
+#      * the club rollup, once all the reports are done.
+#    A worker takes the first task whose dependencies are done by creating its lease file (O_CREAT | O_EXCL,
+#    atomic also on NFS), renews it while working, and writes a done file at the end. A lease not renewed
+#    for --lease seconds (a killed worker) is taken over by the next worker. A task may then run twice, which
+#    is harmless: every output is written through a temporary file or rewritten as a whole.
+#    The queue folder is named from the list of files with their sizes and modification times: the same
+#    command started on each machine joins the same plan, and new runs later give a new plan, which only
+#    decodes the new files (the caches and journals are kept per athlete). The cache entries are keyed by
+#    the absolute path of the files, so the club folder should be mounted at the same path on all machines. \par
+#
+
+import os
+import json
+import time
+import errno
+import heapq
+import socket
+import hashlib
+import logging
+import argparse
+import threading
+import traceback
+import multiprocessing
+from collections import OrderedDict
+import datetime
+from read_sequence import read_sequence
+from batch_journal import batch_journal
+from export_summary import write_table
+from race_predictor import race_distances
+from elevation import dem_tiles
+from aggregates import summary_state
+import anal
+
+_queue_folder = "_queue"
+
+def list_athletes( club_input ):
+  '''The *fit* files of each athlete: dictionary of athlete (folder name) -> sorted list of files.'''
+  athletes = { }
+  for athlete in sorted( os.listdir( club_input ) ):
+    folder = club_input + "/" + athlete
+    if not os.path.isdir( folder ) or athlete.startswith( "." ):
+      continue
+    # the same files as read_sequence takes from the folder
+    files = sorted( folder + "/" + f for f in os.listdir( folder ) if ".fit" in f )
+    if len( files ) <= 0:
+      logging.warning( ' Athlete folder ' + folder + ' has no fit file. Skip! ')
+      continue
+    athletes[ athlete ] = files
+  return athletes
+
+def balance_shards( sizes, shards ):
+  '''Split items into shards of about the same total size: the largest item goes to the lightest shard.
+
+    Parameters:
+    -- sizes   list of ( item, size in bytes ).
+    -- shards  number of shards.
+
+    Return: list of shards, each a list of items, the heaviest shard first. No empty shard.
+  '''
+  shards = max( 1, min( shards, len( sizes ) ) )
+  heap = [ ( 0, idx ) for idx in range( shards ) ]
+  content = [ [ ] for idx in range( shards ) ]
+  totals = [ 0 ] * shards
+  for item, size in sorted( sizes, key = lambda pair: -pair[1] ):
+    total, idx = heapq.heappop( heap )
+    content[ idx ].append( item )
+    totals[ idx ] = total + size
+    heapq.heappush( heap, ( totals[ idx ], idx ) )
+  order = sorted( range( shards ), key = lambda idx: -totals[ idx ] )
+  return [ content[ idx ] for idx in order if content[ idx ] ]
+
+def make_plan( athletes, shards, options ):
+  '''Tasks of the club: decode shards, athlete reports and the rollup, each with its dependencies.
+
+    Parameters:
+    -- athletes  list_athletes().
+    -- shards    number of decode shards.
+    -- options   the options of read_sequence and anal.write_outputs, kept in the plan for all the workers.
+  '''
+  sizes = [ ( ( athlete, ffitname ), os.path.getsize( ffitname ) ) for athlete, files in athletes.items() for ffitname in files ]
+  tasks = [ ]
+  holding = dict( ( athlete, [ ] ) for athlete in athletes )
+  for idx, content in enumerate( balance_shards( sizes, shards ) ):
+    task_id = "shard%04d" % idx
+    tasks.append( { "id": task_id, "kind": "shard", "after": [ ], "files": content,
+                    "bytes": sum( os.path.getsize( ffitname ) for athlete, ffitname in content ) } )
+    for athlete in set( athlete for athlete, ffitname in content ):
+      holding[ athlete ].append( task_id )
+  # the biggest archives first, their report is the longest
+  volume = lambda athlete: -sum( os.path.getsize( ffitname ) for ffitname in athletes[ athlete ] )
+  for athlete in sorted( athletes, key = volume ):
+    tasks.append( { "id": "report_" + athlete, "kind": "report", "after": holding[ athlete ], "athlete": athlete } )
+  tasks.append( { "id": "rollup", "kind": "rollup", "after": [ task[ "id" ] for task in tasks if task[ "kind" ] == "report" ] } )
+  return { "options": options, "tasks": tasks }
+
+def plan_key( athletes ):
+  '''Name of the queue of a list of files, changed by any new, removed or modified file.'''
+  digest = hashlib.sha1()
+  for athlete in sorted( athletes ):
+    for ffitname in athletes[ athlete ]:
+      st = os.stat( ffitname )
+      digest.update( ( "%s %d %d\n" % ( os.path.abspath( ffitname ), st.st_size, int( st.st_mtime ) ) ).encode( 'utf-8' ) )
+  return digest.hexdigest()[ :12 ]
+
+class work_queue:
+  '''Document for class work_queue
+
+    Purpose: share the tasks of a plan between workers through a folder, with lease files.
+    Example:
+      queue = work_queue( "out/_queue/1a2b3c", lease_seconds = 300. )
+      queue.create( plan )           # kept if another worker made it first
+      task = queue.claim()
+      if task is not None:
+        ... run the task, calling queue.renew( task[ "id" ] ) more often than every lease_seconds ...
+        queue.complete( task[ "id" ], { "status": "ok" } )
+  '''
+
+  def __init__(self, queue_dir, lease_seconds = 300. ):
+    self._queue_dir = queue_dir
+    self._lease_seconds = lease_seconds
+    self._owner = "%s:%d" % ( socket.gethostname(), os.getpid() )
+    self._plan = None
+    if not os.path.isdir( queue_dir ):
+      try:
+        os.makedirs( queue_dir )
+      except OSError as err:
+        if err.errno != errno.EEXIST: raise # made by another worker in between
+
+  def _path(self, task_id, ext ):
+    return os.path.join( self._queue_dir, task_id + ext )
+
+  def create(self, plan ):
+    '''Write the plan unless there is one already. Return the plan of the queue.'''
+    name = os.path.join( self._queue_dir, "plan.json" )
+    if not os.path.isfile( name ):
+      tmp = name + "." + self._owner + ".tmp"
+      with open( tmp, "w" ) as fp:
+        json.dump( plan, fp )
+      try:
+        os.link( tmp, name ) # fails if another worker wrote its plan first
+      except OSError as err:
+        if err.errno != errno.EEXIST: raise
+      os.remove( tmp )
+    return self.getPlan()
+
+  def getPlan(self):
+    ''' Return the plan of the queue, None if not created '''
+    if self._plan is None:
+      name = os.path.join( self._queue_dir, "plan.json" )
+      if not os.path.isfile( name ):
+        return None
+      with open( name ) as fp:
+        self._plan = json.load( fp )
+    return self._plan
+
+  def getOutcome(self, task_id ):
+    ''' Return the outcome written by complete(), None if the task is not done '''
+    name = self._path( task_id, ".done" )
+    if not os.path.isfile( name ):
+      return None
+    with open( name ) as fp:
+      return json.load( fp )
+
+  def isDone(self, task_id ):
+    return os.path.isfile( self._path( task_id, ".done" ) )
+
+  def finished(self):
+    ''' Return True if all the tasks of the plan are done '''
+    return all( self.isDone( task[ "id" ] ) for task in self.getPlan()[ "tasks" ] )
+
+  def _acquire(self, task_id ):
+    '''Create the lease of the task, or take over an expired one. Return True if the lease is ours.'''
+    name = self._path( task_id, ".lease" )
+    for attempt in range( 2 ):
+      try:
+        fd = os.open( name, os.O_CREAT | os.O_EXCL | os.O_WRONLY )
+      except OSError as err:
+        if err.errno != errno.EEXIST: raise
+        try:
+          expired = time.time() - os.path.getmtime( name ) > self._lease_seconds
+        except OSError:
+          continue # released in between
+        if not expired or attempt > 0:
+          return False
+        # only one of the workers finding the expired lease can move it away
+        stale = name + "." + self._owner + ".stale"
+        try:
+          os.rename( name, stale )
+        except OSError:
+          return False
+        logging.warning( ' Lease of task ' + task_id + ' expired. Take it over. ')
+        os.remove( stale )
+        continue
+      os.write( fd, self._owner.encode( 'utf-8' ) )
+      os.close( fd )
+      return True
+    return False
+
+  def claim(self):
+    '''Lease the first task not done whose dependencies are done. Return the task, None if none is ready.'''
+    for task in self.getPlan()[ "tasks" ]:
+      if self.isDone( task[ "id" ] ):
+        continue
+      if not all( self.isDone( task_id ) for task_id in task[ "after" ] ):
+        continue
+      if self._acquire( task[ "id" ] ):
+        if self.isDone( task[ "id" ] ): # done by the previous owner of the lease
+          self._release( task[ "id" ] )
+          continue
+        return task
+    return None
+
+  def renew(self, task_id ):
+    '''Tell the other workers that the task is still running. Return False if the lease is no longer ours.'''
+    name = self._path( task_id, ".lease" )
+    try:
+      with open( name ) as fp:
+        if fp.read() != self._owner:
+          return False
+      os.utime( name, None )
+    except (IOError, OSError):
+      return False
+    return True
+
+  def _release(self, task_id ):
+    try:
+      os.remove( self._path( task_id, ".lease" ) )
+    except OSError:
+      pass
+
+  def complete(self, task_id, outcome ):
+    '''Write the outcome of the task (a dictionary) as its done file, and release the lease.'''
+    outcome = dict( outcome, worker = self._owner )
+    name = self._path( task_id, ".done" )
+    with open( name + "." + self._owner + ".tmp", "w" ) as fp:
+      json.dump( outcome, fp )
+    os.rename( name + "." + self._owner + ".tmp", name )
+    self._release( task_id )
+
+class _heartbeat( threading.Thread ):
+  '''Renew the lease of a task every third of the lease time, until stopped.'''
+
+  def __init__(self, queue, task_id, interval ):
+    threading.Thread.__init__( self )
+    self.daemon = True
+    self._queue = queue
+    self._task_id = task_id
+    self._interval = interval
+    self._stopped = threading.Event()
+
+  def run(self):
+    while not self._stopped.wait( self._interval ):
+      if not self._queue.renew( self._task_id ):
+        logging.warning( ' Lease of task ' + self._task_id + ' taken over by another worker. ')
+        return
+
+  def stop(self):
+    self._stopped.set()
+    self.join()
+
+def _sequence_options( options ):
+  '''Options of read_sequence from the options of the plan.'''
+  return dict( ( name, options[ name ] ) for name in
+               [ "timeout", "prefer_sources", "sports", "guess_sport", "index_mode" ] )
+
+def _athlete_dir( outdir, athlete ):
+  folder = outdir + "/" + athlete
+  if not os.path.isdir( folder ):
+    try:
+      os.makedirs( folder )
+    except OSError as err:
+      if err.errno != errno.EEXIST: raise
+  return folder
+
+def run_shard( task, club_input, outdir, options, queue_dir ):
+  '''Decode the files of a shard into the caches of their athletes, with the per-file products.'''
+  runs = 0
+  by_athlete = OrderedDict()
+  for athlete, ffitname in task[ "files" ]:
+    by_athlete.setdefault( athlete, [ ] ).append( ffitname )
+  for athlete, files in by_athlete.items():
+    folder = _athlete_dir( outdir, athlete )
+    if not os.path.isdir( folder + "/journals" ):
+      try:
+        os.makedirs( folder + "/journals" )
+      except OSError as err:
+        if err.errno != errno.EEXIST: raise
+    # the files done by a previous plan are in the journal of the athlete
+    journal = batch_journal( folder + "/journal.jsonl" )
+    files = [ ffitname for ffitname in files if journal.getStatus( ffitname ) is None ]
+    journal.close()
+    if len( files ) <= 0:
+      continue
+    listname = os.path.join( queue_dir, task[ "id" ] + "_" + hashlib.sha1( athlete.encode( 'utf-8' ) ).hexdigest()[ :8 ] + ".txt" )
+    with open( listname, "w" ) as fp:
+      fp.write( "".join( ffitname + "\n" for ffitname in files ) )
+    # duplicates are dropped by the report, among all the files of the athlete
+    seq = read_sequence( listname, cache_dir = folder + "/cache", journal_name = folder + "/journals/" + task[ "id" ] + ".jsonl",
+                         dedup = False, **_sequence_options( options ) )
+    if seq.size() > 0 and not options[ "index_mode" ]:
+      seq.getBestEfforts()
+      seq.getIntervals()
+      seq.getPooledHistograms()
+      seq.getEfficiency()
+      if options.get( "dem" ):
+        seq.getCorrectedClimb( dem_tiles( options[ "dem" ] ) )
+    runs += seq.size()
+  return { "status": "ok", "runs": runs, "files": len( task[ "files" ] ), "bytes": task[ "bytes" ] }
+
+def _merge_journals( folder ):
+  '''Add the journals of the decode shards to the journal of the athlete.'''
+  journals = folder + "/journals"
+  if not os.path.isdir( journals ):
+    return None
+  with open( folder + "/journal.jsonl", "a" ) as out:
+    for name in sorted( os.listdir( journals ) ):
+      if not name.endswith( ".jsonl" ): continue
+      with open( journals + "/" + name ) as fp:
+        for line in fp:
+          if line.endswith( "\n" ): out.write( line ) # a line cut by a killed worker is dropped
+      os.remove( journals + "/" + name )
+
+def athlete_rollup( athlete, seq, load, prediction ):
+  '''Totals of one athlete for the club rollup, as plain JSON values.'''
+  summaries = seq.getSummaries()
+  row = OrderedDict()
+  row[ "Athlete" ] = athlete
+  row[ "Runs" ] = len( summaries )
+  distances = [ summary[ "TotalDistanceKm" ] or 0. for summary in summaries ]
+  moving = [ summary[ "TotalTimeMoving" ].total_seconds() for summary in summaries if summary[ "TotalTimeMoving" ] is not None ]
+  starts = sorted( summary[ "StartTime" ] for summary in summaries if summary[ "StartTime" ] is not None )
+  row[ "TotalDistanceKm" ] = sum( distances )
+  row[ "LongestRunKm" ] = max( distances ) if distances else 0.
+  row[ "TotalTimeMovingSeconds" ] = sum( moving )
+  row[ "AveragePaceKm" ] = sum( moving ) / 60. / sum( distances ) if sum( distances ) > 0. else None
+  row[ "FirstRun" ] = starts[0].isoformat() if starts else None
+  row[ "LastRun" ] = starts[-1].isoformat() if starts else None
+  for name, distance in race_distances:
+    seconds = prediction[1][ name ][-1] if prediction is not None else float( 'nan' )
+    row[ "Predicted" + name + "Seconds" ] = float( seconds ) if seconds == seconds else None
+  days = load.getDays() if load is not None else [ ]
+  row[ "AcuteLoad" ] = float( load.getAcuteLoad()[-1] ) if days else None
+  row[ "ChronicLoad" ] = float( load.getChronicLoad()[-1] ) if days else None
+  monthly = { }
+  for summary in summaries:
+    if summary[ "StartTime" ] is None: continue
+    month = summary[ "StartTime" ].strftime( "%Y-%m" )
+    monthly[ month ] = monthly.get( month, 0. ) + ( summary[ "TotalDistanceKm" ] or 0. )
+  row[ "MonthlyKm" ] = monthly
+  return row
+
+def run_report( task, club_input, outdir, options ):
+  '''Write the outputs of anal.py for one athlete, from the cache filled by the shards.'''
+  athlete = task[ "athlete" ]
+  folder = _athlete_dir( outdir, athlete )
+  _merge_journals( folder )
+  seq = read_sequence( club_input + "/" + athlete, cache_dir = folder + "/cache", journal_name = folder + "/journal.jsonl",
+                       dedup = options[ "dedup" ], **_sequence_options( options ) )
+  load, prediction = None, None
+  if seq.size() > 0:
+    load, prediction = anal.write_outputs( seq, folder, exports = options[ "exports" ], plots = options[ "plots" ],
+      rest_hr = options[ "rest_hr" ], max_hr = options[ "max_hr" ], weeks = options[ "weeks" ], dem = options.get( "dem" ) )
+  else:
+    logging.error( ' No run found for athlete ' + athlete + '. ')
+  rollup = athlete_rollup( athlete, seq, load, prediction )
+  with open( folder + "/athlete_rollup.json.tmp", "w" ) as fp:
+    json.dump( rollup, fp )
+  os.rename( folder + "/athlete_rollup.json.tmp", folder + "/athlete_rollup.json" )
+  return { "status": "ok", "runs": seq.size() }
+
+def write_club_rollup( outdir, athletes, queue ):
+  '''Write the club tables: one row per athlete, the club distance per month, and the balance of the shards.'''
+  rows = [ ]
+  for athlete in sorted( athletes ):
+    name = outdir + "/" + athlete + "/athlete_rollup.json"
+    if not os.path.isfile( name ):
+      logging.error( ' No rollup of athlete ' + athlete + '. Skip! ')
+      continue
+    with open( name ) as fp:
+      rows.append( json.load( fp, object_pairs_hook = OrderedDict ) )
+  if len( rows ) <= 0:
+    logging.error( ' No athlete to roll up. Return! ')
+    return None
+  rows.sort( key = lambda row: -row[ "TotalDistanceKm" ] )
+
+  f = open( outdir + "/club_summary.txt", "w" )
+  f.write( "Number of athletes: %d \n" % len( rows ) )
+  f.write( "Number of runs: %d \n" % sum( row[ "Runs" ] for row in rows ) )
+  f.write( " the total distance is: %.1f km. \n" % sum( row[ "TotalDistanceKm" ] for row in rows ) )
+  f.write( " the total time moving in h:m:s is: %s\n" % datetime.timedelta( seconds = int( sum( row[ "TotalTimeMovingSeconds" ] for row in rows ) ) ) )
+  f.write( "# athlete  runs  km  moving(h:m:s)  pace(per Km)  5Km  10Km  acute  chronic  last run\n" )
+  clock = lambda seconds: "%s" % datetime.timedelta( seconds = int( seconds ) ) if seconds is not None else "-"
+  for row in rows:
+    f.write( " %s  %d  %.1f  %s  %s  %s  %s  %s  %s  %s\n" % ( row[ "Athlete" ], row[ "Runs" ], row[ "TotalDistanceKm" ],
+      clock( row[ "TotalTimeMovingSeconds" ] ), clock( row[ "AveragePaceKm" ] * 60. if row[ "AveragePaceKm" ] else None ),
+      clock( row[ "Predicted5KmSeconds" ] ), clock( row[ "Predicted10KmSeconds" ] ),
+      "%.0f" % row[ "AcuteLoad" ] if row[ "AcuteLoad" ] is not None else "-",
+      "%.0f" % row[ "ChronicLoad" ] if row[ "ChronicLoad" ] is not None else "-", ( row[ "LastRun" ] or "-" )[ :10 ] ) )
+
+  monthly = { }
+  for row in rows:
+    for month, km in row[ "MonthlyKm" ].items():
+      total, active = monthly.get( month, ( 0., 0 ) )
+      monthly[ month ] = ( total + km, active + 1 )
+  f.write( "# month  club km  athletes running\n" )
+  for month in sorted( monthly ):
+    f.write( " %s  %.1f  %d\n" % ( month, monthly[ month ][0], monthly[ month ][1] ) )
+
+  shards = [ queue.getOutcome( task[ "id" ] ) for task in queue.getPlan()[ "tasks" ] if task[ "kind" ] == "shard" ]
+  shards = [ outcome for outcome in shards if outcome is not None and outcome.get( "status" ) == "ok" ]
+  if shards:
+    f.write( "# decode shards: %d, Mbytes per shard %.1f to %.1f, seconds per shard %.1f to %.1f\n" % ( len( shards ),
+      min( s[ "bytes" ] for s in shards ) / 1e6, max( s[ "bytes" ] for s in shards ) / 1e6,
+      min( s[ "seconds" ] for s in shards ), max( s[ "seconds" ] for s in shards ) ) )
+  f.close()
+
+  table = [ OrderedDict( ( name, value ) for name, value in row.items() if name != "MonthlyKm" ) for row in rows ]
+  write_table( table, outdir + "/club_athletes.csv", "csv" )
+
+  # the summary of all the runs of the club, from the summary states of the athletes (different files)
+  club = summary_state()
+  for row in rows:
+    name = outdir + "/" + row[ "Athlete" ] + "/summary_state.json"
+    if os.path.isfile( name ) and club.merge( summary_state( name ) ) is None:
+      logging.error( ' Summary state of athlete ' + row[ "Athlete" ] + ' could not be merged. Skip! ')
+  if club.size() > 0:
+    anal.render_summary( club, outdir + "/club_runs_summary.txt" )
+  return rows
+
+def work( club_input, outdir, queue_dir, lease_seconds = 300., poll = 5. ):
+  '''Run the tasks of the queue until all are done. Return the number of tasks run by this worker.'''
+  queue = work_queue( queue_dir, lease_seconds )
+  plan = queue.getPlan()
+  options = plan[ "options" ]
+  done = 0
+  while True:
+    task = queue.claim()
+    if task is None:
+      if queue.finished(): break
+      time.sleep( poll ) # waiting for the dependencies, or for the tasks leased by other workers
+      continue
+    logging.info( ' Worker %d runs task %s ', os.getpid(), task[ "id" ] )
+    beat = _heartbeat( queue, task[ "id" ], lease_seconds / 3. )
+    beat.start()
+    start = time.time()
+    try:
+      if task[ "kind" ] == "shard":
+        outcome = run_shard( task, club_input, outdir, options, queue_dir )
+      elif task[ "kind" ] == "report":
+        outcome = run_report( task, club_input, outdir, options )
+      else:
+        write_club_rollup( outdir, list_athletes( club_input ), queue )
+        outcome = { "status": "ok" }
+    except Exception:
+      # done anyway: the tasks after it still run, with what is there
+      logging.error( ' Task ' + task[ "id" ] + ' failed: ' + traceback.format_exc() )
+      outcome = { "status": "error", "message": traceback.format_exc() }
+    finally:
+      beat.stop()
+    outcome[ "seconds" ] = time.time() - start
+    queue.complete( task[ "id" ], outcome )
+    done += 1
+  return done
+
+def main():
+  '''
+    Example: python club_batch.py club_dir out_dir --jobs 4
+    Note:    this example is tested with python version 2.7
+    Argu:  club_dir  one folder of *fit* files per athlete.
+           out_dir   the output folder: out_dir/<athlete> gets the outputs of anal.py for the athlete, out_dir gets
+                     club_summary.txt and club_athletes.csv.
+           --jobs    number of worker processes on this machine. The same command started on other machines,
+                     with club_dir and out_dir on a shared file system, adds their workers to the same plan.
+           --shards  number of decode shards, of about the same number of bytes (default: 4 per job).
+  '''
+  parser = argparse.ArgumentParser( description = 'Analyze the runs of all the athletes of a club.' )
+  parser.add_argument( 'input', help = 'folder with one folder of *fit* files per athlete' )
+  parser.add_argument( 'outdir', nargs = '?', default = '.', help = 'output folder, shared by all the workers' )
+  parser.add_argument( '--jobs', type = int, default = 1, help = 'number of worker processes on this machine' )
+  parser.add_argument( '--shards', type = int, default = 0, help = 'number of decode shards, 0: 4 per job' )
+  parser.add_argument( '--lease', type = float, default = 300., help = 'seconds without news after which a task is taken over' )
+  parser.add_argument( '--export', action = 'append', default = [ ], help = 'also write the per-run table of each athlete: csv, jsonl or parquet' )
+  parser.add_argument( '--no-plots', action = 'store_true', help = 'only write the summaries, never import matplotlib' )
+  parser.add_argument( '--index', action = 'store_true', help = 'take the summaries from the session messages, do not decode the records' )
+  parser.add_argument( '--sports', default = '', help = 'comma separated sports to keep, e.g. running' )
+  parser.add_argument( '--no-sport-guess', action = 'store_true', help = 'keep the inputs with no sport written' )
+  parser.add_argument( '--keep-duplicates', action = 'store_true', help = 'keep all the copies of an activity' )
+  parser.add_argument( '--prefer', default = '', help = 'comma separated sources to keep first among copies' )
+  parser.add_argument( '--timeout', type = float, default = 120., help = 'time limit in seconds to decode one input' )
+  parser.add_argument( '--rest-hr', type = float, default = 60., help = 'heart rate at rest, for the training load' )
+  parser.add_argument( '--max-hr', type = float, default = 190., help = 'maximum heart rate, for the training load' )
+  parser.add_argument( '--weeks', type = int, default = 6, help = 'weeks of best efforts used for the race prediction' )
+  parser.add_argument( '--dem', default = None, help = 'folder of SRTM .hgt elevation tiles, for the ascent from the ground elevation' )
+  args = parser.parse_args()
+
+  athletes = list_athletes( args.input )
+  if len( athletes ) <= 0:
+    print 'input ', args.input, ' has no athlete folder.'
+    return None
+  outdir = args.outdir
+  queue_dir = outdir + "/" + _queue_folder + "/" + plan_key( athletes )
+  options = { "timeout": args.timeout, "prefer_sources": [ p for p in args.prefer.split( ',' ) if p ],
+              "sports": [ p for p in args.sports.split( ',' ) if p ] or None, "guess_sport": not args.no_sport_guess,
+              "index_mode": args.index, "dedup": not args.keep_duplicates, "exports": args.export,
+              "plots": not args.no_plots, "rest_hr": args.rest_hr, "max_hr": args.max_hr, "weeks": args.weeks,
+              "dem": args.dem }
+  queue = work_queue( queue_dir, args.lease )
+  plan = queue.create( make_plan( athletes, args.shards or 4 * max( 1, args.jobs ), options ) )
+  print 'Club of', len( athletes ), 'athletes, plan of', len( plan[ "tasks" ] ), 'tasks in:', queue_dir
+
+  if args.jobs <= 1:
+    work( args.input, outdir, queue_dir, args.lease )
+  else:
+    workers = [ multiprocessing.Process( target = work, args = ( args.input, outdir, queue_dir, args.lease ) )
+                for idx in range( args.jobs ) ]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join()
+  if queue.isDone( "rollup" ):
+    print 'Club summary written to: ', outdir + "/club_summary.txt"
+
+if __name__ == '__main__' :
+
+  main()
@@ -0,0 +1,105 @@
+## @package compare_runs
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Compare many runs of the same route at the same positions along the route. \par
+#
+#  @detail
+#    The elapsed time, heart rate and pace of each run are resampled on a common grid of distance. All the
+#    runs are interpolated together: their records are put one after the other in one array, shifted so that
+#    the distance keeps increasing from one run to the next, and a single np.interp call resamples all the
+#    grid points of all the runs. From the aligned matrices (one row per run) come the "ghost" gap
+#    of each run to the median run, and the median and percentile band at each position. \par
+#
+
+import numpy as np
+
+def batch_interp( grid, xs, ys ):
+  '''Linear interpolation of many curves on the same grid in one vector operation.
+
+    Parameters:
+    -- grid  increasing numpy array of the positions to interpolate at.
+    -- xs    list of increasing arrays, one per curve.
+    -- ys    list of arrays of the values, one per curve.
+
+    Return: numpy array ( number of curves, len( grid ) ), NaN outside the range of each curve.
+  '''
+  grid = np.asarray( grid, dtype = float )
+  nruns = len( xs )
+  result = np.full( ( nruns, grid.size ), np.nan )
+  lengths = np.array( [ len( x ) for x in xs ], dtype = int )
+  if nruns == 0 or lengths.sum() == 0:
+    return result
+
+  xcat = np.concatenate( [ np.asarray( x, dtype = float ) for x in xs ] )
+  ycat = np.concatenate( [ np.asarray( y, dtype = float ) for y in ys ] )
+  run_id = np.repeat( np.arange( nruns ), lengths )
+  first = np.concatenate( ( [ 0 ], np.cumsum( lengths )[ :-1 ] ) )
+  last = first + lengths - 1
+
+  # shift each curve beyond the previous ones, so that the concatenated positions keep increasing
+  width = max( np.max( xcat ), grid[-1] ) - min( np.min( xcat ), grid[0] ) + 1.
+  xcat = xcat + run_id * width
+  query = grid[ None, : ] + ( np.arange( nruns ) * width )[ :, None ]
+
+  # one interpolation for all the curves, the points between two curves are then masked out
+  values = np.interp( query.ravel(), xcat, ycat ).reshape( nruns, grid.size )
+  valid = ( lengths > 0 )[ :, None ] & ( query >= xcat[ first ][ :, None ] ) & ( query <= xcat[ last ][ :, None ] )
+  values[ ~valid ] = np.nan
+  return values
+
+def align_traces( traces, step = 10., max_distance = None ):
+  '''Resample the elapsed time, heart rate and pace of the runs on a common grid of distance.
+
+    Parameters:
+    -- traces        list of run_record.getTraces() (or read_sequence.getTraces()), one per run.
+    -- step          distance in meters between two grid points.
+    -- max_distance  end of the grid in meters, default the longest run.
+
+    Return: dictionary of "distance" (the grid in meters), and one matrix ( runs, grid ) for each of
+            "time" (elapsed seconds), "pace" (minutes per Km) and "heart_rate" (bpm, NaN if not measured).
+  '''
+  traces = [ tr for tr in traces if tr is not None and "distance" in tr and "time" in tr and len( tr[ "time" ] ) > 1 ]
+  if len( traces ) == 0:
+    return None
+  # the distance of a run never goes down, fix the glitches of the device
+  dists = [ np.maximum.accumulate( np.asarray( tr[ "distance" ], dtype = float ) ) for tr in traces ]
+  if max_distance is None:
+    max_distance = max( d[-1] for d in dists )
+  grid = np.arange( 0., max_distance + step, step )
+
+  aligned = { "distance": grid }
+  aligned[ "time" ] = batch_interp( grid, dists, [ tr[ "time" ] for tr in traces ] )
+  # pace from the time per step of distance, smoother than the pace of each record
+  pace = np.diff( aligned[ "time" ], axis = 1 ) / step * 1000. / 60.
+  aligned[ "pace" ] = np.concatenate( ( pace[ :, :1 ], pace ), axis = 1 )
+  hrs = [ tr[ "heart_rate" ] if "heart_rate" in tr else np.full( len( d ), np.nan ) for tr, d in zip( traces, dists ) ]
+  aligned[ "heart_rate" ] = batch_interp( grid, dists, hrs )
+  return aligned
+
+def ghost_gaps( aligned, reference = None ):
+  '''Time gap in seconds of each run to the reference run at each position, > 0 when behind.
+
+    Parameters:
+    -- aligned    output of align_traces().
+    -- reference  row index of the reference run, default the median time of all the runs at each position.
+  '''
+  times = aligned[ "time" ]
+  if reference is None:
+    ref = _nan_percentile( times, 50. )
+  else:
+    ref = times[ reference ]
+  return times - ref[ None, : ]
+
+def percentile_band( matrix, percentiles = ( 10., 50., 90. ) ):
+  '''Percentiles across the runs at each position of an aligned matrix, one row per percentile.
+  '''
+  return np.array( [ _nan_percentile( matrix, pct ) for pct in percentiles ] )
+
+def _nan_percentile( matrix, pct ):
+  '''Percentile along the runs ignoring NaN, NaN where no run has a value.'''
+  out = np.full( matrix.shape[1], np.nan )
+  valid = np.any( ~np.isnan( matrix ), axis = 0 )
+  if np.any( valid ):
+    out[ valid ] = np.nanpercentile( matrix[ :, valid ], pct, axis = 0 )
+  return out
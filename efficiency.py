@@ -0,0 +1,106 @@
+## @package efficiency
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Aerobic efficiency of each run: efficiency factor, aerobic decoupling and heart rate drift. \par
+#
+#  @detail
+#    * Efficiency factor: average speed (meters per minute) over average heart rate, over the moving time.
+#    * Aerobic decoupling: how much the efficiency factor drops from the first half of the moving time to the
+#      second half, in %. Below 5% the run is seen as aerobically "coupled".
+#    * Heart rate drift: the slope of the heart rate in bpm per hour while the speed stays within 5% of the
+#      median speed of the run, from a linear fit.
+#    The runs are put on a 1 second grid (resample) and stacked into matrices of ( runs, seconds ), so all
+#    the metrics of a block of runs are a few masked array operations, with no loop over the runs. A matrix
+#    is as long as its longest run: the runs are sorted by duration and a block only takes runs at most
+#    twice as long as its shortest one, so the padding is never more than the runs themselves (one 24 hour
+#    activity does not make 255 one hour runs 24 hours long). \par
+#
+
+import warnings
+import numpy as np
+from resample import resample, stack
+
+_moving_speed = 1.6   # m/s, as run_record
+_steady_band = 0.05   # fraction of the median speed for the heart rate drift
+_min_steady = 600     # seconds at steady speed needed for the heart rate drift
+_block = 256          # runs handled together, to bound the size of the matrices
+
+metric_names = [ "EfficiencyFactor", "Decoupling", "HeartRateDrift" ]
+
+def _masked_mean( values, mask ):
+  count = mask.sum( axis = 1 )
+  with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+    return np.where( count > 0, np.where( mask, values, 0. ).sum( axis = 1 ) / count, np.nan )
+
+def _block_metrics( speed, heart, step ):
+  '''The metrics of a block of runs, from the matrices ( runs, grid ) of speed and heart rate.'''
+  with np.errstate( invalid = 'ignore' ):
+    moving = ( speed > _moving_speed ) & ( heart > 0. )
+  count = moving.sum( axis = 1 )
+  order = np.cumsum( moving, axis = 1 )
+  first = moving & ( order <= 0.5 * count[ :, None ] )
+  second = moving & ~first
+
+  with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+    factor = _masked_mean( speed, moving ) * 60. / _masked_mean( heart, moving )
+    factor_1 = _masked_mean( speed, first ) / _masked_mean( heart, first )
+    factor_2 = _masked_mean( speed, second ) / _masked_mean( heart, second )
+    decoupling = ( factor_1 - factor_2 ) / factor_1 * 100.
+
+    # heart rate against time, only where the speed is steady around the median of the run
+    with warnings.catch_warnings():
+      # the runs without heart rate have no moving point
+      warnings.simplefilter( "ignore", RuntimeWarning )
+      median = np.nanmedian( np.where( moving, speed, np.nan ), axis = 1 )
+    steady = moving & ( np.abs( speed - median[ :, None ] ) <= _steady_band * median[ :, None ] )
+    hours = np.arange( speed.shape[1] ) * step / 3600.
+    nsteady = steady.sum( axis = 1 )
+    mean_t = _masked_mean( np.broadcast_to( hours, speed.shape ), steady )
+    mean_h = _masked_mean( heart, steady )
+    dt = np.where( steady, hours[ None, : ] - mean_t[ :, None ], 0. )
+    dh = np.where( steady, heart - mean_h[ :, None ], 0. )
+    drift = ( dt * dh ).sum( axis = 1 ) / ( dt * dt ).sum( axis = 1 )
+    drift = np.where( nsteady * step >= _min_steady, drift, np.nan )
+  return factor, decoupling, drift
+
+def _usable( traces ):
+  return traces is not None and all( name in traces for name in [ "time", "speed", "heart_rate" ] ) and len( traces[ "time" ] ) > 0
+
+def _length_blocks( sizes ):
+  '''Blocks of the indices of the runs, by increasing size: at most _block runs, the longest at most twice
+    the shortest.'''
+  blocks = [ ]
+  for idx in sorted( range( len( sizes ) ), key = lambda idx: sizes[ idx ] ):
+    if not blocks or len( blocks[-1] ) >= _block or sizes[ idx ] > 2 * max( sizes[ blocks[-1][0] ], 1 ):
+      blocks.append( [ ] )
+    blocks[-1].append( idx )
+  return blocks
+
+def efficiency_batch( traces_list, step = 1., max_gap = 10. ):
+  '''Get the efficiency metrics of many runs.
+
+    Parameters:
+    -- traces_list  list of run_record.getTraces() (a dictionary with "time", "speed" and "heart_rate").
+    -- step         seconds of the grid.
+    -- max_gap      pauses longer than this (in seconds) are left out.
+
+    Return: list of dictionaries with the metric_names, None for a metric which can not be calculated
+            (e.g. no heart rate).
+  '''
+  # size of the grid of each run, known before resampling it
+  sizes = [ int( ( traces[ "time" ][-1] - traces[ "time" ][0] ) / step ) + 1 if _usable( traces ) else 0 for traces in traces_list ]
+  results = [ None ] * len( traces_list )
+  for block in _length_blocks( sizes ):
+    grids = [ ]
+    for idx in block:
+      traces = traces_list[ idx ]
+      if _usable( traces ):
+        grids.append( resample( traces[ "time" ], { "speed": traces[ "speed" ], "heart_rate": traces[ "heart_rate" ] },
+                                step, max_gap, "nan" ) )
+      else:
+        grids.append( { "speed": np.zeros( 0 ), "heart_rate": np.zeros( 0 ) } )
+    for idx, values in zip( block, zip( *_block_metrics( stack( grids, "speed" ), stack( grids, "heart_rate" ), step ) ) ):
+      results[ idx ] = dict( ( name, float( value ) if np.isfinite( value ) else None )
+                             for name, value in zip( metric_names, values ) )
+  return results
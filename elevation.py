@@ -0,0 +1,150 @@
+## @package elevation
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Ground elevation of the positions of a run from local elevation tiles (SRTM .hgt files, no network),
+#         and the ascent and descent along the run from it. \par
+#
+#  @detail
+#    * A .hgt tile covers one degree of latitude and longitude, named from its south-west corner (e.g.
+#      N47E008.hgt): a square grid of big-endian int16 meters, 1201 x 1201 (3 arc seconds) or 3601 x 3601
+#      (1 arc second), the first row at the north edge. -32768 marks a void.
+#    * The tiles are decoded when first needed and kept in a least recently used cache shared by all the runs
+#      (dem_tiles), so a series of runs in the same area reads each tile once.
+#    * The positions of a run are grouped by tile (np.unique) and the elevation of all the positions of a tile
+#      is one bilinear interpolation of the 4 grid points around them, as array operations.
+#    * The barometric or GPS altitude of a device drifts and is noisy, and the sum of its ups and downs grows
+#      with the noise. The ground elevation is put on a grid of distance (every 20 m) before summing the
+#      climbs, so that the ascent of a course is the same whatever the device and the recording rate. \par
+#
+
+import os
+import logging
+from collections import OrderedDict
+import numpy as np
+
+void = -32768
+_distance_step = 20. # meters between two points of the elevation profile
+
+def tile_name( lat0, lon0 ):
+  '''Name of the .hgt tile whose south-west corner is at the integer degrees ( lat0, lon0 ).'''
+  return "%s%02d%s%03d.hgt" % ( "N" if lat0 >= 0 else "S", abs( lat0 ), "E" if lon0 >= 0 else "W", abs( lon0 ) )
+
+def read_tile( fname ):
+  '''Decode a .hgt tile: square numpy array of float32 meters, NaN for the voids. None if not a tile.'''
+  size = os.path.getsize( fname )
+  side = int( round( np.sqrt( size / 2 ) ) )
+  if side * side * 2 != size:
+    logging.error( ' Elevation tile ' + fname + ' has %d bytes, not a square grid. Skip! ', size )
+    return None
+  grid = np.fromfile( fname, dtype = '>i2' ).reshape( side, side )
+  return np.where( grid == void, np.nan, grid ).astype( np.float32 )
+
+class dem_tiles:
+  '''Document for class dem_tiles
+
+    Purpose: ground elevation of any position from the .hgt tiles of a folder, with the decoded tiles kept
+    in a least recently used cache shared by all the runs.
+    Example:
+      dem = dem_tiles( "srtm", capacity = 16 )
+      meters = dem.getElevation( latitudes, longitudes )  # NaN where no tile
+      print( dem.getReads() )                              # number of tiles decoded
+  '''
+
+  def __init__(self, folder, capacity = 16 ):
+    '''Constructor of class dem_tiles.
+      Parameter folder: the folder of the .hgt files.
+      Parameter capacity: largest number of decoded tiles kept in memory (26 MB each for 1 arc second).
+    '''
+    self._folder = folder
+    self._capacity = max( 1, capacity )
+    self._tiles = OrderedDict() # ( lat0, lon0 ) -> grid or None if not found, the most recent last
+    self._reads = 0
+
+  def _tile(self, lat0, lon0 ):
+    key = ( lat0, lon0 )
+    if key in self._tiles:
+      grid = self._tiles.pop( key )
+    else:
+      fname = os.path.join( self._folder, tile_name( lat0, lon0 ) )
+      grid = read_tile( fname ) if os.path.isfile( fname ) else None
+      if grid is not None:
+        self._reads += 1
+    self._tiles[ key ] = grid
+    while len( self._tiles ) > self._capacity:
+      self._tiles.popitem( last = False )
+    return grid
+
+  def getElevation(self, latitude, longitude ):
+    '''Ground elevation in meters of each position (degrees), bilinear between the grid points. NaN without
+      tile, position or in a void.
+    '''
+    latitude = np.asarray( latitude, dtype = float )
+    longitude = np.asarray( longitude, dtype = float )
+    elevation = np.full( latitude.shape, np.nan )
+    known = np.flatnonzero( np.isfinite( latitude ) & np.isfinite( longitude ) )
+    if known.size == 0:
+      return elevation
+    lat0 = np.floor( latitude[ known ] ).astype( int )
+    lon0 = np.floor( longitude[ known ] ).astype( int )
+    corners, inverse = np.unique( np.column_stack( ( lat0, lon0 ) ), axis = 0, return_inverse = True )
+    for idx, ( south, west ) in enumerate( corners ):
+      grid = self._tile( int( south ), int( west ) )
+      if grid is None: continue
+      points = known[ inverse == idx ]
+      last = grid.shape[0] - 1
+      # row 0 is the north edge
+      row = np.clip( ( south + 1 - latitude[ points ] ) * last, 0., last )
+      col = np.clip( ( longitude[ points ] - west ) * last, 0., last )
+      r0 = np.minimum( np.floor( row ).astype( int ), last - 1 )
+      c0 = np.minimum( np.floor( col ).astype( int ), last - 1 )
+      fr, fc = row - r0, col - c0
+      elevation[ points ] = ( grid[ r0, c0 ] * ( 1. - fr ) * ( 1. - fc ) + grid[ r0, c0 + 1 ] * ( 1. - fr ) * fc +
+                              grid[ r0 + 1, c0 ] * fr * ( 1. - fc ) + grid[ r0 + 1, c0 + 1 ] * fr * fc )
+    return elevation
+
+  def getFolder(self):
+    ''' Return the folder of the tiles '''
+    return self._folder
+
+  def getReads(self):
+    ''' Return the number of tiles decoded since the creation '''
+    return self._reads
+
+def climb( elevation, distance, step = _distance_step ):
+  '''Ascent and descent in meters along a profile, from the elevation on a grid of distance.
+
+    Parameters:
+    -- elevation  elevation in meters of each record, NaN where unknown (skipped).
+    -- distance   distance in meters of each record.
+    -- step       meters between two points of the grid.
+
+    Return: ( ascent, descent ), None if fewer than 2 known points.
+  '''
+  elevation = np.asarray( elevation, dtype = float )
+  distance = np.asarray( distance, dtype = float )
+  known = np.isfinite( elevation ) & np.isfinite( distance )
+  if known.sum() < 2:
+    return None
+  elevation, distance = elevation[ known ], np.maximum.accumulate( distance[ known ] )
+  grid = np.arange( distance[0], distance[-1] + step, step )
+  changes = np.diff( np.interp( grid, distance, elevation ) )
+  return float( changes[ changes > 0. ].sum() ), float( -changes[ changes < 0. ].sum() )
+
+def corrected_climb( traces, dem ):
+  '''Ascent and descent of a run from the ground elevation of its positions.
+
+    Parameters:
+    -- traces  run_record.getTraces(), with "latitude", "longitude" and "distance".
+    -- dem     dem_tiles.
+
+    Return: dictionary of "AscendMeters", "DescendMeters" (from the ground elevation), "Coverage" (fraction of
+            the positions with an elevation), None without position or tile.
+  '''
+  if traces is None or "latitude" not in traces or "distance" not in traces:
+    return None
+  elevation = dem.getElevation( traces[ "latitude" ], traces[ "longitude" ] )
+  total = climb( elevation, traces[ "distance" ] )
+  if total is None:
+    return None
+  return { "AscendMeters": total[0], "DescendMeters": total[1], "Coverage": float( np.isfinite( elevation ).mean() ) }
@@ -0,0 +1,80 @@
+## @package export_summary
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Write the per-run summaries of a series of runs into one machine-readable table. \par
+#
+#  @detail
+#    One row per run, one typed column per quantity of run_record.getSummary(). Durations and paces are
+#    written in seconds, time points as ISO 8601 strings of the local time plus a "<name>Epoch" column with
+#    the seconds since 1970-01-01 UTC. The whole table is written in one operation as CSV, JSON lines or,
+#    if pandas is installed, Parquet. \par
+#
+
+import logging
+import csv
+import json
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+_epoch = datetime( 1970, 1, 1 )
+
+# supported formats and the file extensions
+export_formats = { "csv": ".csv", "jsonl": ".jsonl", "parquet": ".parquet" }
+
+def summary_row( summary ):
+  '''Convert the summary of one run into a row of plain numbers and strings.
+
+    Parameters:
+    -- summary  <OrderedDict> from run_record.getSummary().
+  '''
+  row = OrderedDict()
+  utc_offset = timedelta( hours = summary.get( "UtcOffsetHours" ) or 0. )
+  for name, value in summary.items():
+    if isinstance( value, timedelta ):
+      row[ name ] = value.total_seconds()
+    elif isinstance( value, datetime ):
+      row[ name ] = value.isoformat()
+      row[ name + "Epoch" ] = ( value - utc_offset - _epoch ).total_seconds()
+    else:
+      row[ name ] = value
+  return row
+
+def write_table( summaries, outname, fmt = "csv" ):
+  '''Write the summaries of all the runs into one table.
+
+    Parameters:
+    -- summaries  list of <OrderedDict> from run_record.getSummary(), one per run.
+    -- outname    output name of the table.
+    -- fmt        "csv", "jsonl" or "parquet".
+  '''
+  if fmt not in export_formats:
+    logging.error( ' Export format ' + fmt + ' not supported. Use one of: ' + ', '.join( sorted( export_formats ) ) )
+    return None
+  rows = [ summary_row( summary ) for summary in summaries ]
+  if len( rows ) <= 0:
+    logging.error( ' No run to export. Return! ')
+    return None
+
+  # the columns of all the rows, a missing measurement in one run makes an empty cell
+  columns = [ ]
+  for row in rows:
+    for name in row:
+      if name not in columns: columns.append( name )
+
+  if fmt == "csv":
+    with open( outname, "w" ) as fp:
+      writer = csv.DictWriter( fp, fieldnames = columns )
+      writer.writeheader()
+      writer.writerows( rows )
+  elif fmt == "jsonl":
+    with open( outname, "w" ) as fp:
+      fp.write( "".join( json.dumps( row ) + "\n" for row in rows ) )
+  else:
+    try:
+      import pandas as pd
+    except ImportError:
+      logging.error( ' Parquet export needs pandas (and pyarrow or fastparquet). Return! ')
+      return None
+    pd.DataFrame( rows, columns = columns ).to_parquet( outname )
+  return outname
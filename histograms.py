@@ -0,0 +1,247 @@
+## @package histograms
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Distributions over every record of every run: heart rate, pace, cadence and their joint distributions,
+#         with approximate quantiles. \par
+#
+#  @detail
+#    The distributions are accumulators which are filled run by run and merged by adding their counts, so
+#    the whole archive never has to be in memory: each run gives its own small accumulators (cached per file
+#    by read_sequence.getPooledHistograms()), and accumulators filled by different processes merge the same way.
+#    * histogram1d / histogram2d: fixed bins, counts kept in numpy arrays, values outside the range in
+#      the underflow / overflow counts (1-D) or dropped (2-D).
+#    * quantile_sketch: logarithmic buckets, bucket k holding the values in ( gamma^(k-1), gamma^k ], so any
+#      quantile is found within the relative accuracy ( gamma - 1 ) / ( gamma + 1 ), whatever the range.
+#    Each record is weighted by the seconds since the previous one (at most max_gap), so a device recording
+#    every second and one recording every 4 seconds give the same distribution. Only the moving records
+#    (the active segments of run_record, see pauses) are used. \par
+#
+
+import numpy as np
+from rolling import pace_from_speed
+
+_moving_speed = 1.6 # m/s, as run_record
+
+class histogram1d:
+  '''Document for class histogram1d
+
+    Purpose: mergeable histogram of fixed bins.
+    Example:
+      hist = histogram1d( 40., 220., 180 )
+      hist.add( heart_rate, seconds )
+      hist.merge( other )      # same bins
+      median = hist.getQuantile( 0.5 )
+  '''
+
+  def __init__(self, low, high, bins ):
+    self._low = float( low )
+    self._high = float( high )
+    self._bins = int( bins )
+    self._counts = np.zeros( self._bins )
+    self._underflow = 0.
+    self._overflow = 0.
+
+  def add(self, values, weights = None ):
+    '''Add the values (NaN are skipped), each with its weight (1 if None).'''
+    values = np.asarray( values, dtype = float )
+    weights = np.ones( values.size ) if weights is None else np.asarray( weights, dtype = float )
+    keep = np.isfinite( values )
+    values, weights = values[ keep ], weights[ keep ]
+    below = values < self._low
+    above = values >= self._high
+    self._underflow += weights[ below ].sum()
+    self._overflow += weights[ above ].sum()
+    inside = ~below & ~above
+    index = ( ( values[ inside ] - self._low ) / ( self._high - self._low ) * self._bins ).astype( int )
+    self._counts += np.bincount( np.minimum( index, self._bins - 1 ), weights = weights[ inside ], minlength = self._bins )
+
+  def merge(self, other ):
+    '''Add the counts of another histogram1d with the same bins.'''
+    if ( other._low, other._high, other._bins ) != ( self._low, self._high, self._bins ):
+      raise ValueError( "histograms with different bins can not be merged" )
+    self._counts += other._counts
+    self._underflow += other._underflow
+    self._overflow += other._overflow
+    return self
+
+  def getEdges(self):
+    ''' Return the array of the bins + 1 edges '''
+    return np.linspace( self._low, self._high, self._bins + 1 )
+
+  def getCounts(self):
+    ''' Return the array of the summed weights in each bin '''
+    return self._counts
+
+  def getTotal(self):
+    ''' Return the summed weights, underflow and overflow included '''
+    return self._counts.sum() + self._underflow + self._overflow
+
+  def getQuantile(self, q ):
+    ''' Return the q quantile (0 to 1), linear within a bin, None if empty. Clipped to the range of the bins '''
+    total = self.getTotal()
+    if total <= 0.:
+      return None
+    cum = self._underflow + np.concatenate( ( [ 0. ], np.cumsum( self._counts ) ) )
+    return float( np.interp( q * total, cum, self.getEdges() ) )
+
+class histogram2d:
+  '''Document for class histogram2d
+
+    Purpose: mergeable 2-D histogram of fixed bins, e.g. pace vs heart rate.
+  '''
+
+  def __init__(self, xlow, xhigh, xbins, ylow, yhigh, ybins ):
+    self._x = ( float( xlow ), float( xhigh ), int( xbins ) )
+    self._y = ( float( ylow ), float( yhigh ), int( ybins ) )
+    self._counts = np.zeros( ( self._x[2], self._y[2] ) )
+
+  @staticmethod
+  def _index( values, axis ):
+    low, high, bins = axis
+    return np.floor( ( values - low ) / ( high - low ) * bins ).astype( int )
+
+  def add(self, xvalues, yvalues, weights = None ):
+    '''Add the pairs ( x, y ), each with its weight (1 if None). Pairs with a NaN or out of range are skipped.'''
+    xvalues = np.asarray( xvalues, dtype = float )
+    yvalues = np.asarray( yvalues, dtype = float )
+    weights = np.ones( xvalues.size ) if weights is None else np.asarray( weights, dtype = float )
+    keep = np.isfinite( xvalues ) & np.isfinite( yvalues )
+    xidx = self._index( xvalues[ keep ], self._x )
+    yidx = self._index( yvalues[ keep ], self._y )
+    inside = ( xidx >= 0 ) & ( xidx < self._x[2] ) & ( yidx >= 0 ) & ( yidx < self._y[2] )
+    flat = xidx[ inside ] * self._y[2] + yidx[ inside ]
+    self._counts += np.bincount( flat, weights = weights[ keep ][ inside ],
+                                 minlength = self._counts.size ).reshape( self._counts.shape )
+
+  def merge(self, other ):
+    '''Add the counts of another histogram2d with the same bins.'''
+    if ( other._x, other._y ) != ( self._x, self._y ):
+      raise ValueError( "histograms with different bins can not be merged" )
+    self._counts += other._counts
+    return self
+
+  def __getstate__(self):
+    # a run fills few bins: keep only those in the cache
+    flat = self._counts.ravel()
+    filled = np.flatnonzero( flat )
+    return { "x": self._x, "y": self._y, "index": filled.astype( np.int32 ), "counts": flat[ filled ] }
+
+  def __setstate__(self, state ):
+    self._x = state[ "x" ]
+    self._y = state[ "y" ]
+    self._counts = np.zeros( ( self._x[2], self._y[2] ) )
+    self._counts.ravel()[ state[ "index" ] ] = state[ "counts" ]
+
+  def getXEdges(self):
+    return np.linspace( self._x[0], self._x[1], self._x[2] + 1 )
+
+  def getYEdges(self):
+    return np.linspace( self._y[0], self._y[1], self._y[2] + 1 )
+
+  def getCounts(self):
+    ''' Return the array ( x bins, y bins ) of the summed weights '''
+    return self._counts
+
+class quantile_sketch:
+  '''Document for class quantile_sketch
+
+    Purpose: mergeable approximate quantiles of positive values, within a relative accuracy, in a few hundred
+    logarithmic buckets whatever the number of values.
+    Example:
+      sketch = quantile_sketch( 0.01 )
+      sketch.add( pace, seconds )
+      sketch.merge( other )    # same accuracy
+      p90 = sketch.getQuantile( 0.9 )
+  '''
+
+  def __init__(self, relative_accuracy = 0.01 ):
+    self._accuracy = float( relative_accuracy )
+    self._log_gamma = np.log( ( 1. + self._accuracy ) / ( 1. - self._accuracy ) )
+    self._buckets = { } # bucket index -> summed weight
+
+  def add(self, values, weights = None ):
+    '''Add the values, each with its weight (1 if None). NaN and values <= 0 are skipped.'''
+    values = np.asarray( values, dtype = float )
+    weights = np.ones( values.size ) if weights is None else np.asarray( weights, dtype = float )
+    with np.errstate( invalid = 'ignore' ):
+      keep = np.isfinite( values ) & ( values > 0. )
+    index = np.ceil( np.log( values[ keep ] ) / self._log_gamma ).astype( int )
+    keys, inverse = np.unique( index, return_inverse = True )
+    sums = np.bincount( inverse, weights = weights[ keep ], minlength = keys.size )
+    for key, weight in zip( keys.tolist(), sums.tolist() ):
+      self._buckets[ key ] = self._buckets.get( key, 0. ) + weight
+
+  def merge(self, other ):
+    '''Add the buckets of another quantile_sketch with the same accuracy.'''
+    if other._accuracy != self._accuracy:
+      raise ValueError( "sketches with different accuracies can not be merged" )
+    for key, weight in other._buckets.items():
+      self._buckets[ key ] = self._buckets.get( key, 0. ) + weight
+    return self
+
+  def getTotal(self):
+    return sum( self._buckets.values() )
+
+  def getQuantile(self, q ):
+    ''' Return the q quantile (0 to 1) within the relative accuracy, None if empty '''
+    if len( self._buckets ) <= 0:
+      return None
+    keys = np.array( sorted( self._buckets ) )
+    cum = np.cumsum( [ self._buckets[ key ] for key in keys ] )
+    key = keys[ min( np.searchsorted( cum, q * cum[-1], side = 'left' ), keys.size - 1 ) ]
+    # middle of the bucket ( gamma^(k-1), gamma^k ] in the relative sense
+    return float( 2. * np.exp( key * self._log_gamma ) / ( np.exp( self._log_gamma ) + 1. ) )
+
+def pooled_histograms():
+  '''New empty accumulators of the pooled distributions: dictionary of name -> accumulator.'''
+  return {
+    "heart_rate":          histogram1d( 40., 220., 180 ),
+    "pace":                histogram1d( 2., 15., 260 ),
+    "cadence":             histogram1d( 40., 120., 80 ),
+    "pace_v_heart_rate":   histogram2d( 2., 15., 130, 40., 220., 90 ),
+    "pace_v_cadence":      histogram2d( 2., 15., 130, 40., 120., 80 ),
+    "heart_rate_quantile": quantile_sketch(),
+    "pace_quantile":       quantile_sketch(),
+    "cadence_quantile":    quantile_sketch(),
+  }
+
+def run_histograms( traces, max_gap = 10. ):
+  '''Fill new accumulators (pooled_histograms()) with the moving records of one run.
+
+    Parameters:
+    -- traces   run_record.getTraces().
+    -- max_gap  largest weight in seconds of one record (pauses).
+
+    Return: dictionary of name -> accumulator, None without time or speed.
+  '''
+  if traces is None or "time" not in traces or "speed" not in traces:
+    return None
+  accumulators = pooled_histograms()
+  tsec = np.asarray( traces[ "time" ], dtype = float )
+  seconds = np.minimum( np.concatenate( ( [ 0. ], np.diff( tsec ) ) ), max_gap )
+  speed = np.asarray( traces[ "speed" ], dtype = float )
+  if "active" in traces:
+    moving = np.asarray( traces[ "active" ], dtype = bool )
+  else:
+    with np.errstate( invalid = 'ignore' ):
+      moving = speed > _moving_speed
+  seconds = seconds[ moving ]
+  pace = pace_from_speed( speed[ moving ] )
+  accumulators[ "pace" ].add( pace, seconds )
+  accumulators[ "pace_quantile" ].add( pace, seconds )
+  for name in [ "heart_rate", "cadence" ]:
+    if name not in traces: continue
+    values = np.asarray( traces[ name ], dtype = float )[ moving ]
+    with np.errstate( invalid = 'ignore' ):
+      values = np.where( values > 0., values, np.nan ) # not measured
+    accumulators[ name ].add( values, seconds )
+    accumulators[ name + "_quantile" ].add( values, seconds )
+    accumulators[ "pace_v_" + name ].add( pace, values, seconds )
+  return accumulators
+
+def merge_histograms( total, accumulators ):
+  '''Merge the accumulators of one run (or one worker) into the total, both from pooled_histograms().'''
+  for name, accumulator in accumulators.items():
+    total[ name ].merge( accumulator )
+  return total
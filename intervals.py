@@ -0,0 +1,221 @@
+## @package intervals
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Find the structure of an interval session: the work and recovery reps of a run. \par
+#
+#  @detail
+#    * The speed is put on a 1 second grid (resample), the pauses are left out (see pauses), and it is
+#      smoothed over 5 seconds. The distance of a rep is the sum of its 1 second speeds.
+#    * Change points: binary segmentation for changes of the mean. With the cumulative sums of x and x^2, the
+#      cost (sum of squared deviations) of any segment is O(1), and the best split of a segment is one vector
+#      operation over its points. The segment with the largest gain is split first (heap), as long as the
+#      gain beats the penalty 3 * sigma^2 * log(n), with sigma the noise of the 1 second speed estimated from
+#      its differences. O(n log n) for a run of n seconds.
+#    * The segments are put in two groups by their mean speed (weighted 2-means). The run is an interval
+#      session if the fast group is clearly faster (by 15%) and has at least 2 reps; else it is one steady rep.
+#      Neighbour segments of the same group are merged.
+#    * A pace which swings slowly (hills, a loop in the wind) also splits into fast and slow segments. The
+#      change between two reps has to be sharp: the mean speed over 15 seconds on each side of the boundary
+#      (leaving out 5 seconds around it, where the runner speeds up) has to differ by at least 60% of the
+#      difference of the mean speeds of the two reps, about 100% for a real rep and 40% for a sine. Only the
+#      work reps with sharp changes count, at least 2 of them make an interval session.
+#    * python2.7 intervals.py checks the detection on made-up runs. \par
+#
+
+import heapq
+from collections import OrderedDict
+import numpy as np
+from resample import resample
+from pauses import active_on_grid
+
+_smooth = 5           # seconds of the box smoothing
+_min_length = 30      # seconds, shortest rep
+_max_segments = 64
+_penalty_scale = 3.
+_min_contrast = 1.15  # work speed / recovery speed of an interval session
+_edge_gap = 5         # seconds left out on each side of a change between reps
+_edge_width = 15      # seconds of speed averaged on each side of a change
+_min_sharpness = 0.6  # change over the edges / change of the mean speeds of the reps
+
+def _cost( cum1, cum2, begin, end ):
+  '''Sum of squared deviations from the mean of the points [ begin, end ), from the cumulative sums.'''
+  count = end - begin
+  total = cum1[ end ] - cum1[ begin ]
+  return ( cum2[ end ] - cum2[ begin ] ) - total * total / count
+
+def _best_split( cum1, cum2, begin, end, min_length ):
+  '''Best split point of [ begin, end ) and its gain, ( None, 0 ) if too short.'''
+  splits = np.arange( begin + min_length, end - min_length + 1 )
+  if splits.size == 0:
+    return None, 0.
+  gains = _cost( cum1, cum2, begin, end ) - _cost( cum1, cum2, begin, splits ) - _cost( cum1, cum2, splits, end )
+  best = int( np.argmax( gains ) )
+  return int( splits[ best ] ), float( gains[ best ] )
+
+def change_points( values, noise = None, min_length = _min_length, max_segments = _max_segments ):
+  '''Split a series into segments of different means by binary segmentation.
+
+    Parameters:
+    -- values        numpy array of the series (no NaN).
+    -- noise         standard deviation of the noise, estimated from the differences if None.
+    -- min_length    shortest segment, in points.
+    -- max_segments  largest number of segments.
+
+    Return: sorted list of the boundaries [ 0, ..., len( values ) ].
+  '''
+  values = np.asarray( values, dtype = float )
+  size = values.size
+  if size < 2 * min_length:
+    return [ 0, size ]
+  if noise is None:
+    # median absolute difference, robust to the changes themselves
+    noise = 1.4826 * np.median( np.abs( np.diff( values ) ) ) / np.sqrt( 2. )
+  penalty = _penalty_scale * max( noise, 1e-3 ) ** 2 * np.log( size )
+  cum1 = np.concatenate( ( [ 0. ], np.cumsum( values ) ) )
+  cum2 = np.concatenate( ( [ 0. ], np.cumsum( values * values ) ) )
+
+  bounds = [ 0, size ]
+  heap = [ ]
+  split, gain = _best_split( cum1, cum2, 0, size, min_length )
+  if split is not None: heapq.heappush( heap, ( -gain, 0, size, split ) )
+  while heap and len( bounds ) - 1 < max_segments:
+    neg_gain, begin, end, split = heapq.heappop( heap )
+    if -neg_gain <= penalty: break
+    bounds.append( split )
+    for left, right in ( ( begin, split ), ( split, end ) ):
+      sub, sub_gain = _best_split( cum1, cum2, left, right, min_length )
+      if sub is not None: heapq.heappush( heap, ( -sub_gain, left, right, sub ) )
+  return sorted( bounds )
+
+def _two_groups( means, weights ):
+  '''Threshold between the slow and the fast groups of the segment means (weighted 1-D 2-means).'''
+  threshold = np.average( means, weights = weights )
+  for iteration in range( 20 ):
+    fast = means > threshold
+    if fast.all() or not fast.any(): break
+    slow_mean = np.average( means[ ~fast ], weights = weights[ ~fast ] )
+    fast_mean = np.average( means[ fast ], weights = weights[ fast ] )
+    new = 0.5 * ( slow_mean + fast_mean )
+    if new == threshold: break
+    threshold = new
+  return threshold
+
+def _sharpness( speed, begins, ends ):
+  '''Sharpness of the change at the start of each segment but the first: difference of the mean speeds over
+    the edges around the boundary / difference of the mean speeds of the two segments (1 for a step).'''
+  cum = np.concatenate( ( [ 0. ], np.cumsum( speed ) ) )
+  def mean( begin, end ):
+    return ( cum[ end ] - cum[ begin ] ) / np.maximum( end - begin, 1 )
+  bounds = begins[ 1: ]
+  before = mean( np.maximum( bounds - _edge_gap - _edge_width, begins[ :-1 ] ), np.maximum( bounds - _edge_gap, begins[ :-1 ] + 1 ) )
+  after = mean( np.minimum( bounds + _edge_gap, ends[ 1: ] - 1 ), np.minimum( bounds + _edge_gap + _edge_width, ends[ 1: ] ) )
+  change = mean( begins[ 1: ], ends[ 1: ] ) - mean( begins[ :-1 ], ends[ :-1 ] )
+  with np.errstate( divide = 'ignore', invalid = 'ignore' ):
+    return np.where( change != 0., ( after - before ) / change, 0. )
+
+def detect_intervals( traces, max_gap = 10. ):
+  '''Find the work and recovery reps of a run.
+
+    Parameters:
+    -- traces   run_record.getTraces(), with "time" and "speed" ("heart_rate" and "active" if measured).
+    -- max_gap  records further apart are a pause (when there is no "active" trace).
+
+    Return: list of reps in time order, each an <OrderedDict> of "Kind" ("work", "recovery" or "steady"),
+            "Rep" (number of the work rep, 0 otherwise), "StartSeconds" (elapsed), "Seconds" (moving), "Meters", "PaceKm" (minutes
+            per Km, None if not moving) and "AverageHeartRate" (None if not measured). None without speed.
+  '''
+  if traces is None or "time" not in traces or "speed" not in traces or len( traces[ "time" ] ) < 2:
+    return None
+  measures = dict( ( name, traces[ name ] ) for name in [ "speed", "heart_rate" ] if name in traces )
+  grid = resample( traces[ "time" ], measures, 1., max_gap, "hold" )
+  speed = np.nan_to_num( grid[ "speed" ] )
+  paused = grid[ "in_gap" ]
+  if "active" in traces:
+    paused = paused | ~active_on_grid( traces[ "time" ], traces[ "active" ], grid[ "time" ] )
+  # only the active seconds: a pause (a traffic light, the watch stopped) is not a recovery rep
+  moving = np.flatnonzero( ~paused )
+  if moving.size < 2:
+    return None
+  speed = speed[ moving ]
+  smooth = np.convolve( speed, np.ones( _smooth ) / _smooth, mode = 'same' )
+  noise = 1.4826 * np.median( np.abs( np.diff( speed ) ) ) / np.sqrt( 2. )
+
+  bounds = change_points( smooth, noise = noise )
+  begins, ends = np.array( bounds[ :-1 ] ), np.array( bounds[ 1: ] )
+  cum = np.concatenate( ( [ 0. ], np.cumsum( speed ) ) )
+  means = ( cum[ ends ] - cum[ begins ] ) / ( ends - begins )
+  threshold = _two_groups( means, ( ends - begins ).astype( float ) )
+  fast = means > threshold
+  kinds = np.where( fast, "work", "recovery" )
+  if fast.sum() < 2 or fast.all() or \
+     np.average( means[ fast ], weights = ends[ fast ] - begins[ fast ] ) < \
+     _min_contrast * np.average( means[ ~fast ], weights = ends[ ~fast ] - begins[ ~fast ] ):
+    kinds = np.array( [ "steady" ] * begins.size )
+
+  # merge the neighbours of the same kind
+  keep = np.concatenate( ( [ True ], kinds[ 1: ] != kinds[ :-1 ] ) )
+  begins = begins[ keep ]
+  ends = np.concatenate( ( begins[ 1: ], [ bounds[-1] ] ) )
+  kinds = kinds[ keep ]
+
+  # a work rep counts if the changes with its recovery reps are sharp, not a slow swing of the pace
+  if kinds[0] != "steady":
+    sharp = np.concatenate( ( [ np.inf ], _sharpness( speed, begins, ends ), [ np.inf ] ) ) >= _min_sharpness
+    if np.sum( ( kinds == "work" ) & sharp[ :-1 ] & sharp[ 1: ] ) < 2:
+      begins, ends, kinds = begins[ :1 ], np.array( [ bounds[-1] ] ), np.array( [ "steady" ] )
+
+  reps = [ ]
+  work = 0
+  for begin, end, kind in zip( begins, ends, kinds ):
+    rep = OrderedDict()
+    if kind == "work": work += 1
+    rep[ "Kind" ] = str( kind )
+    rep[ "Rep" ] = work if kind == "work" else 0
+    points = moving[ begin:end ]
+    rep[ "StartSeconds" ] = float( grid[ "time" ][ points[0] ] )
+    rep[ "Seconds" ] = float( end - begin ) # moving seconds
+    rep[ "Meters" ] = meters = float( speed[ begin:end ].sum() )
+    rep[ "PaceKm" ] = rep[ "Seconds" ] / 60. / ( meters / 1000. ) if meters > 1. else None
+    heart = grid[ "heart_rate" ][ points ] if "heart_rate" in grid else np.zeros( 0 )
+    heart = heart[ np.isfinite( heart ) & ( heart > 0. ) ]
+    rep[ "AverageHeartRate" ] = float( heart.mean() ) if heart.size > 0 else None
+    reps.append( rep )
+  return reps
+
+def is_interval_session( reps ):
+  '''Whether the reps of detect_intervals() are an interval session (at least 2 work reps).'''
+  return reps is not None and sum( 1 for rep in reps if rep[ "Kind" ] == "work" ) >= 2
+
+def _made_up_run( speed ):
+  '''Traces of a run at the given 1 second speeds, for the checks.'''
+  speed = np.asarray( speed, dtype = float )
+  return { "time": np.arange( speed.size, dtype = float ), "speed": speed, "distance": np.cumsum( speed ) }
+
+def main():
+  '''Check the detection on made-up runs: steady, steady with a slow swing of the pace, intervals.'''
+  noise = np.random.RandomState( 1 ).normal( 0., 0.1, 3600 )
+  seconds = np.arange( 3600 )
+  cases = [
+    ( "steady 3.0 m/s", 3. + noise, 0 ),
+    # +-12% of the speed, 5 minutes period: faster and slower halves, but no rep
+    ( "steady 3.0 m/s, +-12% swing of 5 minutes", 3. * ( 1. + 0.12 * np.sin( 2. * np.pi * seconds / 300. ) ) + noise, 0 ),
+    ( "steady 3.0 m/s, +-12% swing of 20 minutes", 3. * ( 1. + 0.12 * np.sin( 2. * np.pi * seconds / 1200. ) ) + noise, 0 ),
+    # 10 minutes warm up, 8 x ( 3 minutes at 4.5 m/s, 2 minutes at 3.0 m/s ), 10 minutes cool down
+    ( "8 x 3 minutes", np.where( ( seconds >= 600 ) & ( seconds < 3000 ) & ( ( seconds - 600 ) % 300 < 180 ), 4.5, 3. ) + noise, 8 ),
+    # the same with 10 seconds to speed up and to slow down
+    ( "8 x 3 minutes, 10 seconds ramps", np.convolve( np.where( ( seconds >= 600 ) & ( seconds < 3000 ) & ( ( seconds - 600 ) % 300 < 180 ), 4.5, 3. ),
+                                                      np.ones( 10 ) / 10., mode = 'same' ) + noise, 8 ),
+  ]
+  failed = 0
+  for name, speed, work in cases:
+    reps = detect_intervals( _made_up_run( speed ) )
+    found = sum( 1 for rep in reps if rep[ "Kind" ] == "work" )
+    ok = found == work and is_interval_session( reps ) == ( work >= 2 )
+    if not ok: failed += 1
+    print " %-45s work reps %2d, expected %2d: %s" % ( name, found, work, "OK" if ok else "FAILED" )
+  return failed
+
+if __name__ == '__main__' :
+  import sys
+  sys.exit( main() )
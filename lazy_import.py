@@ -0,0 +1,68 @@
+## @package lazy_import
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Import heavy modules (matplotlib, pandas, Basemap) only when they are first used. \par
+#
+#  @detail
+#    Importing matplotlib.pyplot takes much longer than reading one .fit file. A module kept behind a
+#    lazy_module is imported at the first access of one of its attributes, so a job writing only the text
+#    or structured summaries never pays for the plotting libraries. \par
+#
+
+import os
+import sys
+import importlib
+
+def _headless_backend():
+  '''Use the non-interactive backend of matplotlib when there is no display, e.g. in a cron job.'''
+  if "MPLBACKEND" in os.environ or "matplotlib.pyplot" in sys.modules:
+    return
+  if sys.platform.startswith( "linux" ) and not os.environ.get( "DISPLAY" ):
+    import matplotlib
+    matplotlib.use( "Agg" )
+
+class lazy_module:
+  '''Document for class lazy_module
+
+    Purpose: stand for a module, which is imported at the first access of one of its attributes.
+    Example:
+      plt = lazy_module( "matplotlib.pyplot" )
+      ...
+      plt.plot( x, y ) # matplotlib.pyplot is imported here
+  '''
+
+  def __init__(self, name, setup = None ):
+    '''Constructor of class lazy_module.
+      Parameter name: full name of the module.
+      Parameter setup: function called once just before the import, None for nothing.
+    '''
+    self.__dict__[ "_name" ] = name
+    self.__dict__[ "_setup" ] = setup
+    self.__dict__[ "_module" ] = None
+
+  def _load(self):
+    if self._module is None:
+      if self._setup is not None:
+        self._setup()
+      self.__dict__[ "_module" ] = importlib.import_module( self._name )
+    return self._module
+
+  def __getattr__(self, attr ):
+    return getattr( self._load(), attr )
+
+  def __setattr__(self, attr, value ):
+    setattr( self._load(), attr, value )
+
+def is_loaded( name ):
+  '''Tell if the module is already imported, e.g. to check that a summary-only job never imports matplotlib.
+  '''
+  return name in sys.modules
+
+#
+# the plotting modules shared by read_fit and anal
+#
+pyplot = lazy_module( "matplotlib.pyplot", setup = _headless_backend )
+mdates = lazy_module( "matplotlib.dates", setup = _headless_backend )
+mcollections = lazy_module( "matplotlib.collections", setup = _headless_backend )
+mcolors = lazy_module( "matplotlib.colors", setup = _headless_backend )
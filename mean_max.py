@@ -0,0 +1,99 @@
+## @package mean_max
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Mean-maximal speed curve (the pace-duration profile) of a run and over a series of runs. \par
+#
+#  @detail
+#    For every duration between 5 seconds and the full length of a run, the mean-maximal curve gives the
+#    best average speed held over any window of that duration. All curves are evaluated on the same grid of
+#    durations, so the all-time envelope of many runs is a simple element-wise maximum. \par
+#
+
+import numpy as np
+from resample import resample
+
+#
+# every second from 5 s to 1 minute, then about 30 points per decade up to 24 hours
+#
+_durations = np.unique( np.concatenate( ( np.arange( 5, 61 ),
+  np.round( np.logspace( np.log10( 60. ), np.log10( 86400. ), 96 ) ).astype( int ) ) ) )
+
+def mean_max_durations():
+  '''Get the common grid of durations in seconds used by all the mean-maximal curves.
+  '''
+  return _durations
+
+def mean_max_curve( elapsed_seconds, distance ):
+  '''Calculate the mean-maximal speed curve of one run.
+
+    The distance is interpolated on a 1 second grid, where it is the prefix sum of the speed. The distance
+    covered in any window of d seconds is then cum[ i + d ] - cum[ i ], so every duration costs one vector
+    operation over the run and the whole curve is O(n) per grid point.
+
+    Parameters:
+    -- elapsed_seconds  list of the elapsed time in seconds of each record.
+    -- distance         list of the distance in meters of each record.
+
+    Return: numpy array of the best average speed in m/s for each duration of mean_max_durations(),
+            NaN for durations longer than the run.
+  '''
+
+  curve = np.full( _durations.size, np.nan )
+  tsec = np.asarray( elapsed_seconds, dtype = float )
+  dist = np.asarray( distance, dtype = float )
+  if tsec.size < 2 or tsec.size != dist.size:
+    return curve
+
+  # distance of a run never goes down, fix the glitches of the device; in a pause it simply stays
+  dist = np.maximum.accumulate( dist )
+  cum = resample( tsec, { "distance": dist }, step = 1., gap = "interp" )[ "distance" ]
+
+  for idx, dur in enumerate( _durations ):
+    if dur >= cum.size: break
+    curve[ idx ] = np.max( cum[ dur: ] - cum[ :-dur ] ) / dur
+  return curve
+
+class mean_max_envelope:
+  '''Document for class mean_max_envelope
+
+    Purpose: keep the all-time best mean-maximal speed for each duration, and the run holding it.
+      The envelope is updated one run at a time, so adding a new run never needs the older ones.
+  '''
+
+  def __init__(self):
+    self._best_speed = np.full( _durations.size, np.nan )
+    self._best_run = [ None ] * _durations.size
+
+  def add(self, curve, run_id ):
+    '''Update the envelope with the mean-maximal curve of one more run.
+
+      Parameters:
+      -- curve   mean-maximal speed curve from mean_max_curve().
+      -- run_id  identifier of the run, e.g. its starting time.
+    '''
+    self._update( np.asarray( curve, dtype = float ), [ run_id ] * _durations.size )
+
+  def merge(self, other ):
+    '''Merge the envelope of another series of runs into this one.
+    '''
+    self._update( other._best_speed, other._best_run )
+
+  def _update(self, speed, runs ):
+    with np.errstate( invalid = 'ignore' ):
+      better = np.greater( speed, self._best_speed ) | ( np.isnan( self._best_speed ) & ~np.isnan( speed ) )
+    self._best_speed[ better ] = speed[ better ]
+    for idx in np.flatnonzero( better ):
+      self._best_run[ idx ] = runs[ idx ]
+
+  def getDurations(self):
+    ''' Return the grid of durations in seconds '''
+    return _durations
+
+  def getBestSpeed(self):
+    ''' Return the best average speed in m/s for each duration, NaN if no run is long enough '''
+    return self._best_speed
+
+  def getBestRun(self):
+    ''' Return the identifier of the run holding the best speed for each duration '''
+    return self._best_run
@@ -0,0 +1,159 @@
+## @package overlay
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief The full traces of many runs drawn over each other on one axis: pace vs distance, heart rate vs
+#         time, elevation profile. \par
+#
+#  @detail
+#    * One plt.plot per run makes one artist per run, and the cost of matplotlib grows with the artists: a
+#      few hundred runs take minutes. All the runs are given to one LineCollection instead, a single artist
+#      drawn in one pass, with the color (and the transparency) of each run from its own value.
+#    * Each trace is cut to about 400 points first: the records are split into equal buckets, and the lowest
+#      and the highest point of each bucket are kept in their order (min / max decimation). Unlike keeping
+#      every n-th record, the spikes and the envelope of the trace stay, which is what the eye sees of a
+#      line wider than a pixel. The buckets of a trace are one reshaped array, argmin and argmax along it.
+#    * The limits of the axes are set from the points (NaN breaks a line and is skipped), and with many
+#      runs the lines are rasterized in the .pdf, so the file stays small and quick to open. The time goes
+#      to drawing the strokes, about 2 seconds for 1000 runs of 400 points. \par
+#
+
+import numpy as np
+from collections import OrderedDict
+from rolling import rolling_speed, pace_from_speed
+from lazy_import import pyplot as plt, mcollections, mcolors
+
+_points = 400      # points kept per trace
+_rasterize = 100   # number of runs above which the lines are rasterized in the figure
+
+def downsample( y, points = _points ):
+  '''Indices of the points kept of a trace by min / max decimation.
+
+    Parameters:
+    -- y       values of the trace, NaN where unknown.
+    -- points  about the number of points kept: the lowest and the highest of points / 2 buckets.
+
+    Return: sorted numpy array of the indices kept, the first and the last always.
+  '''
+  y = np.asarray( y, dtype = float )
+  size = y.size
+  buckets = max( points // 2, 1 )
+  if size <= 2 * buckets:
+    return np.arange( size )
+  width = int( np.ceil( size / float( buckets ) ) )
+  buckets = int( np.ceil( size / float( width ) ) )
+  padded = np.full( buckets * width, np.nan )
+  padded[ :size ] = y
+  padded = padded.reshape( buckets, width )
+  known = np.isfinite( padded )
+  # a bucket without value keeps its first point: a NaN, which breaks the line there
+  low = np.argmin( np.where( known, padded, np.inf ), axis = 1 )
+  high = np.argmax( np.where( known, padded, -np.inf ), axis = 1 )
+  offset = np.arange( buckets ) * width
+  kept = np.concatenate( ( [ 0, size - 1 ], offset + low, offset + high ) )
+  return np.unique( kept[ kept < size ] )
+
+def pace_v_distance( traces ):
+  '''( distance in Km, pace in minutes per Km over 30 seconds ) of a run, NaN when not moving.'''
+  if "distance" not in traces or "time" not in traces:
+    return None
+  pace = pace_from_speed( rolling_speed( traces[ "time" ], traces[ "distance" ], 30. ) )
+  if "active" in traces:
+    pace = np.where( traces[ "active" ], pace, np.nan )
+  pace[ :1 ] = np.nan # no time covered yet at the first record
+  return traces[ "distance" ] / 1000., pace
+
+def heart_rate_v_time( traces ):
+  '''( elapsed minutes, heart rate in bpm ) of a run.'''
+  if "heart_rate" not in traces or "time" not in traces:
+    return None
+  return traces[ "time" ] / 60., traces[ "heart_rate" ]
+
+def elevation_v_distance( traces ):
+  '''( distance in Km, altitude in meters ) of a run.'''
+  if "altitude" not in traces or "distance" not in traces:
+    return None
+  return traces[ "distance" ] / 1000., traces[ "altitude" ]
+
+#
+# overlays made for a series: name -> ( function of the traces, x label, y label )
+#
+overlays = OrderedDict( [
+  ( "pace_v_distance", ( pace_v_distance, "Distance (Km)", "Pace (minutes per Km)" ) ),
+  ( "heart_rate_v_time", ( heart_rate_v_time, "Time (minutes)", "Heart Rate (bpm)" ) ),
+  ( "elevation_v_distance", ( elevation_v_distance, "Distance (Km)", "Altitude (meters)" ) ),
+] )
+
+def overlay_lines( traces, name, points = _points ):
+  '''Downsampled line of each run for one of the overlays.
+
+    Parameters:
+    -- traces  list of run_record.getTraces() of the runs, None for a run without traces.
+    -- name    a key of overlays.
+    -- points  about the number of points kept per run, see downsample().
+
+    Return: list of numpy arrays ( points, 2 ) of [ x, y ] for each run, None if the run has not the measures.
+  '''
+  function = overlays[ name ][0]
+  lines = [ ]
+  for trace in traces:
+    xy = function( trace ) if trace is not None else None
+    if xy is None or len( xy[0] ) < 2:
+      lines.append( None )
+      continue
+    x, y = np.asarray( xy[0], dtype = float ), np.asarray( xy[1], dtype = float )
+    kept = downsample( y, points )
+    lines.append( np.column_stack( ( x[ kept ], y[ kept ] ) ) )
+  return lines
+
+def draw_overlay( lines, out, xlab, ylab, title = "", values = None, alpha = None, cmap = 'viridis', value_label = "" ):
+  '''Draw the lines of many runs on one axis as a single LineCollection.
+
+    Parameters:
+    -- lines        list of numpy arrays ( points, 2 ) of [ x, y ] (overlay_lines()), None are skipped.
+    -- out          name of the figure written.
+    -- values       value of each line giving its color on cmap (e.g. the date of the run), None: one color.
+    -- alpha        transparency of all the lines, or list of one per line. None: from the number of lines.
+    -- value_label  label of the color bar of the values.
+
+    Return the number of lines drawn.
+  '''
+  drawn = [ idx for idx, line in enumerate( lines ) if line is not None and len( line ) >= 2 ]
+  if len( drawn ) <= 0:
+    return 0
+  segments = [ lines[ idx ] for idx in drawn ]
+  if alpha is None:
+    alpha = min( 1., max( 0.05, 20. / len( drawn ) ) )
+  alphas = np.broadcast_to( np.asarray( alpha, dtype = float ), ( len( lines ), ) )[ drawn ]
+
+  plt.clf()
+  plt.gcf().set_size_inches(10, 8)
+  axes = plt.gca()
+  if values is not None:
+    values = np.asarray( values, dtype = float )[ drawn ]
+    norm = mcolors.Normalize( vmin = values.min(), vmax = values.max() if values.max() > values.min() else values.min() + 1. )
+    colors = plt.get_cmap( cmap )( norm( values ) )
+  else:
+    colors = np.tile( mcolors.to_rgba( '#0504aa' ), ( len( drawn ), 1 ) )
+  colors[ :, 3 ] = alphas
+  collection = mcollections.LineCollection( segments, colors = colors, linewidths = 1 )
+  collection.set_rasterized( len( drawn ) > _rasterize )
+  axes.add_collection( collection, autolim = False )
+
+  points = np.concatenate( segments )
+  for limit, column in ( ( axes.set_xlim, 0 ), ( axes.set_ylim, 1 ) ):
+    known = points[ np.isfinite( points[ :, column ] ), column ]
+    if known.size > 0:
+      low, high = known.min(), known.max()
+      margin = 0.02 * ( high - low ) if high > low else 1.
+      limit( low - margin, high + margin )
+  if values is not None:
+    mappable = plt.cm.ScalarMappable( norm = norm, cmap = cmap )
+    mappable.set_array( values )
+    plt.colorbar( mappable, label = value_label )
+  plt.xlabel( xlab )
+  plt.ylabel( ylab )
+  plt.title( title )
+  # not plt.savefig: on a non-interactive backend it draws the figure once more after saving
+  plt.gcf().savefig( out )
+  return len( drawn )
@@ -0,0 +1,125 @@
+## @package pauses
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Split a run into active segments, leaving out the pauses: the watch timer stopped (auto-pause or
+#         the stop button), gaps in the records, and stretches standing or walking (traffic lights). \par
+#
+#  @detail
+#    The interval between two records ( i-1, i ] is a pause if
+#      * the records are more than max_gap seconds apart with almost no distance covered in between (no record
+#        while stopped). With "smart recording" a moving watch may also write a record only every 10 to 20
+#        seconds: those gaps, where the distance grows at a moving speed, stay active. Without distance,
+#        every gap longer than max_gap is a pause,
+#      * its middle time falls between a timer stop and the next timer start (FIT event messages), or
+#      * record i belongs to a run of consecutive records at or below min_speed lasting at least min_stop
+#        seconds. A single slow record (a sharp turn) stays active.
+#    All three are array operations over the records: np.diff for the gaps, searchsorted of the middle times
+#    in the sorted timer stops, and a run-length encoding of the slow records from the changes of the
+#    padded mask. The active segments are the runs of active intervals, given as index ranges of records,
+#    and the active mask of record i tells whether the interval ending at i is active, so that the moving
+#    time is dt[ active ].sum() and any mean over the moving records is a masked mean. \par
+#
+
+import numpy as np
+
+timer_stop_types = ( 1, 4, 8, 9 ) # FIT event_type: stop, stop_all, stop_disable, stop_disable_all
+timer_start_type = 0              # FIT event_type: start
+timer_event = 0                   # FIT event: timer
+
+def timer_stops( events ):
+  '''Intervals of time when the timer of the watch was stopped.
+
+    Parameters:
+    -- events  list of ( time in seconds, event_type ) of the timer events (FIT event messages with event timer),
+               in the file order.
+
+    Return: two arrays ( stop times, start times ) in seconds, the start time is +inf if never started again.
+  '''
+  stops, starts = [ ], [ ]
+  stopped = False
+  for time, event_type in events:
+    if event_type in timer_stop_types and not stopped:
+      stops.append( time )
+      stopped = True
+    elif event_type == timer_start_type and stopped:
+      starts.append( time )
+      stopped = False
+  if stopped:
+    starts.append( np.inf )
+  return np.array( stops, dtype = float ), np.array( starts, dtype = float )
+
+def _runs( mask ):
+  '''Begin and end (excluded) indices of the runs of True in a boolean array.'''
+  changes = np.diff( np.concatenate( ( [ 0 ], mask.astype( np.int8 ), [ 0 ] ) ) )
+  return np.flatnonzero( changes == 1 ), np.flatnonzero( changes == -1 )
+
+def active_mask( elapsed_seconds, speed = None, events = None, distance = None, max_gap = 10., min_speed = 1.6, min_stop = 5. ):
+  '''Whether the interval ending at each record is active (not a pause).
+
+    Parameters:
+    -- elapsed_seconds  increasing list of the time of each record in seconds.
+    -- speed            list of the speed in m/s of each record, None if not measured.
+    -- events           timer events, see timer_stops(), with the times in the same seconds. None if none.
+    -- distance         list of the distance in meters of each record, None if not measured.
+    -- max_gap          records further apart are in a pause, unless the distance grows faster than min_speed.
+    -- min_speed        speed in m/s at or below which a record is slow.
+    -- min_stop         seconds a run of slow records must last to be a pause.
+
+    Return: numpy boolean array, one value per record. The first record is never active (no interval).
+  '''
+  tsec = np.asarray( elapsed_seconds, dtype = float )
+  active = np.zeros( tsec.size, dtype = bool )
+  if tsec.size < 2:
+    return active
+  dt = np.diff( tsec )
+  gap = dt > max_gap
+  if distance is not None:
+    covered = np.diff( np.asarray( distance, dtype = float ) )
+    with np.errstate( invalid = 'ignore' ):
+      gap &= ~( covered > min_speed * dt )
+  active[ 1: ] = ~gap
+
+  if events:
+    stops, starts = timer_stops( events )
+    if stops.size > 0:
+      middle = 0.5 * ( tsec[ 1: ] + tsec[ :-1 ] )
+      last_stop = np.searchsorted( stops, middle, side = 'right' ) - 1
+      stopped = ( last_stop >= 0 ) & ( middle < starts[ np.maximum( last_stop, 0 ) ] )
+      active[ 1: ] &= ~stopped
+
+  if speed is not None:
+    with np.errstate( invalid = 'ignore' ):
+      slow = ~( np.asarray( speed, dtype = float ) > min_speed )
+    begins, ends = _runs( slow )
+    # a run of slow records lasts from the record before it to its last record
+    durations = tsec[ ends - 1 ] - tsec[ np.maximum( begins - 1, 0 ) ]
+    paused = np.repeat( durations >= min_stop, ends - begins )
+    slow[ slow ] = paused
+    active &= ~slow
+  return active
+
+def active_segments( active ):
+  '''Active segments from active_mask(): array ( segments, 2 ) of [ first record, last record + 1 ).'''
+  begins, ends = _runs( np.asarray( active, dtype = bool ) )
+  # the interval ending at record i starts at record i - 1
+  return np.column_stack( ( begins - 1, ends ) ).astype( int ) if begins.size > 0 else np.zeros( ( 0, 2 ), dtype = int )
+
+def moving_clock( elapsed_seconds, active ):
+  '''Time in seconds counted only over the active intervals, for each record: the clock of a watch which
+    stops in the pauses. Durations measured on it (e.g. best efforts) leave the pauses out.
+  '''
+  tsec = np.asarray( elapsed_seconds, dtype = float )
+  if tsec.size == 0:
+    return tsec
+  dt = np.concatenate( ( [ 0. ], np.diff( tsec ) ) )
+  return np.cumsum( np.where( active, dt, 0. ) )
+
+def active_on_grid( elapsed_seconds, active, grid ):
+  '''Active mask of the points of a grid of time (e.g. resample.resample()), from the records around them.'''
+  tsec = np.asarray( elapsed_seconds, dtype = float )
+  if tsec.size == 0:
+    return np.zeros( len( grid ), dtype = bool )
+  tsec = tsec - tsec[0]
+  after = np.clip( np.searchsorted( tsec, grid, side = 'left' ), 0, tsec.size - 1 )
+  return np.asarray( active, dtype = bool )[ after ]
@@ -0,0 +1,123 @@
+## @package race_predictor
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Predicted race times (5 Km, 10 Km, half marathon, marathon) from the best efforts of the runs. \par
+#
+#  @detail
+#    * Best efforts of a run: the shortest time to cover each of a fixed list of distances, anywhere in the
+#      run. With the time interpolated at distance d + D for every record at distance d, each distance D is
+#      one vector operation. The time is the moving time (pauses.moving_clock()), without the pauses. They
+#      are calculated once per file and cached (read_sequence.getBestEfforts()), with effort_version: a
+#      cached effort of another version of best_efforts() is calculated again.
+#    * Over the runs of the last N weeks, the best time of each distance is taken, and two models are fitted:
+#        - Riegel: T = a * D^b, a straight line in log T vs log D (from 1 Km on), used for the predictions.
+#        - Critical speed: D = CS * T + D', a straight line over the efforts of 2 to 20 minutes, giving the
+#          speed which can be held for long and the distance D' which can be run above it.
+#    * The trend is the prediction at the date of each run. All the windows are taken at once (interleaved
+#      np.minimum.reduceat over the runs sorted by date) and the fits of all the windows are closed-form
+#      masked least squares, so a history of thousands of runs is a few array operations. \par
+#
+
+import numpy as np
+from pauses import moving_clock
+
+effort_distances = np.array( [ 400., 1000., 1609.34, 3000., 5000., 10000., 21097.5, 42195. ] )
+effort_version = 2 # increase when best_efforts() changes its results (2: on the moving clock, without the pauses)
+race_distances = [ ( "5Km", 5000. ), ( "10Km", 10000. ), ( "HalfMarathon", 21097.5 ), ( "Marathon", 42195. ) ]
+riegel_exponent = 1.06 # used when only one distance has an effort
+_riegel_min_distance = 1000.
+_cs_durations = ( 120., 1200. )
+
+def best_efforts( traces ):
+  '''Shortest time in seconds to cover each distance of effort_distances, anywhere in the run.
+
+    Parameters:
+    -- traces  run_record.getTraces(), with "time" and "distance".
+
+    Return: numpy array of seconds, NaN for the distances longer than the run. None without distance.
+  '''
+  if traces is None or "time" not in traces or "distance" not in traces or len( traces[ "time" ] ) < 2:
+    return None
+  tsec = np.asarray( traces[ "time" ], dtype = float )
+  if "active" in traces:
+    # on the clock of the active segments: a best effort does not count the pauses
+    tsec = moving_clock( tsec, traces[ "active" ] )
+  dist = np.maximum.accumulate( np.nan_to_num( np.asarray( traces[ "distance" ], dtype = float ) ) )
+  efforts = np.full( effort_distances.size, np.nan )
+  for idx, target in enumerate( effort_distances ):
+    start = dist + target <= dist[-1]
+    if not np.any( start ): break
+    # time at distance d + D for every record at distance d
+    end_time = np.interp( dist[ start ] + target, dist, tsec )
+    efforts[ idx ] = np.min( end_time - tsec[ start ] )
+  return efforts
+
+def _masked_line( x, y, mask ):
+  '''Slope and intercept of y = slope * x + intercept for each row, from the points in mask. NaN if < 2.'''
+  count = mask.sum( axis = 1 ).astype( float )
+  with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+    mean_x = np.where( mask, x, 0. ).sum( axis = 1 ) / count
+    mean_y = np.where( mask, y, 0. ).sum( axis = 1 ) / count
+    dx = np.where( mask, x - mean_x[ :, None ], 0. )
+    dy = np.where( mask, y - mean_y[ :, None ], 0. )
+    slope = ( dx * dy ).sum( axis = 1 ) / ( dx * dx ).sum( axis = 1 )
+  slope = np.where( count >= 2, slope, np.nan )
+  return slope, mean_y - slope * mean_x
+
+def window_best( efforts, start_times, weeks = 6 ):
+  '''Best time of each distance over the runs of the weeks before each run (the run included).
+
+    Parameters:
+    -- efforts      array ( runs, distances ) of best_efforts(), NaN if none.
+    -- start_times  list of the start time (<datetime>) of each run, in increasing order.
+    -- weeks        length of the window.
+
+    Return: array ( runs, distances ), NaN where no run of the window covers the distance.
+  '''
+  efforts = np.asarray( efforts, dtype = float )
+  if efforts.shape[0] == 0:
+    return efforts
+  seconds = np.array( [ ( t - start_times[0] ).total_seconds() for t in start_times ] )
+  first = np.searchsorted( seconds, seconds - weeks * 7 * 86400., side = 'left' )
+  last = np.arange( seconds.size ) + 1
+  # interleaved [ first, last ) bounds, with an extra row so that the last bound is a valid index
+  padded = np.vstack( ( np.where( np.isnan( efforts ), np.inf, efforts ), np.full( ( 1, efforts.shape[1] ), np.inf ) ) )
+  bounds = np.empty( 2 * seconds.size, dtype = int )
+  bounds[ 0::2 ] = first
+  bounds[ 1::2 ] = last
+  best = np.minimum.reduceat( padded, bounds, axis = 0 )[ 0::2 ]
+  return np.where( np.isinf( best ), np.nan, best )
+
+def fit_models( best ):
+  '''Fit the Riegel and the critical speed models to each row of best times.
+
+    Parameters:
+    -- best  array ( rows, distances ) of best times in seconds of effort_distances, NaN if none.
+
+    Return: dictionary of arrays, one value per row: "RiegelExponent", "RiegelScale" (T = scale * D^exponent),
+            "CriticalSpeed" (m/s) and "Dprime" (m). NaN if the row has not enough efforts.
+  '''
+  best = np.atleast_2d( np.asarray( best, dtype = float ) )
+  dist = np.broadcast_to( effort_distances, best.shape )
+  filled = np.where( np.isfinite( best ), best, 0. )
+  valid = filled > 0.
+
+  riegel = valid & ( dist >= _riegel_min_distance )
+  with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+    exponent, log_scale = _masked_line( np.log( dist ), np.log( np.where( valid, filled, 1. ) ), riegel )
+    # only one distance: the usual exponent through its effort
+    single = riegel.sum( axis = 1 ) == 1
+    longest = np.where( single, ( np.where( riegel, dist, 0. ) ).argmax( axis = 1 ), 0 )
+    rows = np.arange( best.shape[0] )
+    exponent = np.where( single, riegel_exponent, exponent )
+    log_scale = np.where( single, np.log( best[ rows, longest ] ) - riegel_exponent * np.log( dist[ rows, longest ] ), log_scale )
+
+  critical = valid & ( filled >= _cs_durations[0] ) & ( filled <= _cs_durations[1] )
+  speed, dprime = _masked_line( filled, dist, critical )
+  return { "RiegelExponent": exponent, "RiegelScale": np.exp( log_scale ), "CriticalSpeed": speed, "Dprime": dprime }
+
+def predict( models ):
+  '''Predicted race times in seconds from fit_models(): dictionary of race name -> array, NaN if no fit.'''
+  return dict( ( name, models[ "RiegelScale" ] * distance ** models[ "RiegelExponent" ] )
+               for name, distance in race_distances )
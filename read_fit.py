@@ -1,8 +1,10 @@
 import os
 import logging
 import sys                    
+import argparse
 from run_record import *
-import matplotlib.pyplot as plt
+from intervals import is_interval_session
+from lazy_import import pyplot as plt # matplotlib is only imported when a plot is made
   
 
 def draw_xyplot(xlist, ylist, xlab, ylab, title, out, leg, legloc = 'upper right', xsize_inch = 10, ysize_inch = 8, scatter = False):
@@ -63,6 +65,7 @@ class read_fit:
     self._time_list = [] 
     self._alti_list = [] 
     self._pace_list = [] 
+    self._pace5_list = [] 
     self._hart_list = [] 
     self._cade_list = [] 
     self._sped_list = [] 
@@ -79,8 +82,8 @@ class read_fit:
         self._EndTime = self._rrd.getEndTime()
       if "altitude" in measured_list:
         self._AverageAltitude = self._rrd.getAverageAltitude()
-        self._AssendMeters = self._rrd.getAssendMeters()
-        self._DesendMeters = self._rrd.getDesendMeters()
+        self._AssendMeters = self._rrd.getAscendMeters()
+        self._DesendMeters = self._rrd.getDescendMeters()
       if "speed" in measured_list:
         self._FastestKmTime = self._rrd.getFastestKmTime()
         self._MinimumSpeed = self._rrd.getMinimumSpeed()
@@ -106,9 +109,11 @@ class read_fit:
 
       self._time_list = self._rrd.getElapsedMinutesList()
       self._alti_list = self._rrd.getAltitudeList()
-      self._pace_list = self._rrd.getPaceKmList()
-      self._hart_list = self._rrd.getHeartRateList()
-      self._cade_list = self._rrd.getCadenceList()
+      # rolling means over 30 seconds of time, the values of each record are too noisy
+      self._pace_list = self._rrd.getRollingPaceKmList( 30. )
+      self._pace5_list = self._rrd.getRollingPaceKmList( 300. )
+      self._hart_list = self._rrd.getRollingHeartRateList( 30. )
+      self._cade_list = self._rrd.getRollingCadenceList( 30. )
       self._sped_list = self._rrd.getSpeedList()
       self._dist_list = self._rrd.getDistanceList()
    
@@ -159,6 +164,20 @@ class read_fit:
     if "distance" in measured_list:
       f.write( " the total distance is: %.1f miles.  \n" % self._TotalDistanceMile )
       f.write( " the total distance is: %.1f km.  \n" % self._TotalDistanceKm )
+    if "time" in measured_list:
+      # every second of the moving time counts the same, whatever the recording rate of the device
+      for name, value in self._rrd.getTimeWeightedAverages().items():
+        if value is not None:
+          f.write( " the time-weighted %s is: %.2f \n" % ( name, value ) )
+    reps = self._rrd.getIntervals()
+    if is_interval_session( reps ):
+      f.write( " interval session of %d work reps:\n" % sum( 1 for rep in reps if rep[ "Kind" ] == "work" ) )
+      f.write( "   kind      start(h:m:s)  time(h:m:s)  distance(m)  pace(h:m:s per Km)  heart rate(bpm)\n" )
+      for rep in reps:
+        f.write( "   %-8s  %s  %s  %.0f  %s  %s\n" % ( rep[ "Kind" ] + ( " %d" % rep[ "Rep" ] if rep[ "Rep" ] else "" ),
+          timedelta( seconds = int( rep[ "StartSeconds" ] ) ), timedelta( seconds = int( rep[ "Seconds" ] ) ), rep[ "Meters" ],
+          timedelta( seconds = int( rep[ "PaceKm" ] * 60. ) ) if rep[ "PaceKm" ] else "-",
+          "%.0f" % rep[ "AverageHeartRate" ] if rep[ "AverageHeartRate" ] else "-" ) )
   
     f.close()
    
@@ -200,9 +219,30 @@ class read_fit:
     # 
     if "speed" in measured_list and "time" in measured_list:
       draw_xyplot( self._time_list, self._pace_list, 
-        xlab = "Elapsed Time (minutes)", ylab = "Pace (minutes per Km)", title = title_name,
+        xlab = "Elapsed Time (minutes)", ylab = "Pace (minutes per Km), 30 seconds", title = title_name,
         out = outdir+"/"+outtime_tag+"_pace_v_time.pdf", leg = None)
+      draw_xyplot( self._time_list, self._pace5_list, 
+        xlab = "Elapsed Time (minutes)", ylab = "Pace (minutes per Km), 5 minutes", title = title_name,
+        out = outdir+"/"+outtime_tag+"_pace5min_v_time.pdf", leg = None)
   
+    # 
+    # Plot the pace of each work and recovery rep over the pace vs time
+    # 
+    reps = self._rrd.getIntervals()
+    if "speed" in measured_list and "time" in measured_list and is_interval_session( reps ):
+      plt.clf()
+      plt.gcf().set_size_inches(10, 8)
+      plt.plot( self._time_list, self._pace_list, color = 'grey', linewidth = 1, label = '30 seconds' )
+      for rep in reps:
+        if not rep[ "PaceKm" ]: continue
+        begin = rep[ "StartSeconds" ] / 60.
+        plt.hlines( rep[ "PaceKm" ], begin, begin + rep[ "Seconds" ] / 60., linewidth = 3,
+          color = 'red' if rep[ "Kind" ] == "work" else 'blue' )
+      plt.xlabel( "Elapsed Time (minutes)" )
+      plt.ylabel( "Pace (minutes per Km), work (red) and recovery (blue) reps" )
+      plt.title( title_name )
+      plt.savefig( outdir+"/"+outtime_tag+"_intervals_v_time.pdf" )
+
     # 
     # Plot heart rate vs time
     # 
@@ -228,33 +268,34 @@ class read_fit:
         out = outdir+"/"+outtime_tag+"_pace_v_cadence.pdf", leg = None, scatter = True)
   
 def main():
-  if len(sys.argv) < 2:
-    print 'Usage: ', sys.argv[0], ' [ a.fit ] [out_dir] ' 
-    return 0
+  parser = argparse.ArgumentParser( description = 'Summary and plots of one run from a *fit* file.' )
+  parser.add_argument( 'input', help = 'the *fit* input' )
+  parser.add_argument( 'outdir', nargs = '?', default = '.', help = 'output folder' )
+  parser.add_argument( '--no-plots', action = 'store_true', help = 'only write the summary, never import matplotlib' )
+  args = parser.parse_args()
 
-  if '.fit' not in sys.argv[1]:
-    print 'Usage: ', sys.argv[0], ' [ a.fit ] [out_dir] ' 
+  if '.fit' not in args.input:
+    print 'Usage: ', sys.argv[0], ' [ a.fit ] [out_dir] [--no-plots] ' 
     return 1
 
-  outdir = '.'
-  if len(sys.argv) >= 3:
-    outdir = sys.argv[2]
-
+  outdir = args.outdir
   if outdir == "": outdir = "."
   elif not os.path.isdir( outdir ):
     logging.warning('Output folder: ' + outdir + ' NOT found. Create one now! ')
     os.makedirs( outdir )
 
 
-  rrf = read_fit( sys.argv[1] )
-  print 'Reading input: ', sys.argv[1], '.'
+  rrf = read_fit( args.input )
+  print 'Reading input: ', args.input, '.'
   if rrf.isValid() is None:
-    print 'input ', sys.argv[1], ' not correct.'
+    print 'input ', args.input, ' not correct.'
     return None
 
   print 'Start writing summary to: ', outdir, '.'
   rrf.write_summary( outdir )
 
+  if args.no_plots:
+    return None
   print 'Start making plots to: ', outdir, '.'
   rrf.draw( outdir )
       
@@ -14,7 +14,22 @@ import os
 import logging
 import sys                    
 from run_record import *
+from run_cache import run_cache, file_stamp
+from mean_max import mean_max_envelope
+from batch_journal import batch_journal
+from run_worker import decode_runs
+from shared_traces import shared_run
+from activity_dedup import drop_duplicates
+from activity_type import select_sports
+from session_index import session_summary
+from efficiency import efficiency_batch
+from race_predictor import best_efforts, effort_distances, effort_version
+from histograms import pooled_histograms, run_histograms, merge_histograms
+from intervals import detect_intervals
+from route_clusters import course_index
+from elevation import corrected_climb
 import datetime
+import numpy as np
   
 class read_sequence:
   '''Document for class read_sequence
@@ -26,9 +41,37 @@ class read_sequence:
       * The average cadence during each run
   '''
 
-  def __init__(self, fit_input_name ):
+  #
+  # measured variable and the summary quantity telling if it is measured
+  #
+  _measure_keys = [ ( "altitude", "AscendMeters" ), ( "cadence", "AverageCadence" ), ( "distance", "TotalDistanceMeter" ),
+                    ( "heart_rate", "AverageHeartRate" ), ( "speed", "AverageSpeed" ), ( "time", "StartTime" ) ]
+
+  def __init__(self, fit_input_name, cache_dir = None, journal_name = None, restart = False, retry_errors = False,
+               timeout = None, jobs = 1, dedup = True, prefer_sources = None, sports = None, guess_sport = True,
+               index_mode = False ):
     '''Constructor of class read_sequence.
       Parameter fit_input_name
+      Parameter cache_dir: folder to keep the per-run quantities between two jobs, None to keep them in memory.
+      Parameter journal_name: journal of the outcome of each input (batch_journal). The inputs done by a previous
+                job with the same journal are not decoded again. None for no journal.
+      Parameter restart: forget the outcomes in the journal and decode all the inputs.
+      Parameter retry_errors: decode again the inputs which failed (error or timeout) in a previous job.
+      Parameter timeout: time limit in seconds to decode one input, each input is then decoded in its own
+                process (run_worker). None to decode in this process.
+      Parameter jobs: number of inputs decoded at the same time in worker processes.
+      Parameter dedup: keep only one input for each activity, e.g. when both the garmin and the strava exports
+                of a run are given (activity_dedup). The copies are found before decoding, and never decoded.
+      Parameter prefer_sources: list of patterns of the file name or device manufacturer, the copy matching
+                the earliest pattern is kept, e.g. [ "garmin", "strava" ].
+      Parameter sports: list of the sports to keep, e.g. [ "running" ]. The sport is read from the header
+                messages (activity_type), the other activities are rejected before their records are decoded.
+                None to keep all the activities.
+      Parameter guess_sport: classify from the speed profile the inputs with no sport written.
+      Parameter index_mode: take the per-run summaries from the session and lap messages (session_index) and
+                never decode the records. Only the inputs without a session message are decoded. The
+                quantities made from the records (mean-maximal curve, traces) are then only given for the
+                runs found in the cache.
     '''
     self._TheRuns           = [ ]
     self._TotalTimePassed   = [ ] 
@@ -58,6 +101,13 @@ class read_sequence:
     self._AverageHeartRate  = [ ]
     self._TotalDistanceMile = [ ]
     self._TotalDistanceKm   = [ ]
+    self._MeanMaxSpeed      = [ ]
+    self._Summaries         = [ ]
+    self._Sources           = [ ]
+    self._MeanMaxEnvelope   = mean_max_envelope()
+    self._number_runs       = 0
+    self._cache             = run_cache( cache_dir )
+    self._index_mode        = index_mode
  
     #
     # supported list: "altitude", "cadence", "distance", "heart_rate", "speed", "time"
@@ -88,73 +138,393 @@ class read_sequence:
             logging.warning( 'file: ' + line[:-1] + ' from input: ' + fit_input_name + ' is not a fit file.')
             continue
  
-    for ffitname in fitfiles_list:
-      _rrd = run_record( ffitname )
-      if _rrd is None:
-        logging.warning( ' Input ' + ffitname + ' has no record installed. Check! ')
-        continue
-      else:
-        if len( self._MeasuredList ) <= 0:
-          self._MeasuredList  = _rrd.getListMeasures()
-        selected = True
-        if "distance" not in self._MeasuredList or _rrd.getTotalDistanceKm() < 2.0:
-          selected = False
-        if "speed" not in self._MeasuredList or _rrd.getAverageSpeed() < 0.1:
-          selected = False
-
-        if not selected:
-            logging.warning( ' Input %s found distance %.1f, average speed %.1f. Failed to pass selection. Skip!', ffitname, _rrd.getTotalDistanceKm(), _rrd.getAverageSpeed() )
-            continue
+    self._Duplicates = [ ]
+    self._OtherSports = [ ]
+    self._Courses = None
+    self._options = { "dedup": dedup, "prefer_sources": prefer_sources, "sports": sports, "guess_sport": guess_sport,
+                      "retry_errors": retry_errors, "timeout": timeout, "jobs": jobs, "cache_dir": cache_dir }
+    self._journal = None
+    if journal_name is not None:
+      self._journal = batch_journal( journal_name, restart = restart )
+    self._readInputs( fitfiles_list )
+
+    logging.info( ' Number of runs loaded: %d ', self._number_runs )
+
+  def _resumeStatus(self, ffitname, retry_errors ):
+    '''Outcome of the file in a previous job, None if it has to be decoded.'''
+    if self._journal is None:
+      return None
+    status = self._journal.getStatus( ffitname )
+    if status == "ok" and self._cache.get( ffitname, "summary" ) is None:
+      # a summary from the session is good enough for an index job, not for a full one
+      if not self._index_mode or self._cache.get( ffitname, "index_summary" ) is None:
+        return None
+    if status in ( "error", "timeout" ) and retry_errors:
+      return None
+    return status
+
+  def _readInputs(self, fitfiles_list, known = None ):
+    '''Select the inputs (sports, then copies), resume them from the journal, index or decode them, and add the
+      runs passing the selection.
+      Parameter known: the files already read, the copies of which are dropped.
+      Return the number of runs added.
+    '''
+    options = self._options
+    before = self._number_runs
+    #
+    # the other sports are rejected before anything else, from the header messages only: also the inputs done
+    # by a previous job, which may have asked for other sports (the sport of each input is in the cache), and
+    # before the copies are found, which reads the records of each input
+    #
+    if options[ "sports" ] is not None:
+      fitfiles_list, others = select_sports( fitfiles_list, options[ "sports" ], options[ "guess_sport" ], self._cache )
+      self._OtherSports.extend( others )
 
+    if options[ "dedup" ]:
+      fitfiles_list, duplicates = drop_duplicates( fitfiles_list, options[ "prefer_sources" ], self._cache, known )
+      self._Duplicates.extend( duplicates )
 
-        if "distance" in self._MeasuredList:
-          self._TotalDistanceMile.append( _rrd.getTotalDistanceMile() )
-          self._TotalDistanceKm.append( _rrd.getTotalDistanceKm() )
-        if "time" in self._MeasuredList:
-          self._TotalTimePassed.append( _rrd.getTotalTimePassed() )
-          self._TotalTimeMoving.append( _rrd.getTotalTimeMoving() )
-          self._StartTime.append( _rrd.getStartTime() )
-          self._EndTime.append( _rrd.getEndTime() )
-        if "altitude" in self._MeasuredList:
-          self._AverageAltitude.append( _rrd.getAverageAltitude() )
-          self._AscendMeters.append( _rrd.getAscendMeters() )
-          self._DescendMeters.append( _rrd.getDescendMeters() )
-        if "speed" in self._MeasuredList:
-          self._FastestKmTime.append( _rrd.getFastestKmTime() )
-          self._MinimumSpeed.append( _rrd.getMinimumSpeed() )
-          self._MaximumSpeed.append( _rrd.getMaximumSpeed() )
-          self._AverageSpeed.append( _rrd.getAverageSpeed() )
-          self._MinimumPaceKm.append( _rrd.getMinimumPaceKm() )
-          self._MaximumPaceKm.append( _rrd.getMaximumPaceKm() )
-          self._AveragePaceKm.append( _rrd.getAveragePaceKm() )
-          self._fltAveragePaceKm.append( _rrd.getAveragePaceKm().total_seconds() / 60. )
-          self._MinimumPaceMile.append( _rrd.getMinimumPaceMile() )
-          self._MaximumPaceMile.append( _rrd.getMaximumPaceMile() )
-          self._AveragePaceMile.append( _rrd.getAveragePaceMile() )
-          self._fltAveragePaceMile.append( _rrd.getAveragePaceMile().total_seconds() / 60. )
-        if "cadence" in self._MeasuredList:
-          self._MinimumCadence.append( _rrd.getMinimumCadence() )
-          self._MaximumCadence.append( _rrd.getMaximumCadence() )
-          self._AverageCadence.append( _rrd.getAverageCadence() )
-        if "heart_rate" in self._MeasuredList:
-          self._MinimumHeartRate.append( _rrd.getMinimumHeartRate() )
-          self._MaximumHeartRate.append( _rrd.getMaximumHeartRate() )
-          self._AverageHeartRate.append( _rrd.getAverageHeartRate() )
-        #
-        # at the end, keep also the run!
-        #
-        self._TheRuns.append( _rrd )
-
-    self._number_runs = len( self._TheRuns )
-    logging.info( ' Number of runs loaded  ' + ffitname + ' has no record installed. Check! ')
-   
+    #
+    # files done by a previous job with the same journal are taken from the cache
+    #
+    resumed = { }
+    for ffitname in fitfiles_list:
+      status = self._resumeStatus( ffitname, options[ "retry_errors" ] )
+      if status is not None:
+        resumed[ ffitname ] = status
+    todo = [ ffitname for ffitname in fitfiles_list if ffitname not in resumed ]
+    # the other sports are not written to the journal: the next job may ask for other sports
+    logging.info( ' Number of inputs of other sports: %d, done by a previous job: %d, to decode: %d ',
+                  len( self._OtherSports ), len( resumed ), len( todo ) )
+
+    indexed = { }
+    if self._index_mode:
+      for ffitname in todo:
+        summary = self._indexSummary( ffitname )
+        if summary is not None:
+          indexed[ ffitname ] = summary # ( summary, source )
+      todo = [ ffitname for ffitname in todo if ffitname not in indexed ]
+      logging.info( ' Number of inputs indexed from their session: %d, to decode: %d ', len( indexed ), len( todo ) )
+
+    decoded = decode_runs( todo, timeout = options[ "timeout" ], jobs = options[ "jobs" ], cache_dir = options[ "cache_dir" ] )
+    for ffitname in fitfiles_list:
+      if ffitname in resumed:
+        if resumed[ ffitname ] == "ok":
+          summary, source = self._cache.get( ffitname, "summary" ), "full"
+          if summary is None: summary, source = self._cache.get( ffitname, "index_summary" ), "index"
+          self._addSummary( summary, self._cache.get( ffitname, "mean_max" ), source )
+        continue
+      if ffitname in indexed:
+        self._addIndexed( ffitname, indexed[ ffitname ] )
+        continue
+      self._addDecoded( *next( decoded ) )
+    if self._journal is not None:
+      self._journal.close()
+    return self._number_runs - before
+
+  def addRuns(self, fitfiles_list ):
+    '''Read more .fit files and add the runs passing the selection of the constructor: the same sports, the
+      same index mode, and no copy of an activity already read (dedup).
+
+      The per-run quantities kept in the cache (e.g. the mean-maximal curve) are only calculated for files
+      that are new or modified, so adding runs never re-calculates the older ones.
+      Return the number of runs added.
+    '''
+    return self._readInputs( fitfiles_list, known = [ summary[ "FileName" ] for summary in self._Summaries ] )
+
+  def addRun(self, ffitname ):
+    '''Read one more .fit file, see addRuns(). Return True if the run is added.'''
+    return self.addRuns( [ ffitname ] ) > 0
+
+  def _addDecoded(self, ffitname, status, _rrd, message ):
+    '''Add a decoded run if it passes the selection, and record the outcome in the journal.'''
+    if status != "ok":
+      logging.error( ' Input ' + ffitname + ' failed to decode (' + status + '): ' + str( message ).strip().splitlines()[-1] + ' Skip! ' )
+      self._record( ffitname, status, message )
+      return False
+
+    summary = _rrd.getSummary()
+    if len( self._MeasuredList ) <= 0:
+      self._MeasuredList  = _rrd.getListMeasures()
+    selected = True
+    if "distance" not in self._MeasuredList or _rrd.getTotalDistanceKm() < 2.0:
+      selected = False
+    if "speed" not in self._MeasuredList or _rrd.getAverageSpeed() < 0.1:
+      selected = False
+
+    if not selected:
+      logging.warning( ' Input %s found distance %.1f, average speed %.1f. Failed to pass selection. Skip!', ffitname, _rrd.getTotalDistanceKm(), _rrd.getAverageSpeed() )
+      self._record( ffitname, "rejected" )
+      return False
+
+    mean_max = None
+    if "distance" in self._MeasuredList and "time" in self._MeasuredList:
+      mean_max = self._cache.get( ffitname, "mean_max" )
+      if mean_max is None:
+        mean_max = _rrd.getMeanMaxSpeedList()
+        self._cache.put( ffitname, "mean_max", mean_max )
+    traces = _rrd.getTraces()
+    # None: put in the cache by the worker (run_worker)
+    if traces is not None:
+      self._cache.put( ffitname, "traces", traces )
+    self._putRoute( ffitname, _rrd.getRoute() )
+    self._cache.put( ffitname, "summary", summary )
+    self._addSummary( summary, mean_max, "full" )
+    #
+    # at the end, keep also the run! A run of a worker drops its shared block, its traces are in the cache
+    #
+    if isinstance( _rrd, shared_run ):
+      _rrd.release()
+    self._TheRuns.append( _rrd )
+    self._record( ffitname, "ok" )
+    return True
+
+  def _indexSummary(self, ffitname ):
+    '''( summary of the run from its session message or from a previous decoding, "index" or "full" ), None if
+      the records have to be decoded.'''
+    summary = self._cache.get( ffitname, "summary" )
+    if summary is not None:
+      return summary, "full"
+    summary = self._cache.get( ffitname, "index_summary" )
+    if summary is not None:
+      return summary, "index"
+    try:
+      summary = session_summary( ffitname )
+    except Exception as err:
+      # e.g. a cut file: its decoding will report the error
+      logging.warning( ' Input ' + ffitname + ' has no session summary: ' + str( err ) )
+      return None
+    if summary is None:
+      return None
+    self._cache.put( ffitname, "index_summary", summary )
+    return summary, "index"
+
+  def _addIndexed(self, ffitname, indexed ):
+    '''Add a run indexed from its session message if it passes the selection, and record it in the journal.'''
+    summary, source = indexed
+    distance = summary[ "TotalDistanceKm" ]
+    speed = summary[ "AverageSpeed" ]
+    if distance is None or distance < 2.0 or speed is None or speed < 0.1:
+      logging.warning( ' Input %s found distance %s Km, average speed %s m/s. Failed to pass selection. Skip!', ffitname, distance, speed )
+      self._record( ffitname, "rejected" )
+      return False
+    self._addSummary( summary, self._cache.get( ffitname, "mean_max" ), source )
+    self._record( ffitname, "ok" )
+    return True
+
+  def _record(self, ffitname, status, message = None ):
+    if self._journal is not None:
+      self._journal.record( ffitname, status, message )
+
+  def _addSummary(self, summary, mean_max = None, source = "full" ):
+    '''Add the per-run quantities of one selected run, from its run_record.getSummary() ("full") or from its
+      session message ("index", session_index.session_summary()). A quantity the run did not measure is None
+      in the lists (e.g. no heart rate strap for this run): the users of the lists leave them out.'''
+    if len( self._MeasuredList ) <= 0:
+      self._MeasuredList = [ measure for measure, name in self._measure_keys if summary[ name ] is not None ]
+
+    if "distance" in self._MeasuredList:
+      self._TotalDistanceMile.append( summary[ "TotalDistanceMile" ] )
+      self._TotalDistanceKm.append( summary[ "TotalDistanceKm" ] )
+    if "time" in self._MeasuredList:
+      self._TotalTimePassed.append( summary[ "TotalTimePassed" ] )
+      self._TotalTimeMoving.append( summary[ "TotalTimeMoving" ] )
+      self._StartTime.append( summary[ "StartTime" ] )
+      self._EndTime.append( summary[ "EndTime" ] )
+    if "altitude" in self._MeasuredList:
+      self._AverageAltitude.append( summary[ "AverageAltitude" ] )
+      self._AscendMeters.append( summary[ "AscendMeters" ] )
+      self._DescendMeters.append( summary[ "DescendMeters" ] )
+    if "speed" in self._MeasuredList:
+      self._FastestKmTime.append( summary[ "FastestKmTime" ] )
+      self._MinimumSpeed.append( summary[ "MinimumSpeed" ] )
+      self._MaximumSpeed.append( summary[ "MaximumSpeed" ] )
+      self._AverageSpeed.append( summary[ "AverageSpeed" ] )
+      self._MinimumPaceKm.append( summary[ "MinimumPaceKm" ] )
+      self._MaximumPaceKm.append( summary[ "MaximumPaceKm" ] )
+      self._AveragePaceKm.append( summary[ "AveragePaceKm" ] )
+      self._fltAveragePaceKm.append( None if summary[ "AveragePaceKm" ] is None else summary[ "AveragePaceKm" ].total_seconds() / 60. )
+      self._MinimumPaceMile.append( summary[ "MinimumPaceMile" ] )
+      self._MaximumPaceMile.append( summary[ "MaximumPaceMile" ] )
+      self._AveragePaceMile.append( summary[ "AveragePaceMile" ] )
+      self._fltAveragePaceMile.append( None if summary[ "AveragePaceMile" ] is None else summary[ "AveragePaceMile" ].total_seconds() / 60. )
+    if "cadence" in self._MeasuredList:
+      self._MinimumCadence.append( summary[ "MinimumCadence" ] )
+      self._MaximumCadence.append( summary[ "MaximumCadence" ] )
+      self._AverageCadence.append( summary[ "AverageCadence" ] )
+    if "heart_rate" in self._MeasuredList:
+      self._MinimumHeartRate.append( summary[ "MinimumHeartRate" ] )
+      self._MaximumHeartRate.append( summary[ "MaximumHeartRate" ] )
+      self._AverageHeartRate.append( summary[ "AverageHeartRate" ] )
+    if mean_max is not None:
+      self._MeanMaxSpeed.append( mean_max )
+      self._MeanMaxEnvelope.add( mean_max, summary[ "StartTime" ] )
+    self._Summaries.append( summary )
+    self._Sources.append( "%s/%d" % ( source, self._cache._version ) )
+    self._number_runs = len( self._Summaries )
+ 
   def size(self):
     return self._number_runs
 
   def getTheRuns(self):
-    ''' Return the list of instances for each run_record '''
+    ''' Return the list of instances for each run_record decoded by this job (not the ones resumed from the journal).
+        The runs decoded by worker processes (shared_traces.shared_run) have no traces left: see getTraces() '''
     return self._TheRuns           
 
+  def getSummaries(self):
+    ''' Return the list of per-run summaries (run_record.getSummary()) for each run '''
+    return self._Summaries
+
+  def getSources(self):
+    ''' Return the list of the source of the summary of each run: "full/<run_cache version>" from the records,
+        "index/<run_cache version>" from the session message. A product made from the summary changes with it '''
+    return self._Sources
+
+  def getTrace(self, idx ):
+    ''' Return the traces (run_record.getTraces()) of the run idx from the cache, None if not decoded '''
+    return self._cache.get( self._Summaries[ idx ][ "FileName" ], "traces" )
+
+  def getTraces(self):
+    ''' Return the list of traces (run_record.getTraces()) for each run, also for the runs resumed from the journal.
+        All of them are then in memory: to go over many runs, getTrace() one run at a time '''
+    return [ self.getTrace( idx ) for idx in range( len( self._Summaries ) ) ]
+
+  def getOtherSports(self):
+    ''' Return the list of ( rejected input, sport ) of the inputs of other sports, never decoded '''
+    return self._OtherSports
+
+  def getEfficiency(self):
+    ''' Return the list of the efficiency metrics (efficiency.metric_names) of each run. The runs not in the
+        cache are calculated together in one batch, from their cached traces '''
+    metrics = [ self._cache.get( summary[ "FileName" ], "efficiency" ) for summary in self._Summaries ]
+    missing = [ idx for idx, metric in enumerate( metrics ) if metric is None ]
+    if len( missing ) > 0:
+      traces = [ self._cache.get( self._Summaries[ idx ][ "FileName" ], "traces" ) for idx in missing ]
+      for idx, trace, metric in zip( missing, traces, efficiency_batch( traces ) ):
+        metrics[ idx ] = metric
+        # not kept without traces (e.g. index mode): a later full job can still calculate it
+        if trace is not None:
+          self._cache.put( self._Summaries[ idx ][ "FileName" ], "efficiency", metric )
+    return metrics
+
+  def getBestEfforts(self):
+    ''' Return the list of the best efforts (race_predictor.best_efforts(), seconds for each of the
+        race_predictor.effort_distances) of each run, None without distance. Extracted once per file and cached
+        with the distances and the race_predictor.effort_version they were made with '''
+    efforts = [ ]
+    for summary in self._Summaries:
+      cached = self._cache.get( summary[ "FileName" ], "best_efforts" )
+      if cached is not None and cached.get( "version" ) == effort_version \
+         and list( cached[ "distances" ] ) == list( effort_distances ):
+        efforts.append( cached[ "seconds" ] )
+        continue
+      traces = self._cache.get( summary[ "FileName" ], "traces" )
+      seconds = best_efforts( traces )
+      if traces is not None:
+        self._cache.put( summary[ "FileName" ], "best_efforts", { "version": effort_version,
+                         "distances": list( effort_distances ), "seconds": seconds } )
+      efforts.append( seconds )
+    return efforts
+
+  def getIntervals(self):
+    ''' Return the list of the reps (intervals.detect_intervals()) of each run, None without traces.
+        Found once per file and cached '''
+    intervals = [ ]
+    for summary in self._Summaries:
+      reps = self._cache.get( summary[ "FileName" ], "intervals" )
+      if reps is None:
+        traces = self._cache.get( summary[ "FileName" ], "traces" )
+        reps = detect_intervals( traces )
+        if traces is not None:
+          self._cache.put( summary[ "FileName" ], "intervals", reps or [ ] )
+      intervals.append( reps )
+    return intervals
+
+  def findCourses(self, state_name = None ):
+    ''' Return the list of the course id (route_clusters.course_index) of each run, None without route.
+        The runs already in the state (a JSON file, None: in memory only) keep their course, only the new or
+        modified runs are assigned '''
+    index = course_index( state_name )
+    missing = [ idx for idx, summary in enumerate( self._Summaries ) if not index.hasRun( summary[ "FileName" ],
+                file_stamp( summary[ "FileName" ] ) if os.path.isfile( summary[ "FileName" ] ) else None ) ]
+    if len( missing ) > 0:
+      # only the routes of the new runs are read, the archive is not touched
+      for idx in missing:
+        fname = self._Summaries[ idx ][ "FileName" ]
+        index.addRun( fname, self.getRoute( idx ), file_stamp( fname ) if os.path.isfile( fname ) else None )
+      index.save()
+    self._Courses = [ index.getCourse( summary[ "FileName" ] ) for summary in self._Summaries ]
+    return self._Courses
+
+  def isIndexMode(self):
+    ''' Return True if the summaries are taken from the session messages, the records not decoded '''
+    return self._index_mode
+
+  def getCourses(self):
+    ''' Return the list of the course id of each run found by findCourses(), None if not called '''
+    return self._Courses
+
+  def getCorrectedClimb(self, dem ):
+    ''' Return the list of the ascent and descent of each run from the ground elevation of its positions
+        (elevation.corrected_climb()), None without position or tile. dem is an elevation.dem_tiles, shared by
+        all the runs. Kept in the cache when the tiles cover the run '''
+    folder = os.path.abspath( dem.getFolder() )
+    climbs = [ ]
+    for summary in self._Summaries:
+      cached = self._cache.get( summary[ "FileName" ], "dem_climb" )
+      if cached is not None and cached[ "folder" ] == folder:
+        climbs.append( cached[ "climb" ] )
+        continue
+      traces = self._cache.get( summary[ "FileName" ], "traces" )
+      total = corrected_climb( traces, dem )
+      # not kept if a tile is missing: it may be added later
+      if total is not None and total[ "Coverage" ] >= 0.95:
+        self._cache.put( summary[ "FileName" ], "dem_climb", { "folder": folder, "climb": total } )
+      climbs.append( total )
+    return climbs
+
+  def _putRoute(self, ffitname, route ):
+    '''Cache the simplified route of a run with its small products, apart from the traces: in float32 (within a
+      meter), a few Kbytes per run. An empty route marks a run without position. Return the route, None if empty.'''
+    route = np.zeros( ( 0, 2 ), dtype = np.float32 ) if route is None else np.asarray( route, dtype = np.float32 )
+    self._cache.put( ffitname, "route", route )
+    return route if len( route ) > 0 else None
+
+  def getRoute(self, idx ):
+    ''' Return the simplified route (run_record.getRoute()) of the run idx, None without position.
+        Kept in the cache with the summary when the run is decoded, never with the traces, so reading it does
+        not unpickle the records. A run not decoded (index mode) has None: the records are never decoded here '''
+    route = self._cache.get( self._Summaries[ idx ][ "FileName" ], "route" )
+    return route if route is not None and len( route ) > 0 else None
+
+  def getRoutes(self):
+    ''' Return the list of the simplified routes of each run (getRoute()), None without position '''
+    return [ self.getRoute( idx ) for idx in range( len( self._Summaries ) ) ]
+
+  def getPooledHistograms(self):
+    ''' Return the distributions over the moving records of all the runs (histograms.pooled_histograms()).
+        The accumulators of each run are filled once per file and cached with the small products, then
+        merged one run at a time: the traces are read only the first time, one run at a time '''
+    total = pooled_histograms()
+    for summary in self._Summaries:
+      accumulators = self._cache.get( summary[ "FileName" ], "histograms" )
+      if accumulators is None:
+        traces = self._cache.get( summary[ "FileName" ], "traces" )
+        if traces is None: continue # not decoded (index mode)
+        # empty for a run without speed, so that its traces are not read again at the next call
+        accumulators = run_histograms( traces ) or { }
+        self._cache.put( summary[ "FileName" ], "histograms", accumulators )
+      merge_histograms( total, accumulators )
+    return total
+
+  def getCache(self):
+    ''' Return the run_cache of the per-run quantities '''
+    return self._cache
+
+  def getDuplicates(self):
+    ''' Return the list of ( dropped input, kept input ) of the inputs recording the same activity '''
+    return self._Duplicates
+
   def getMeasuredList(self):
     ''' Return the list of measured variables: 
         altitude, cadence, distance, heart_rate, speed, time  
@@ -268,6 +638,14 @@ class read_sequence:
   def getTotalDistanceKm(self):
     ''' Return the list of total distance in Km for each run '''
     return self._TotalDistanceKm   
+
+  def getMeanMaxSpeed(self):
+    ''' Return the list of mean-maximal speed curves in m/s for each run '''
+    return self._MeanMaxSpeed
+
+  def getMeanMaxEnvelope(self):
+    ''' Return the all-time mean-maximal envelope (class mean_max_envelope) of the runs '''
+    return self._MeanMaxEnvelope
   
 def main():
   '''
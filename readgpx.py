@@ -1,45 +1,63 @@
 #!/usr/bin/env python
 
+import sys
+import argparse
 import gpxpy
-import matplotlib.pyplot as plt
 # import datetime
 # from geopy import distance
 # from math import sqrt, floor
 import numpy as np
-import pandas as pd
 # import plotly.plotly as py
 # import plotly.graph_objs as go
 # import haversine
-from mpl_toolkits.basemap import Basemap
-
-
-gpx_file = open('data/533829103.gpx', 'r')
-gpx = gpxpy.parse(gpx_file)
-data = gpx.tracks[0].segments[0].points
-df = pd.DataFrame(columns=['lon', 'lat', 'alt', 'time'])
-ln = []
-lt = []
-for point in data:
-    df = df.append({'lon': point.longitude,
-                    'lat': point.latitude,
-                    'alt': point.elevation,
-                    'time': point.time},
-                   ignore_index=True)
-    ln.append(point.longitude)
-    lt.append(point.latitude)
-#    print("long:", point.longitude,
-#          "lati:", point.latitude,
-#          "alti:", point.elevation)
-
-print("longitude: (min, max)", np.min(ln), ",", np.max(ln))
-print("latitude: (min, max)", np.min(lt), ",", np.max(lt))
-
-m = Basemap(resolution='c',  # c, l, i, h, f or None
-            projection='merc',
-            lon_0=-93.625, lat_0=42.035,
-            llcrnrlon=-93.7, llcrnrlat=42.02,
-            urcrnrlon=-93.55, urcrnrlat=42.05)
-m.arcgisimage(service='ESRI_Imagery_World_2D', xpixels=1500, verbose=True)
-
-plt.plot(df['lon'], df['lat'])
-plt.show()
+from lazy_import import lazy_module, pyplot as plt
+
+# pandas and Basemap are only needed for the plot, import them when it is made
+pd = lazy_module('pandas')
+basemap = lazy_module('mpl_toolkits.basemap')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print the range of a gpx track and draw it on a map.')
+    parser.add_argument('input', nargs='?', default='data/533829103.gpx', help='the gpx input')
+    parser.add_argument('--no-plots', action='store_true', help='only print the ranges, never import matplotlib')
+    args = parser.parse_args()
+
+    gpx_file = open(args.input, 'r')
+    gpx = gpxpy.parse(gpx_file)
+    data = gpx.tracks[0].segments[0].points
+    ln = []
+    lt = []
+    for point in data:
+        ln.append(point.longitude)
+        lt.append(point.latitude)
+    #    print("long:", point.longitude,
+    #          "lati:", point.latitude,
+    #          "alti:", point.elevation)
+
+    print("longitude: (min, max)", np.min(ln), ",", np.max(ln))
+    print("latitude: (min, max)", np.min(lt), ",", np.max(lt))
+
+    if args.no_plots:
+        return 0
+
+    df = pd.DataFrame({'lon': [point.longitude for point in data],
+                       'lat': [point.latitude for point in data],
+                       'alt': [point.elevation for point in data],
+                       'time': [point.time for point in data]},
+                      columns=['lon', 'lat', 'alt', 'time'])
+
+    m = basemap.Basemap(resolution='c',  # c, l, i, h, f or None
+                        projection='merc',
+                        lon_0=-93.625, lat_0=42.035,
+                        llcrnrlon=-93.7, llcrnrlat=42.02,
+                        urcrnrlon=-93.55, urcrnrlat=42.05)
+    m.arcgisimage(service='ESRI_Imagery_World_2D', xpixels=1500, verbose=True)
+
+    plt.plot(df['lon'], df['lat'])
+    plt.show()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
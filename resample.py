@@ -0,0 +1,86 @@
+## @package resample
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Put the measurements of a run on a uniform grid of time (1 Hz by default). \par
+#
+#  @detail
+#    Devices record every 1 to 4 seconds, and with "smart recording" only when something changes, so a
+#    mean over the records gives more weight to the stretches with more records. On a uniform grid every
+#    point stands for the same time: the mean over the grid is the time-weighted mean, whatever the device,
+#    and the traces of all the runs become arrays of the same step, easy to stack and to handle together.
+#
+#    The values are interpolated linearly between two records. Between two records further apart than
+#    max_gap seconds (a pause, a lost signal) the grid is filled as asked: "nan" (no value), "hold" (the
+#    value of the record before the gap) or "interp" (linear, as elsewhere). \par
+#
+
+import numpy as np
+
+gap_modes = ( "nan", "hold", "interp" )
+
+def resample( elapsed_seconds, traces, step = 1., max_gap = 10., gap = "nan" ):
+  '''Resample measurements on a uniform grid of time starting at the first record.
+
+    Parameters:
+    -- elapsed_seconds  increasing list of the time of each record in seconds.
+    -- traces           dictionary of name -> list of the values of each record (None if not measured).
+    -- step             seconds between two points of the grid.
+    -- max_gap          seconds between two records above which the grid points in between are in a gap.
+    -- gap              how the gaps are filled: "nan", "hold" or "interp".
+
+    Return: dictionary with "time" (the grid in seconds since the first record), "in_gap" (boolean array)
+            and one array per trace.
+  '''
+  if gap not in gap_modes:
+    raise ValueError( "gap " + str( gap ) + " not one of: " + ", ".join( gap_modes ) )
+  tsec = np.asarray( elapsed_seconds, dtype = float )
+  if tsec.size == 0:
+    out = { "time": np.zeros( 0 ), "in_gap": np.zeros( 0, dtype = bool ) }
+    for name in traces: out[ name ] = np.zeros( 0 )
+    return out
+  tsec = tsec - tsec[0]
+  grid = np.arange( 0., tsec[-1] + 0.5 * step, step )
+
+  # record before each grid point, and whether the grid point is inside a gap after it
+  before = np.clip( np.searchsorted( tsec, grid, side = 'right' ) - 1, 0, tsec.size - 1 )
+  after = np.minimum( before + 1, tsec.size - 1 )
+  in_gap = ( tsec[ after ] - tsec[ before ] > max_gap ) & ( grid > tsec[ before ] )
+
+  out = { "time": grid, "in_gap": in_gap }
+  for name, values in traces.items():
+    vals = np.array( [ np.nan if v is None else v for v in values ], dtype = float )
+    resampled = np.interp( grid, tsec, vals )
+    if gap == "nan":
+      resampled[ in_gap ] = np.nan
+    elif gap == "hold":
+      resampled[ in_gap ] = vals[ before[ in_gap ] ]
+    out[ name ] = resampled
+  return out
+
+def time_weighted_mean( values, select = None ):
+  '''Time-weighted mean of a resampled trace, over the grid points selected (e.g. moving) with a value.
+
+    Parameters:
+    -- values  resampled array, NaN where there is no value.
+    -- select  boolean array of the grid points to use, None for all.
+
+    Return: the mean, None if no grid point has a value.
+  '''
+  values = np.asarray( values, dtype = float )
+  keep = np.isfinite( values )
+  if select is not None:
+    keep = keep & select
+  if not np.any( keep ):
+    return None
+  return float( np.mean( values[ keep ] ) )
+
+def stack( resampled_runs, name ):
+  '''Stack one trace of many resampled runs (with the same step) into one array ( runs, longest run ),
+    padded with NaN after the end of the shorter runs.
+  '''
+  length = max( [ run[ name ].size for run in resampled_runs ] + [ 0 ] )
+  matrix = np.full( ( len( resampled_runs ), length ), np.nan )
+  for idx, run in enumerate( resampled_runs ):
+    matrix[ idx, :run[ name ].size ] = run[ name ]
+  return matrix
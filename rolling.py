@@ -0,0 +1,87 @@
+## @package rolling
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Rolling means over a window of time (e.g. 30 seconds or 5 minutes) of the measurements of a run. \par
+#
+#  @detail
+#    The records are 1 to 4 seconds apart and not evenly, so the window is a duration and not a number of
+#    records. The mean over the window ending at each record is time-weighted: a record stands for the time
+#    since the previous one. With the cumulative sums of value x time and of time, the mean over any window
+#    is a difference of two cumulative sums. The window starts only move forward, they are found for all the
+#    records at once (searchsorted of the sorted start times), and the partial first interval of each window
+#    is added. Apart from that one vectorised search, the cost is linear in the number of records whatever the
+#    window, also for a 24 hour activity.
+#    Records without a value (None or NaN) have no weight. \par
+#
+
+import numpy as np
+
+def _cumulative( tsec, values ):
+  '''Cumulative sums of value x time and of the time with a value, and the time weight of each record.'''
+  dt = np.concatenate( ( [ 0. ], np.diff( tsec ) ) )
+  valid = np.isfinite( values )
+  weight = np.where( valid, dt, 0. )
+  cum_value = np.cumsum( np.where( valid, values, 0. ) * weight )
+  cum_weight = np.cumsum( weight )
+  return cum_value, cum_weight, weight
+
+def rolling_mean( elapsed_seconds, values, window ):
+  '''Time-weighted mean of the values over the window of time ending at each record.
+
+    Parameters:
+    -- elapsed_seconds  increasing list (or array) of the time of each record in seconds.
+    -- values           list of the values of each record, None or NaN if not measured.
+    -- window           duration of the window in seconds. At the start of the run the window is shorter.
+
+    Return: numpy array of the mean for each record, NaN if the window has no value.
+  '''
+  tsec = np.asarray( elapsed_seconds, dtype = float )
+  vals = np.array( [ np.nan if v is None else v for v in values ], dtype = float )
+  if tsec.size == 0:
+    return np.zeros( 0 )
+  cum_value, cum_weight, weight = _cumulative( tsec, vals )
+
+  # window ( start, t_i ]: first record j ending after start, and the part of its interval inside the window
+  start = tsec - window
+  first = np.searchsorted( tsec, start, side = 'right' )
+  first = np.minimum( first, tsec.size - 1 )
+  prev = np.maximum( first - 1, 0 )
+  inside = np.clip( ( tsec[ first ] - start ) / np.maximum( tsec[ first ] - tsec[ prev ], 1e-9 ), 0., 1. )
+  inside = np.where( first == 0, 0., inside )
+  part_weight = weight[ first ] * inside
+  part_value = np.where( np.isfinite( vals[ first ] ), vals[ first ], 0. ) * part_weight
+
+  sum_value = cum_value - cum_value[ first ] + part_value
+  sum_weight = cum_weight - cum_weight[ first ] + part_weight
+  with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+    mean = np.where( sum_weight > 0., sum_value / sum_weight, vals )
+  return mean
+
+def rolling_speed( elapsed_seconds, distance, window ):
+  '''Average speed in m/s over the window of time ending at each record, from the distance covered.
+
+    Parameters:
+    -- elapsed_seconds  increasing list of the time of each record in seconds.
+    -- distance         list of the distance in meters of each record.
+    -- window           duration of the window in seconds.
+  '''
+  tsec = np.asarray( elapsed_seconds, dtype = float )
+  dist = np.maximum.accumulate( np.asarray( distance, dtype = float ) )
+  if tsec.size == 0:
+    return np.zeros( 0 )
+  start = np.maximum( tsec - window, tsec[0] )
+  covered = dist - np.interp( start, tsec, dist )
+  duration = tsec - start
+  with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+    return np.where( duration > 0., covered / duration, 0. )
+
+def pace_from_speed( speed, unit = 1000., slowest = 15. ):
+  '''Pace in minutes per Km (or per mile with unit = 1609.34) of an array of speeds in m/s.
+
+    A speed below unit / slowest minutes, e.g. standing still, is given the slowest pace, as in run_record.
+  '''
+  speed = np.asarray( speed, dtype = float )
+  with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+    pace = unit / speed / 60.
+  return np.where( np.isfinite( pace ) & ( pace < slowest ), pace, slowest )
@@ -0,0 +1,204 @@
+## @package route_clusters
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Group the runs by course ("all the runs of the river loop") from their routes, without tagging. \par
+#
+#  @detail
+#    * Signature of a run: the set of the geohash cells (about 150 m, 35 bits) its simplified route passes
+#      through, the route being filled with points every 50 m first. Two runs of the same course share most
+#      of their cells: the Jaccard similarity of the sets is high.
+#    * MinHash: for 64 hash functions h( x ) = ( a * x + b ) mod 2^64 (top 32 bits), the signature keeps the
+#      smallest hash of the cells. The fraction of equal values of two signatures estimates their Jaccard
+#      similarity. The hash functions come from a fixed seed, so the signatures kept in the state stay valid.
+#    * Locality sensitive hashing: the signature is cut into 16 bands of 4 values, and runs with an equal
+#      band are candidates (probability 1 - ( 1 - J^4 )^16: 0.98 for J = 0.7, 0.01 for J = 0.1). Only the
+#      candidates with an estimated similarity above 0.5 are joined, with a union-find: a course is a group of
+#      runs linked by similar routes. The cost is linear in the number of runs.
+#    * A new run is added to the buckets and joined to the courses of its candidates, nothing else is done
+#      again. The course id of a run is the number of the first run of its course (in the order added);
+#      when a new run links two courses, they become the one of the older run. \par
+#
+
+import os
+import json
+import binascii
+import logging
+import numpy as np
+from polyline import local_meters
+
+geohash_bits = 35     # 7 geohash characters, cells of about 150 m
+_spacing = 50.        # meters between the points filled along the route
+_num_hashes = 64
+_bands = 16           # _num_hashes = _bands * rows
+_similarity = 0.5     # smallest estimated Jaccard similarity of two runs of one course
+_seed = 20181001
+
+_random = np.random.RandomState( _seed )
+_hash_a = _random.randint( 1, 2 ** 62, _num_hashes ).astype( np.uint64 ) * np.uint64( 2 ) + np.uint64( 1 ) # odd
+_hash_b = _random.randint( 0, 2 ** 62, _num_hashes ).astype( np.uint64 )
+
+def geohash_cells( latitude, longitude, bits = geohash_bits ):
+  '''Geohash of each position as an integer of bits bits (the bits of the geohash string, interleaved
+    longitude and latitude, the longitude first).'''
+  lon_bits = ( bits + 1 ) // 2
+  lat_bits = bits // 2
+  xi = np.clip( ( ( np.asarray( longitude, dtype = float ) + 180. ) / 360. * 2 ** lon_bits ).astype( np.int64 ), 0, 2 ** lon_bits - 1 )
+  yi = np.clip( ( ( np.asarray( latitude, dtype = float ) + 90. ) / 180. * 2 ** lat_bits ).astype( np.int64 ), 0, 2 ** lat_bits - 1 )
+  code = np.zeros( xi.shape, dtype = np.int64 )
+  for bit in range( lon_bits - 1, -1, -1 ):
+    code = ( code << 1 ) | ( ( xi >> bit ) & 1 )
+    if bit < lat_bits:
+      code = ( code << 1 ) | ( ( yi >> bit ) & 1 )
+  return code
+
+def route_cells( route, spacing = _spacing ):
+  '''Sorted array of the geohash cells a route (polyline.simplify_route()) passes through.'''
+  if route is None or len( route ) < 2:
+    return np.zeros( 0, dtype = np.int64 )
+  latitude, longitude = route[ :, 0 ], route[ :, 1 ]
+  x, y = local_meters( latitude, longitude )
+  # fill each segment with points every spacing meters: the simplified segments can be long
+  steps = np.maximum( np.ceil( np.hypot( np.diff( x ), np.diff( y ) ) / spacing ).astype( int ), 1 )
+  segment = np.repeat( np.arange( steps.size ), steps )
+  fraction = ( np.arange( steps.sum() ) - np.repeat( np.cumsum( steps ) - steps, steps ) ) / np.repeat( steps, steps ).astype( float )
+  lat = np.concatenate( ( latitude[ segment ] + fraction * np.diff( latitude )[ segment ], latitude[ -1: ] ) )
+  lon = np.concatenate( ( longitude[ segment ] + fraction * np.diff( longitude )[ segment ], longitude[ -1: ] ) )
+  return np.unique( geohash_cells( lat, lon ) )
+
+def minhash( cells ):
+  '''MinHash signature of a set of cells: numpy array of _num_hashes uint32, None if the set is empty.'''
+  if len( cells ) == 0:
+    return None
+  values = np.asarray( cells ).astype( np.uint64 )
+  with np.errstate( over = 'ignore' ):
+    hashes = ( _hash_a[ :, None ] * values[ None, : ] + _hash_b[ :, None ] ) >> np.uint64( 32 )
+  return hashes.min( axis = 1 ).astype( np.uint32 )
+
+def similarity( first, second ):
+  '''Estimated Jaccard similarity of the cells of two runs from their signatures.'''
+  return float( np.mean( np.asarray( first ) == np.asarray( second ) ) )
+
+def _band_keys( signature ):
+  '''Bucket keys of the bands of a signature.'''
+  rows = _num_hashes // _bands
+  signature = np.asarray( signature, dtype = np.uint32 )
+  return [ "%d:%s" % ( band, binascii.hexlify( signature[ band * rows:( band + 1 ) * rows ].tostring() ) ) for band in range( _bands ) ]
+
+class course_index:
+  '''Document for class course_index
+
+    Purpose: the courses of the runs, with the signature of each run kept so that a new run is assigned
+    without clustering the archive again.
+    Example:
+      index = course_index( "out/courses.json" )
+      course = index.addRun( "a.fit", route, stamp )
+      index.save()
+      runs_of_course = index.getCourses()[ course ]
+  '''
+
+  def __init__(self, state_name = None, min_similarity = _similarity ):
+    '''Constructor of class course_index.
+      Parameter state_name: the JSON file of the state, read if found. None: only kept in memory.
+      Parameter min_similarity: smallest estimated Jaccard similarity of two runs joined in one course.
+    '''
+    self._state_name = state_name
+    self._min_similarity = min_similarity
+    self._files = [ ]      # file name of each node, in the order added
+    self._stamps = [ ]     # file stamp of each node
+    self._signatures = [ ] # MinHash signature of each node, None if replaced by a newer node of the same file
+    self._parent = [ ]     # union-find parent of each node
+    self._nodes = { }      # file name -> its current node
+    self._buckets = { }    # band key -> list of nodes
+    if state_name is not None and os.path.isfile( state_name ):
+      self._read()
+
+  def _read(self):
+    try:
+      with open( self._state_name ) as fp:
+        state = json.load( fp )
+    except ValueError:
+      logging.warning( ' Courses ' + self._state_name + ' are broken. Start from scratch. ')
+      return None
+    if state.get( "seed" ) != _seed or state.get( "bits" ) != geohash_bits or state.get( "min_similarity" ) != self._min_similarity:
+      logging.warning( ' Courses ' + self._state_name + ' were found with other settings. Start from scratch. ')
+      return None
+    self._files = state[ "files" ]
+    self._stamps = state[ "stamps" ]
+    self._parent = state[ "parent" ]
+    self._signatures = [ None if signature is None else np.array( signature, dtype = np.uint32 ) for signature in state[ "signatures" ] ]
+    for node, ffitname in enumerate( self._files ):
+      if self._signatures[ node ] is None: continue
+      self._nodes[ ffitname ] = node
+      for key in _band_keys( self._signatures[ node ] ):
+        self._buckets.setdefault( key, [ ] ).append( node )
+
+  def save(self):
+    '''Write the state to its JSON file, through a temporary file.'''
+    if self._state_name is None:
+      return None
+    state = { "seed": _seed, "bits": geohash_bits, "min_similarity": self._min_similarity,
+              "files": self._files, "stamps": self._stamps, "parent": self._parent,
+              "signatures": [ None if signature is None else signature.tolist() for signature in self._signatures ] }
+    with open( self._state_name + ".tmp", "w" ) as fp:
+      json.dump( state, fp )
+    os.rename( self._state_name + ".tmp", self._state_name )
+
+  def _find(self, node ):
+    root = node
+    while self._parent[ root ] != root:
+      root = self._parent[ root ]
+    while self._parent[ node ] != root: # path compression
+      self._parent[ node ], node = root, self._parent[ node ]
+    return root
+
+  def _union(self, first, second ):
+    first, second = self._find( first ), self._find( second )
+    if first != second:
+      # the course keeps the id of its oldest run
+      self._parent[ max( first, second ) ] = min( first, second )
+
+  def hasRun(self, ffitname, stamp = None ):
+    '''Whether the run is already assigned, for the file with this stamp (run_cache.file_stamp).'''
+    node = self._nodes.get( ffitname )
+    return node is not None and ( stamp is None or self._stamps[ node ] == list( stamp ) )
+
+  def addRun(self, ffitname, route, stamp = None ):
+    '''Assign a run to a course from its simplified route, replacing the one kept for the same file.
+      Return the course id, None without route.
+    '''
+    signature = minhash( route_cells( route ) )
+    old = self._nodes.pop( ffitname, None )
+    if old is not None:
+      # the old node stays as a link of its course, it is only no longer a run
+      self._signatures[ old ] = None
+    if signature is None:
+      return None
+    node = len( self._files )
+    self._files.append( ffitname )
+    self._stamps.append( None if stamp is None else list( stamp ) )
+    self._signatures.append( signature )
+    self._parent.append( node )
+    self._nodes[ ffitname ] = node
+    checked = set( )
+    for key in _band_keys( signature ):
+      bucket = self._buckets.setdefault( key, [ ] )
+      for other in bucket:
+        if other in checked or self._signatures[ other ] is None: continue
+        checked.add( other )
+        if similarity( signature, self._signatures[ other ] ) >= self._min_similarity:
+          self._union( node, other )
+      bucket.append( node )
+    return self.getCourse( ffitname )
+
+  def getCourse(self, ffitname ):
+    ''' Return the course id of the run (the number of the first run of the course), None if not assigned '''
+    node = self._nodes.get( ffitname )
+    return None if node is None else self._find( node ) + 1
+
+  def getCourses(self):
+    ''' Return the dictionary of course id -> list of the file names of its runs '''
+    courses = { }
+    for ffitname, node in self._nodes.items():
+      courses.setdefault( self._find( node ) + 1, [ ] ).append( ffitname )
+    return courses
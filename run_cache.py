@@ -0,0 +1,122 @@
+## @package run_cache
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Per-file cache of the quantities derived from one .fit file. \par
+#
+#  @detail
+#    Each input file gets one cache entry, which keeps any number of named products, e.g. the mean-maximal
+#    curve. An entry is valid as long as the size and the modification time of the input file are unchanged,
+#    so a series of runs only re-calculates the files that are new or modified.
+#    The small products of a file (summary, curves, route, accumulators: a few Kbytes) share one entry file,
+#    written again at each put. A large product (the traces: all the records) has a file of its own with the
+#    stamp in it: it is written once, read only when asked for, and never kept in memory, so that reading a
+#    summary or a route never unpickles the records. Only the last entries used are kept in memory. \par
+#
+
+import os
+import logging
+import hashlib
+from collections import OrderedDict
+try:
+  import cPickle as pickle
+except ImportError:
+  import pickle
+
+def file_stamp( ffitname ):
+  '''Stamp of an input file, which changes when the file is modified: ( size, modification time ).
+  '''
+  st = os.stat( ffitname )
+  return ( st.st_size, int( st.st_mtime ) )
+
+class run_cache:
+  '''Document for class run_cache
+
+    Purpose: keep the products calculated from a .fit file, to be reused by the next analysis of the same file.
+    Example:
+      cache = run_cache( "out/cache" )
+      curve = cache.get( "a.fit", "mean_max" )
+      if curve is None:
+        curve = calculate( "a.fit" )
+        cache.put( "a.fit", "mean_max", curve )
+
+    With cache_dir = None the products are only kept in memory.
+  '''
+
+  _version = 4 # increase to invalidate all the existing entries (2: moving time from the active segments, 3: positions in the traces, 4: traces in their own file)
+  _large_products = ( "traces", ) # each in its own file, never kept in memory
+
+  def __init__(self, cache_dir = None, capacity = 256 ):
+    '''Constructor of class run_cache.
+      Parameter cache_dir: folder of the entries, None to keep all the products in memory only.
+      Parameter capacity: number of entries (small products) kept in memory with a cache folder.
+    '''
+    self._cache_dir = cache_dir
+    self._capacity = max( 1, capacity )
+    self._entries = OrderedDict() # file key -> entry dictionary, the most recent last
+    if cache_dir is not None and not os.path.isdir( cache_dir ):
+      os.makedirs( cache_dir )
+
+  def _stamp(self, ffitname ):
+    return ( self._version, ) + file_stamp( ffitname )
+
+  def _entry_name(self, ffitname, product = None ):
+    key = hashlib.sha1( os.path.abspath( ffitname ).encode( 'utf-8' ) ).hexdigest()
+    if product is not None:
+      key = key + "." + product
+    return os.path.join( self._cache_dir, key + ".pkl" )
+
+  def _read(self, fname, ffitname, stamp ):
+    '''Read a pickled entry, None if not found, broken or out of date.'''
+    if not os.path.isfile( fname ):
+      return None
+    try:
+      with open( fname, "rb" ) as fp:
+        entry = pickle.load( fp )
+    except Exception:
+      logging.warning( ' Cache entry ' + fname + ' of input ' + ffitname + ' is broken. Ignore it. ')
+      return None
+    return entry if entry.get( "stamp" ) == stamp else None
+
+  def _write(self, fname, entry ):
+    # write to a temporary file first, so that an interrupted job never leaves a broken entry
+    with open( fname + ".tmp", "wb" ) as fp:
+      pickle.dump( entry, fp, pickle.HIGHEST_PROTOCOL )
+    os.rename( fname + ".tmp", fname )
+
+  def _load(self, ffitname ):
+    '''Get the valid entry of the file, an empty one if not found or out of date.'''
+    stamp = self._stamp( ffitname )
+    entry = self._entries.pop( ffitname, None )
+    if entry is None and self._cache_dir is not None:
+      entry = self._read( self._entry_name( ffitname ), ffitname, stamp )
+    if entry is None or entry.get( "stamp" ) != stamp:
+      entry = { "stamp": stamp, "products": { } }
+    self._entries[ ffitname ] = entry
+    if self._cache_dir is not None:
+      while len( self._entries ) > self._capacity:
+        self._entries.popitem( last = False )
+    return entry
+
+  def _isLarge(self, product ):
+    return self._cache_dir is not None and product in self._large_products
+
+  def get(self, ffitname, product ):
+    '''Get the cached product of the file, None if not found.
+    '''
+    if self._isLarge( product ):
+      entry = self._read( self._entry_name( ffitname, product ), ffitname, self._stamp( ffitname ) )
+      return None if entry is None else entry[ "value" ]
+    return self._load( ffitname )[ "products" ].get( product )
+
+  def put(self, ffitname, product, value ):
+    '''Keep the product of the file, also on disk if a cache folder is given.
+    '''
+    if self._isLarge( product ):
+      self._write( self._entry_name( ffitname, product ), { "stamp": self._stamp( ffitname ), "value": value } )
+      return
+    entry = self._load( ffitname )
+    entry[ "products" ][ product ] = value
+    if self._cache_dir is None:
+      return
+    self._write( self._entry_name( ffitname ), entry )
@@ -13,9 +13,19 @@
 
 import logging                 # logging:             https://docs.python.org/3.6/howto/logging.html
 import sys                     # system specific:     https://docs.python.org/3.6/library/sys.html
+import io                      # Core tools for streams: https://docs.python.org/3.6/library/io.html
 import time                    # Time access:         https://docs.python.org/3.6/library/time.html
 from datetime import datetime, timedelta  # Date and time types: https://docs.python.org/3.6/library/datetime.html
+from collections import OrderedDict
+import numpy as np
 from fitparse import FitFile
+from fit_scan import fit_scan, FitScanError
+from mean_max import mean_max_curve
+from rolling import rolling_mean, rolling_speed, pace_from_speed
+from resample import resample, time_weighted_mean
+from pauses import active_mask, active_segments, active_on_grid, moving_clock, timer_event
+from intervals import detect_intervals
+from polyline import simplify_route, semicircles_to_degrees
  
 class run_record:
   '''Documentation for class run_record. 
@@ -83,25 +93,47 @@ class run_record:
       -- getDateTimeList():       return the list of time stamps in <datetime>
       -- getElapsedTimeList():    return the list of the elapsed time in <timedelta>
       -- getElapsedMinutesList(): return the list of the elapsed minutes in <float> minutes
+      -- getMeanMaxSpeedList():   return the best average speed in m/s for each duration of mean_max_durations()
+      -- getFileName():           return the name of the input file
+      -- getUtcOffsetHours():     return the difference of hours of the time stamps compared to UTC
+      -- getSummary():            return all the per-run quantities above in one <OrderedDict>
+      -- getTraces():             return the measured lists as numpy arrays, with the elapsed time in seconds
+      -- getRollingSpeedList( window ), getRollingPaceKmList( window ), getRollingHeartRateList( window ),
+         getRollingCadenceList( window ): return the mean over the last window seconds at each record
+      -- getResampled( step, max_gap, gap ): return the measured lists on a uniform grid of time
+      -- getTimeWeightedAverages(): return the averages over the moving time, weighted by time and not by record
+      -- getActiveSegments():     return the index ranges of the records between the pauses
+      -- getMovingList():         return whether the interval ending at each record is active (not a pause)
+      -- getIntervals():          return the work and recovery reps of an interval session
   '''
 
   _mile_in_meter = 1609.34 # number of meters in a mile
+  _record_fields = [ "timestamp", "altitude", "cadence", "distance", "heart_rate", "speed", "position_lat", "position_long" ] # fields read from the records
 
-  def __init__(self, ffitname, hours_dif = timedelta(hours = -6)):
+  def __init__(self, ffitname, hours_dif = timedelta(hours = -6), fit_buffer = None):
     '''Constructor of run_record class.
 
        Parameters:
         -- ffitname: input file name.fit
         -- hours_dif: difference of hours compared to UTC, US Central is 6 hours later, so set to -6
+        -- fit_buffer: content of the .fit file as a bytes-like buffer (bytearray, mmap, zip member, shared
+                       memory), read instead of the file ffitname, which then only names the run
     '''
 
+    self._file_name = ffitname
+    self._fit_buffer = fit_buffer
+    self._hours_dif = hours_dif
     self._exist_vars = [] # existing variable in the data from input file: altitude, etc
     self._altitude = [] # <float> meter
     self._cadence = []  # <int> rpm
     self._distance = [] # <float> meter
     self._heart_rate = [] # <int> bpm
     self._speed = [] # <float> m/s
-    self._ismoving = [] # true: speed > 1.6 or flase
+    self._latitude = [] # <float> degrees, NaN if not recorded
+    self._longitude = [] # <float> degrees, NaN if not recorded
+    self._ismoving = [] # true: the interval ending at the record is active, see pauses.active_mask()
+    self._timer_events = [] # ( <datetime>, FIT event_type ) of the timer start / stop events
+    self._segments = np.zeros( ( 0, 2 ), dtype = int ) # active segments, [ first record, last record + 1 )
     self._pacekm = [] # <float> minutes per km 
     self._timestamp = [] # <'datetime.datetime'> 
     self._elapsedtime = [] # <timedelta>
@@ -124,6 +156,10 @@ class run_record:
     self._fast1km_time = timedelta(0) # 1 km
     self._fast1ml_time = timedelta(0) # 1 mile
     self._total_distance = 0.;
+    self._mean_max = None # best average speed for each duration, calculated when asked
+    self._resampled = { } # ( step, max_gap, gap ) -> measured lists on a uniform grid of time, made when asked
+    self._intervals = None # work and recovery reps, found when asked
+    self._route = None # simplified route, made when asked
 
     self._num_records = 0 # number of data points
     self._num_records_moving = 0 # number of data points
@@ -151,6 +187,37 @@ class run_record:
     return timedelta(minutes=nminute, seconds=nsec) 
 
 
+  def _records(self, ffitname ):
+    '''Get the list of records of the input, each one a dictionary of the fields it has: name -> value,
+      and the list of the timer events ( <datetime> in UTC, FIT event_type ).
+
+      The records are decoded with fit_scan from a memory map of the file (or from the buffer given to the
+      constructor): one struct call per record, with the definitions cached per local message type. The
+      files fit_scan can not read are given to fitparse, which reports their errors.
+    '''
+    source = self._fit_buffer if self._fit_buffer is not None else ffitname
+    records, events = [ ], [ ]
+    try:
+      for name, fields in fit_scan( source ).messages( [ "record", "event" ], self._record_fields + [ "event", "event_type" ] ):
+        if name == "record":
+          records.append( fields )
+        elif fields.get( "event" ) == timer_event and fields.get( "timestamp" ) is not None:
+          events.append( ( fields[ "timestamp" ], fields.get( "event_type" ) ) )
+      return records, events
+    except FitScanError as err:
+      logging.warning( ' Input ' + ffitname + ' read by fitparse: ' + str( err ) )
+    if self._fit_buffer is not None:
+      source = io.BytesIO( bytes( self._fit_buffer[:] ) )
+    records, events = [ ], [ ]
+    for message in FitFile( source ).get_messages( [ 'record', 'event' ] ):
+      if message.name == 'record':
+        records.append( dict( ( record_data.name, record_data.value ) for record_data in message ) )
+        continue
+      raw = dict( ( data.name, data.raw_value ) for data in message )
+      if raw.get( "event" ) == timer_event and message.get_value( "timestamp" ) is not None:
+        events.append( ( message.get_value( "timestamp" ), raw.get( "event_type" ) ) )
+    return records, events
+
   def _read_fit_file(self, ffitname, hours_dif ):
     '''Read a .fit file.
 
@@ -159,8 +226,6 @@ class run_record:
       by about 2-4 seconds.
     '''
  
-    fitfile = FitFile( ffitname )
-
     #
     # A record is a data point during the run, which records one's 
     #   position, speed, heart_rate, time and so on
@@ -168,58 +233,46 @@ class run_record:
     #   variables during the run, like average pace, elapsed time, etc.
     #
     self._num_records = 0
-    for record in fitfile.get_messages('record'):
-
-      skip = True
-      for record_data in record:
-        #
-        # "speed" not found or slower than 0.2 m/s skip!
-        # 0.2 m / s == 0.72 Km / hour
-        #
-        if record_data.name == "speed" and record_data.value > 0.2:
-          skip = False
-          break
-      if skip: continue
+    records, events = self._records( ffitname )
+    self._timer_events = [ ( timestamp + hours_dif, event_type ) for timestamp, event_type in events ]
+    for record in records:
+
+      #
+      # "speed" not found or slower than 0.2 m/s skip!
+      # 0.2 m / s == 0.72 Km / hour
+      #
+      if not record.get( "speed" ) > 0.2: continue
 
       self._num_records = self._num_records + 1
+      # the position is lost now and then (under trees, in a tunnel): kept for every record, None if not found
+      self._latitude.append( record.get( "position_lat" ) )
+      self._longitude.append( record.get( "position_long" ) )
 
       # Go through all the data entries in this record
-      for record_data in record:
-        #if record_data.units:
-        #    print " * %s: %s %s" % ( record_data.name, record_data.value, record_data.units)
-        #else:
-        #    print " * %s: %s" % (record_data.name, record_data.value)
-
- 
-        if record_data.name == "altitude":
-          self._altitude.append( record_data.value ) #<float> meter
-        elif record_data.name == "cadence": 
-          self._cadence.append( record_data.value ) #<int> rpm
-        elif record_data.name == "distance": 
-          self._distance.append( record_data.value ) #<float> meter
-        elif record_data.name == "heart_rate":
-          self._heart_rate.append( record_data.value ) #<int> bpm
+      for name, value in record.items():
+        if name == "altitude":
+          self._altitude.append( value ) #<float> meter
+        elif name == "cadence": 
+          self._cadence.append( value ) #<int> rpm
+        elif name == "distance": 
+          self._distance.append( value ) #<float> meter
+        elif name == "heart_rate":
+          self._heart_rate.append( value ) #<int> bpm
           #print 'Current length heart rate %d ' %len(self._heart_rate)
-        elif record_data.name == "speed":
-          self._speed.append( record_data.value ) #<float> meter/second
+        elif name == "speed":
+          self._speed.append( value ) #<float> meter/second
           #print 'Current length speed %d ' %len(self._speed)
-          # is moving set to true if speed is > 1.6 meter/second
-          if record_data.value > 1.6: 
-            self._ismoving.append( True )
-            self._num_records_moving = self._num_records_moving + 1
-          else:
-            self._ismoving.append( False )
-          pace_dt = self._calculatePaceFromSpeed( record_data.value )
+          pace_dt = self._calculatePaceFromSpeed( value )
           if pace_dt.total_seconds() < 1:
             self._pacekm.append( 15. ) # 15 minutes per Km, impossibly slow!
           #elif pace_dt.total_seconds() > 900: # if it is over 15 minutes, why???
           #  logging.warning( "Found record with pace: " + str(pace_dt.total_seconds() / 60.) + " minutes / Km. Convert to 15 minutes / Km. " )
-          #  logging.warning( "Found speed: " + str(record_data.value) )
+          #  logging.warning( "Found speed: " + str(value) )
           #  self._pacekm.append( 15. ) 
           else:
             self._pacekm.append( pace_dt.total_seconds() / 60. )
-        elif record_data.name == "timestamp":
-          time_pos = record_data.value + hours_dif #<datetime>
+        elif name == "timestamp":
+          time_pos = value + hours_dif #<datetime>
           self._timestamp.append( time_pos ) #<datetime>
           dtm = time_pos - self._timestamp[0]
           self._elapsedtime.append( dtm )
@@ -240,12 +293,36 @@ class run_record:
     if len( self._timestamp  ) == self._num_records : self._exist_vars.append( "time"  )
     else : print ' Number of records %d ' % self._num_records, ' != number of timestamp data %d ' % len( self._timestamp)
 
+    self._latitude = semicircles_to_degrees( self._latitude )
+    self._longitude = semicircles_to_degrees( self._longitude )
+    self._segment()
+
     if self._num_records <= 0:
       logging.error( ' Input ' + ffitname + ' has no record installed. Check! ')
     else:
       logging.info( ' Input ' + ffitname + ' has ',self._num_records, ' records installed.')
     return None
 
+  def _segment(self ):
+    '''Split the run into active segments and set which records are moving (see pauses.active_mask()):
+      the pauses are the gaps between records with no distance covered, the timer stops and the stretches
+      slower than 1.6 m/s.
+      Without time, a record is moving if its speed is above 1.6 m/s.
+    '''
+    speed = self._speed if "speed" in self._exist_vars else None
+    if "time" in self._exist_vars:
+      start = self._timestamp[0] if self._num_records > 0 else None
+      events = [ ( ( timestamp - start ).total_seconds(), event_type ) for timestamp, event_type in self._timer_events ]
+      distance = self._distance if "distance" in self._exist_vars else None
+      active = active_mask( self._elapsedSeconds(), speed, events, distance )
+    elif speed is not None:
+      active = np.asarray( speed, dtype = float ) > 1.6
+    else:
+      active = np.zeros( self._num_records, dtype = bool )
+    self._segments = active_segments( active )
+    self._ismoving = active.tolist()
+    self._num_records_moving = int( active.sum() )
+
   def _time_of_fastest(self, dist_set = 1000. ):
     '''Time of the fastest 1K or 1Mile.
 
@@ -301,16 +378,16 @@ class run_record:
     ###########
     if "speed" in self._exist_vars:
       #
-      # use index to get the time-stamps, then calculate the moving time
+      # moving time: the time of the active intervals, without the pauses (see _segment())
       #
       self._min_speed = 9999.
-      for idx, ismove in enumerate( self._ismoving ):
-        # calculate the moving time.
-        # set the minimum moving speed to be 1.6 meter / second ~ 10 minutes / Km
-        if idx > 0 and ismove: 
-          self._moving_time = self._moving_time + ( self._timestamp[idx] - self._timestamp[idx-1] )
-          if self._speed[ idx ] < self._min_speed: self._min_speed = self._speed[ idx ]
-        
+      moving = np.asarray( self._ismoving, dtype = bool )
+      if np.any( moving[ 1: ] ):
+        if "time" in self._exist_vars:
+          seconds = np.diff( np.asarray( self._elapsedSeconds() ) )
+          self._moving_time = timedelta( seconds = float( seconds[ moving[ 1: ] ].sum() ) )
+        self._min_speed = float( np.asarray( self._speed )[ 1: ][ moving[ 1: ] ].min() )
+
       self._avg_speed = 0.
       if self._moving_time.total_seconds() > 0:
         self._avg_speed = self._total_distance / self._moving_time.total_seconds()
@@ -550,3 +627,180 @@ class run_record:
     '''Get the list of elapsed time records in the number of minutes (numeric).
     '''
     return self._elapsedminutes
+
+  def getMeanMaxSpeedList( self ):
+    '''Get the mean-maximal curve: the best average speed in m/s for each duration of mean_max_durations().
+    '''
+    if self._mean_max is None:
+      if "distance" in self._exist_vars and "time" in self._exist_vars:
+        self._mean_max = mean_max_curve( [ dt.total_seconds() for dt in self._elapsedtime ], self._distance )
+      else:
+        self._mean_max = mean_max_curve( [ ], [ ] )
+    return self._mean_max
+
+  def getFileName( self ):
+    '''Get the name of the input .fit file.
+    '''
+    return self._file_name
+
+  def getUtcOffsetHours( self ):
+    '''Get the difference of hours of the time stamps compared to UTC.
+    '''
+    return self._hours_dif.total_seconds() / 3600.
+
+  def getSummary( self ):
+    '''Get all the per-run quantities in an <OrderedDict>, keyed by the name of the getter without "get".
+
+      The values keep their types: <datetime> for time points, <timedelta> for durations and paces.
+      The quantities not measured in the input file are None.
+    '''
+    summary = OrderedDict()
+    summary[ "FileName" ] = self._file_name
+    summary[ "UtcOffsetHours" ] = self.getUtcOffsetHours()
+    has_time = "time" in self._exist_vars and self._num_records > 0
+    summary[ "StartTime" ] = self.getStartTime() if has_time else None
+    summary[ "EndTime" ] = self.getEndTime() if has_time else None
+    summary[ "TotalTimePassed" ] = self.getTotalTimePassed() if has_time else None
+    summary[ "TotalTimeMoving" ] = self.getTotalTimeMoving() if has_time else None
+
+    getters = [
+      ( "distance",   [ "TotalDistanceMeter", "TotalDistanceKm", "TotalDistanceMile" ] ),
+      ( "altitude",   [ "AverageAltitude", "AscendMeters", "DescendMeters" ] ),
+      ( "speed",      [ "FastestKmTime", "MinimumSpeed", "MaximumSpeed", "AverageSpeed",
+                        "MinimumPaceKm", "MaximumPaceKm", "AveragePaceKm",
+                        "MinimumPaceMile", "MaximumPaceMile", "AveragePaceMile" ] ),
+      ( "cadence",    [ "MinimumCadence", "MaximumCadence", "AverageCadence" ] ),
+      ( "heart_rate", [ "MinimumHeartRate", "MaximumHeartRate", "AverageHeartRate" ] ),
+    ]
+    for measure, names in getters:
+      for name in names:
+        summary[ name ] = getattr( self, "get" + name )() if measure in self._exist_vars else None
+    return summary
+
+  def getActiveSegments( self ):
+    '''Get the active segments of the run, without the pauses: numpy array ( segments, 2 ) of the index ranges
+      [ first record, last record + 1 ) of the measured lists.
+    '''
+    return self._segments
+
+  def getMovingList( self ):
+    '''Get the list of booleans: whether the interval ending at each record is active (not a pause).
+    '''
+    return self._ismoving
+
+  def getIntervals( self ):
+    '''Get the reps of the run (intervals.detect_intervals()): a list of <OrderedDict> with the kind ("work",
+      "recovery" or "steady"), the start, the moving time, the distance, the pace and the heart rate of each.
+    '''
+    if self._intervals is None:
+      self._intervals = detect_intervals( self.getTraces() ) or [ ]
+    return self._intervals
+
+  def getLatitudeList( self ):
+    '''Get the numpy array of the latitude in degrees of each record, NaN where the position is not recorded.
+    '''
+    return self._latitude
+
+  def getLongitudeList( self ):
+    '''Get the numpy array of the longitude in degrees of each record, NaN where the position is not recorded.
+    '''
+    return self._longitude
+
+  def getRoute( self, tolerance = 5. ):
+    '''Get the simplified route (polyline.simplify_route()): numpy array ( points, 2 ) of [ latitude, longitude ]
+      in degrees, within tolerance meters of the recorded track. None without position.
+    '''
+    if tolerance != 5.:
+      return simplify_route( self._latitude, self._longitude, tolerance )
+    if self._route is None:
+      self._route = simplify_route( self._latitude, self._longitude, tolerance )
+    return self._route
+
+  def getTraces( self ):
+    '''Get the measured lists as a dictionary of numpy arrays, compact enough to be cached for each run.
+
+      Keys: "time" (elapsed seconds), "distance" (m), "speed" (m/s), "altitude" (m), "heart_rate" (bpm),
+      "cadence" (rpm). Only the measured ones are given. "active": whether the interval ending at each record
+      is active (getMovingList()). "latitude", "longitude" (degrees, float32: within a meter, NaN where not
+      recorded) if the position is recorded.
+    '''
+    traces = { }
+    if "time" in self._exist_vars:
+      traces[ "time" ] = np.array( [ dt.total_seconds() for dt in self._elapsedtime ], dtype = float )
+    for measure, values in [ ( "distance", self._distance ), ( "speed", self._speed ), ( "altitude", self._altitude ),
+                             ( "heart_rate", self._heart_rate ), ( "cadence", self._cadence ) ]:
+      if measure in self._exist_vars:
+        traces[ measure ] = np.array( values, dtype = np.float32 )
+    if self._num_records > 0:
+      traces[ "active" ] = np.array( self._ismoving, dtype = bool )
+    if np.any( np.isfinite( self._latitude ) ):
+      traces[ "latitude" ] = self._latitude.astype( np.float32 )
+      traces[ "longitude" ] = self._longitude.astype( np.float32 )
+    return traces
+
+  def _elapsedSeconds( self ):
+    return [ dt.total_seconds() for dt in self._elapsedtime ]
+
+  def getRollingSpeedList( self, window = 30. ):
+    '''Get the average speed in m/s over the last window seconds at each record, as a numpy array.
+
+      From the distance covered in the window if the distance is measured, else the time-weighted mean speed.
+    '''
+    if "time" not in self._exist_vars or "speed" not in self._exist_vars:
+      return np.zeros( 0 )
+    if "distance" in self._exist_vars:
+      return rolling_speed( self._elapsedSeconds(), self._distance, window )
+    return rolling_mean( self._elapsedSeconds(), self._speed, window )
+
+  def getRollingPaceKmList( self, window = 30. ):
+    '''Get the pace in minutes per Km over the last window seconds at each record, as a numpy array.
+
+      Smoother than getPaceKmList(), which is the pace of each record. At most 15 minutes per Km, as there.
+    '''
+    return pace_from_speed( self.getRollingSpeedList( window ) )
+
+  def getRollingHeartRateList( self, window = 30. ):
+    '''Get the time-weighted mean heart rate in bpm over the last window seconds at each record, as a numpy array.
+    '''
+    if "time" not in self._exist_vars or "heart_rate" not in self._exist_vars:
+      return np.zeros( 0 )
+    return rolling_mean( self._elapsedSeconds(), self._heart_rate, window )
+
+  def getRollingCadenceList( self, window = 30. ):
+    '''Get the time-weighted mean cadence in rpm over the last window seconds at each record, as a numpy array.
+    '''
+    if "time" not in self._exist_vars or "cadence" not in self._exist_vars:
+      return np.zeros( 0 )
+    return rolling_mean( self._elapsedSeconds(), self._cadence, window )
+
+  def getResampled( self, step = 1., max_gap = 10., gap = "nan" ):
+    '''Get the measured lists on a uniform grid of time, see resample.resample(): a dictionary with "time"
+      (seconds since the first record), "in_gap" and one numpy array per measured variable.
+    '''
+    key = ( step, max_gap, gap )
+    if key not in self._resampled:
+      traces = { }
+      for measure, values in [ ( "distance", self._distance ), ( "speed", self._speed ), ( "altitude", self._altitude ),
+                               ( "heart_rate", self._heart_rate ), ( "cadence", self._cadence ) ]:
+        if measure in self._exist_vars:
+          traces[ measure ] = values
+      elapsed = self._elapsedSeconds() if "time" in self._exist_vars else [ ]
+      self._resampled[ key ] = resample( elapsed, traces, step, max_gap, gap )
+    return self._resampled[ key ]
+
+  def getTimeWeightedAverages( self, max_gap = 10. ):
+    '''Get the averages over the moving time (the active segments) on a 1 second grid, so that every second
+      counts the same whatever the recording rate of the device. Pauses longer than max_gap are left out.
+
+      Return an <OrderedDict> of "AverageSpeed", "AverageAltitude", "AverageCadence", "AverageHeartRate",
+      None for the variables not measured.
+    '''
+    grid = self.getResampled( 1., max_gap, "nan" )
+    moving = None
+    if "time" in self._exist_vars:
+      moving = active_on_grid( self._elapsedSeconds(), self._ismoving, grid[ "time" ] )
+    averages = OrderedDict()
+    for name, measure in [ ( "AverageSpeed", "speed" ), ( "AverageAltitude", "altitude" ),
+                           ( "AverageCadence", "cadence" ), ( "AverageHeartRate", "heart_rate" ) ]:
+      averages[ name ] = time_weighted_mean( grid[ measure ], moving ) if measure in grid else None
+    return averages
@@ -0,0 +1,323 @@
+## @package run_server
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Local HTTP/JSON server answering questions about the history of runs, which is loaded only once. \par
+#
+#  @detail
+#    A new "python anal.py" imports everything and reads the whole archive for each question. This server
+#    reads the history once with read_sequence (fast again after the first time, from the journal and the
+#    cache), keeps the per-run summaries in memory, sorted by start time, and a least recently used set of
+#    full traces. It only listens on localhost and needs no network. \par
+#
+#    Endpoints (GET, JSON unless a plot):
+#      /summaries?start=2018-01-01&end=2018-12-31&fields=StartTime,TotalDistanceKm   per-run summaries
+#      /rollup?period=week|month|year                                               totals per period
+#      /trace?run=<index in /summaries>&points=500                                  downsampled traces
+#      /plot/<name>.png?run=<index>   name: pace_v_date, distance, heartrate_v_date, mean_max, trace
+#    and (POST, as they change the history):
+#      /ingest                        read the new .fit files of the input folder
+#      /ingest {"files": [...]}       read the given .fit files
+#
+
+import os
+import sys
+import io
+import json
+import bisect
+import logging
+import argparse
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+from read_sequence import read_sequence
+from run_record import run_record
+from export_summary import summary_row
+from lazy_import import pyplot as plt # matplotlib is only imported when a plot is asked for
+try:
+  from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+  from urlparse import urlparse, parse_qs
+except ImportError:
+  from http.server import HTTPServer, BaseHTTPRequestHandler
+  from urllib.parse import urlparse, parse_qs
+
+_plot_names = [ "pace_v_date", "distance", "heartrate_v_date", "mean_max", "trace" ]
+_rollup_periods = { "week": lambda t: "%04d-W%02d" % t.isocalendar()[:2],
+                    "month": lambda t: t.strftime( "%Y-%m" ), "year": lambda t: t.strftime( "%Y" ) }
+
+class trace_lru:
+  '''Document for class trace_lru
+
+    Purpose: keep the traces (run_record.getTraces()) of the last runs asked for, at most capacity of them.
+    A trace not kept is read from its file of the run_cache (which keeps no traces in memory), or decoded
+    again if the cache does not have it.
+  '''
+
+  def __init__(self, cache, capacity = 64 ):
+    self._cache = cache
+    self._capacity = capacity
+    self._traces = OrderedDict() # file name -> traces, the most recent last
+
+  def get(self, ffitname ):
+    traces = self._traces.pop( ffitname, None )
+    if traces is None:
+      traces = self._cache.get( ffitname, "traces" )
+      if traces is None:
+        traces = run_record( ffitname ).getTraces()
+        self._cache.put( ffitname, "traces", traces )
+    self._traces[ ffitname ] = traces
+    while len( self._traces ) > self._capacity:
+      self._traces.popitem( last = False )
+    return traces
+
+  def size(self):
+    return len( self._traces )
+
+class run_server:
+  '''Document for class run_server
+
+    Purpose: the state of the server: the history of runs, and the answers to the requests.
+    Example:
+      app = run_server( "data", "out" )
+      app.summaries( start = "2018-01-01" )
+      app.serve( 8765 )
+  '''
+
+  def __init__(self, fit_input_name, outdir, lru_size = 64, **options ):
+    '''Constructor of class run_server.
+      Parameter fit_input_name: folder of .fit files, or a text file with one .fit input per line.
+      Parameter outdir: folder of the cache and the journal, shared with anal.py.
+      Parameter lru_size: number of full traces kept in memory.
+      Parameter options: other options of read_sequence, e.g. jobs, index_mode, sports.
+    '''
+    self._input = fit_input_name
+    # the inputs there at the start are all read (or rejected) by read_sequence
+    self._known = set( self._listInput() )
+    self._seq = read_sequence( fit_input_name, cache_dir = outdir + "/cache", journal_name = outdir + "/journal.jsonl", **options )
+    self._traces = trace_lru( self._seq.getCache(), lru_size )
+    self._answers = { } # request -> answer, cleared when new runs are read
+    self._sort()
+
+  def _sort(self):
+    '''Sort the runs by start time, and make the rows and the times used by the requests.'''
+    order = sorted( range( self._seq.size() ), key = lambda idx: self._seq.getSummaries()[ idx ][ "StartTime" ] or datetime.min )
+    self._summaries = [ self._seq.getSummaries()[ idx ] for idx in order ]
+    self._rows = [ summary_row( summary ) for summary in self._summaries ]
+    self._starts = [ summary[ "StartTime" ] or datetime.min for summary in self._summaries ]
+    self._answers = { }
+
+  def _listInput(self):
+    '''The .fit inputs listed in the input folder or text file.'''
+    if os.path.isdir( self._input ):
+      return [ self._input + "/" + f for f in sorted( os.listdir( self._input ) ) if ".fit" in f ]
+    with open( self._input ) as fp:
+      return [ line.strip() for line in fp if line[0] != '#' and ".fit" in line ]
+
+  def size(self):
+    return len( self._summaries )
+
+  def summaries(self, start = None, end = None, fields = None ):
+    '''Get the summary rows of the runs started between the dates start and end (YYYY-MM-DD, both included).
+
+      Each row gets its index "Run", used by trace(). fields: list of the columns to give, None for all.
+    '''
+    first = 0 if start is None else bisect.bisect_left( self._starts, datetime.strptime( start, "%Y-%m-%d" ) )
+    last = len( self._starts ) if end is None else bisect.bisect_right( self._starts, datetime.strptime( end + " 23:59:59", "%Y-%m-%d %H:%M:%S" ) )
+    rows = [ ]
+    for idx in range( first, last ):
+      row = OrderedDict( [ ( "Run", idx ) ] )
+      for name, value in self._rows[ idx ].items():
+        if fields is None or name in fields:
+          row[ name ] = value
+      rows.append( row )
+    return rows
+
+  def rollup(self, period = "month" ):
+    '''Get the totals per week, month or year: number of runs, distance, moving time and average pace.'''
+    if period not in _rollup_periods:
+      raise ValueError( "period " + period + " not one of: " + ", ".join( sorted( _rollup_periods ) ) )
+    key = ( "rollup", period )
+    if key not in self._answers:
+      totals = OrderedDict()
+      for summary in self._summaries:
+        if summary[ "StartTime" ] is None: continue
+        tag = _rollup_periods[ period ]( summary[ "StartTime" ] )
+        total = totals.setdefault( tag, OrderedDict( [ ( "Period", tag ), ( "Runs", 0 ), ( "DistanceKm", 0. ), ( "MovingSeconds", 0. ) ] ) )
+        total[ "Runs" ] = total[ "Runs" ] + 1
+        total[ "DistanceKm" ] = total[ "DistanceKm" ] + ( summary[ "TotalDistanceKm" ] or 0. )
+        if summary[ "TotalTimeMoving" ] is not None:
+          total[ "MovingSeconds" ] = total[ "MovingSeconds" ] + summary[ "TotalTimeMoving" ].total_seconds()
+      for total in totals.values():
+        total[ "AveragePaceKmSeconds" ] = total[ "MovingSeconds" ] / total[ "DistanceKm" ] if total[ "DistanceKm" ] > 0 else None
+      self._answers[ key ] = list( totals.values() )
+    return self._answers[ key ]
+
+  def _run(self, run ):
+    '''Check the index of a run in summaries().'''
+    if run < 0 or run >= len( self._summaries ):
+      raise IndexError( "run %d not in 0 to %d" % ( run, len( self._summaries ) - 1 ) )
+    return run
+
+  def trace(self, run, points = 500 ):
+    '''Get the traces of one run (index in summaries()), downsampled to at most the given number of points.'''
+    traces = self._traces.get( self._summaries[ self._run( run ) ][ "FileName" ] )
+    answer = OrderedDict( [ ( "Run", run ), ( "FileName", self._summaries[ run ][ "FileName" ] ) ] )
+    size = len( traces[ "time" ] ) if "time" in traces else 0
+    keep = np.unique( np.linspace( 0, size - 1, min( size, max( points, 2 ) ) ).astype( int ) ) if size > 0 else [ ]
+    for name in sorted( traces ):
+      answer[ name ] = [ round( float( value ), 3 ) for value in np.asarray( traces[ name ] )[ keep ] ]
+    return answer
+
+  def plot(self, name, run = None ):
+    '''Get a plot as PNG bytes, see _plot_names. The plots of the whole history are kept until new runs come.'''
+    if name not in _plot_names:
+      raise ValueError( "plot " + name + " not one of: " + ", ".join( _plot_names ) )
+    key = ( "plot", name, run )
+    if key in self._answers:
+      return self._answers[ key ]
+    plt.clf()
+    plt.gcf().set_size_inches( 10, 6 )
+    if name == "pace_v_date":
+      points = [ ( summary[ "StartTime" ], summary[ "AveragePaceKm" ].total_seconds() / 60. ) for summary in self._summaries
+                 if summary[ "StartTime" ] is not None and summary[ "AveragePaceKm" ] is not None ]
+      plt.scatter( [ p[0] for p in points ], [ p[1] for p in points ], c = '#E3CF57', alpha = 0.6 )
+      plt.gcf().autofmt_xdate()
+      plt.ylabel( "Pace (minutes per Km)" )
+    elif name == "heartrate_v_date":
+      points = [ ( summary[ "StartTime" ], summary[ "AverageHeartRate" ] ) for summary in self._summaries
+                 if summary[ "StartTime" ] is not None and summary[ "AverageHeartRate" ] is not None ]
+      plt.scatter( [ p[0] for p in points ], [ p[1] for p in points ], c = '#E3CF57', alpha = 0.6 )
+      plt.gcf().autofmt_xdate()
+      plt.ylabel( "Heart Rate (BPM)" )
+    elif name == "distance":
+      plt.hist( [ summary[ "TotalDistanceKm" ] for summary in self._summaries if summary[ "TotalDistanceKm" ] is not None ],
+                bins = 'auto', color = '#0504aa', alpha = 0.5, rwidth = 0.8 )
+      plt.xlabel( "Distance per Run (Km)" )
+      plt.ylabel( "Number of Runs" )
+    elif name == "mean_max":
+      envelope = self._seq.getMeanMaxEnvelope()
+      plt.plot( envelope.getDurations(), envelope.getBestSpeed() )
+      plt.xscale( 'log' )
+      plt.xlabel( "Duration (seconds)" )
+      plt.ylabel( "Best Average Speed (m/s)" )
+    else:
+      traces = self._traces.get( self._summaries[ self._run( run or 0 ) ][ "FileName" ] )
+      if "time" in traces and "speed" in traces:
+        plt.plot( traces[ "time" ] / 60., traces[ "speed" ] )
+      plt.xlabel( "Elapsed Time (minutes)" )
+      plt.ylabel( "Speed (m/s)" )
+    out = io.BytesIO()
+    plt.savefig( out, format = "png" )
+    self._answers[ key ] = out.getvalue()
+    return self._answers[ key ]
+
+  def ingest(self, fitfiles_list = None ):
+    '''Read the new .fit files, by default the ones of the input folder (or text file) not read yet.
+
+      The new files go through the selection of the history (read_sequence.addRuns()): the sports, the index
+      mode, and no copy of a run already read.
+      Return the dictionary of the number of runs "added", inputs "skipped" (copies, other sports, rejected
+      or failed) and "runs".
+    '''
+    if fitfiles_list is None:
+      fitfiles_list = self._listInput()
+    new = [ ]
+    for ffitname in fitfiles_list:
+      if ffitname in self._known or ffitname in new: continue
+      new.append( ffitname )
+    self._known.update( new )
+    added = self._seq.addRuns( new ) if new else 0
+    skipped = len( new ) - added
+    if added > 0:
+      self._sort()
+    return OrderedDict( [ ( "added", added ), ( "skipped", skipped ), ( "runs", self.size() ) ] )
+
+  def serve(self, port = 8765 ):
+    '''Answer the requests on http://127.0.0.1:port until interrupted.'''
+    httpd = HTTPServer( ( "127.0.0.1", port ), _handler )
+    httpd.app = self
+    logging.warning( ' Serving %d runs on http://127.0.0.1:%d ', self.size(), port )
+    try:
+      httpd.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    httpd.server_close()
+
+class _handler( BaseHTTPRequestHandler ):
+  '''Route the requests to the run_server.'''
+
+  def do_GET(self):
+    url = urlparse( self.path )
+    query = dict( ( key, values[-1] ) for key, values in parse_qs( url.query ).items() )
+    app = self.server.app
+    try:
+      if url.path == "/summaries":
+        fields = query[ "fields" ].split( "," ) if "fields" in query else None
+        self._json( app.summaries( query.get( "start" ), query.get( "end" ), fields ) )
+      elif url.path == "/rollup":
+        self._json( app.rollup( query.get( "period", "month" ) ) )
+      elif url.path == "/trace":
+        self._json( app.trace( int( query.get( "run", 0 ) ), int( query.get( "points", 500 ) ) ) )
+      elif url.path.startswith( "/plot/" ) and url.path.endswith( ".png" ):
+        run = int( query[ "run" ] ) if "run" in query else None
+        self._send( 200, "image/png", app.plot( url.path[ len( "/plot/" ):-len( ".png" ) ], run ) )
+      elif url.path == "/ingest":
+        self._json( { "error": "/ingest changes the history: use POST" }, 405 )
+      else:
+        self._json( { "error": "unknown request " + url.path }, 404 )
+    except ( ValueError, KeyError, IndexError ) as err:
+      self._json( { "error": str( err ) }, 400 )
+    except ( IOError, OSError ) as err:
+      # e.g. a run file removed since it was read
+      self._json( { "error": str( err ) }, 500 )
+
+  def do_POST(self):
+    if urlparse( self.path ).path != "/ingest":
+      return self._json( { "error": "unknown request " + self.path }, 404 )
+    try:
+      length = int( self.headers.get( "Content-Length", 0 ) )
+      # no body: the new files of the input folder
+      body = json.loads( self.rfile.read( length ).decode( "utf-8" ) ) if length > 0 else { }
+      self._json( self.server.app.ingest( body.get( "files" ) ) )
+    except ( ValueError, KeyError, AttributeError ) as err:
+      self._json( { "error": str( err ) }, 400 )
+    except ( IOError, OSError ) as err:
+      self._json( { "error": str( err ) }, 500 )
+
+  def _json(self, answer, code = 200 ):
+    self._send( code, "application/json", json.dumps( answer ).encode( "utf-8" ) )
+
+  def _send(self, code, content_type, body ):
+    self.send_response( code )
+    self.send_header( "Content-Type", content_type )
+    self.send_header( "Content-Length", str( len( body ) ) )
+    self.end_headers()
+    self.wfile.write( body )
+
+  def log_message(self, fmt, *args ):
+    logging.info( ' ' + fmt % args )
+
+def main():
+  '''
+    Example: python run_server.py data out [--port 8765]
+    Then:    curl "http://127.0.0.1:8765/rollup?period=month"
+  '''
+  parser = argparse.ArgumentParser( description = 'Local server of the history of runs.' )
+  parser.add_argument( 'input', help = 'folder of *fit* files, or a text file with one *fit* input per line' )
+  parser.add_argument( 'outdir', nargs = '?', default = '.', help = 'folder of the cache and the journal' )
+  parser.add_argument( '--port', type = int, default = 8765, help = 'port on 127.0.0.1' )
+  parser.add_argument( '--lru', type = int, default = 64, help = 'number of full traces kept in memory' )
+  parser.add_argument( '--jobs', type = int, default = 1, help = 'number of inputs decoded at the same time' )
+  parser.add_argument( '--index', action = 'store_true', help = 'take the summaries from the session messages' )
+  parser.add_argument( '--sports', default = '', help = 'comma separated sports to keep, e.g. running' )
+  args = parser.parse_args()
+
+  if not os.path.isdir( args.outdir ):
+    os.makedirs( args.outdir )
+  app = run_server( args.input, args.outdir, lru_size = args.lru, jobs = args.jobs, index_mode = args.index,
+                    sports = [ p for p in args.sports.split( ',' ) if p ] or None )
+  app.serve( args.port )
+
+if __name__ == '__main__' :
+
+  main()
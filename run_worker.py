@@ -0,0 +1,123 @@
+## @package run_worker
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Decode a list of .fit files, each one in an isolated worker process with a time limit. \par
+#
+#  @detail
+#    A broken or pathological input file may make the decoding throw, hang or even crash the interpreter.
+#    Each file is decoded in its own process, which is killed if it takes longer than the time limit, so
+#    that one file can never stop a batch of thousands. The outcomes are given back in the input order.
+#    The traces of a decoded run come back through a block of shared memory (shared_traces), only a small
+#    header goes through the pipe. \par
+#
+
+import time
+import logging
+import traceback
+import multiprocessing
+from run_record import run_record
+from shared_traces import share_run, shared_run, block_name, remove_block
+
+def _decode(ffitname ):
+  '''Decode one file, return ( status, run_record or None, message ).'''
+  try:
+    return ( "ok", run_record( ffitname ), None )
+  except Exception:
+    return ( "error", None, traceback.format_exc() )
+
+def _worker(ffitname, conn, block, cache_dir ):
+  status, rrd, message = _decode( ffitname )
+  if rrd is not None:
+    try:
+      rrd = share_run( rrd, block, cache_dir )
+    except Exception:
+      status, rrd, message = ( "error", None, traceback.format_exc() )
+  conn.send( ( status, rrd, message ) )
+  conn.close()
+
+def _receive(outcome, block ):
+  '''Outcome of a worker with the run mapped from its shared block, which is always removed.'''
+  status, header, message = outcome
+  if header is None:
+    remove_block( block )
+    return outcome
+  try:
+    return ( status, shared_run( header ), message )
+  except Exception:
+    remove_block( block )
+    return ( "error", None, traceback.format_exc() )
+
+def decode_runs( fitfiles_list, timeout = None, jobs = 1, cache_dir = None ):
+  '''Decode the .fit files and yield ( file name, status, run_record or None, message ) in the input order.
+
+    Parameters:
+    -- fitfiles_list  list of the input .fit files.
+    -- timeout        time limit in seconds to decode one file. None to decode in this process.
+    -- jobs           number of worker processes running at the same time.
+    -- cache_dir      folder of the run_cache: the workers put the traces there themselves, None to give them
+                      back through shared blocks.
+
+    The status is "ok", "error" (the message is the traceback) or "timeout". A run decoded in a worker is
+  a shared_traces.shared_run, with the getters of run_record used by read_sequence.
+    Without timeout and with one job, the files are decoded in this process: errors are still caught,
+    but a hanging file is not stopped.
+  '''
+  if timeout is None and jobs <= 1:
+    for ffitname in fitfiles_list:
+      status, rrd, message = _decode( ffitname )
+      yield ( ffitname, status, rrd, message )
+    return
+
+  jobs = max( 1, jobs )
+  pending = list( enumerate( fitfiles_list ) )
+  pending.reverse()
+  running = { } # index -> ( file name, process, connection, starting time, shared block )
+  done = { }    # index -> outcome, kept until all the previous files are given back
+  next_index = 0
+  try:
+    while pending or running or done:
+      while pending and len( running ) < jobs:
+        idx, ffitname = pending.pop()
+        block = block_name( idx )
+        recv_conn, send_conn = multiprocessing.Pipe( duplex = False )
+        proc = multiprocessing.Process( target = _worker, args = ( ffitname, send_conn, block, cache_dir ) )
+        proc.daemon = True
+        proc.start()
+        send_conn.close()
+        running[ idx ] = ( ffitname, proc, recv_conn, time.time(), block )
+
+      for idx in list( running ):
+        ffitname, proc, conn, start, block = running[ idx ]
+        if conn.poll() or not proc.is_alive():
+          # receive before join, the worker would otherwise block on a full pipe
+          try:
+            outcome = _receive( conn.recv(), block )
+          except EOFError:
+            proc.join()
+            remove_block( block )
+            outcome = ( "error", None, "Worker process exited with code %s" % proc.exitcode )
+          proc.join()
+        elif timeout is not None and time.time() - start > timeout:
+          proc.terminate()
+          proc.join()
+          remove_block( block )
+          outcome = ( "timeout", None, "Decoding took more than %.0f seconds" % timeout )
+        else:
+          continue
+        conn.close()
+        del running[ idx ]
+        done[ idx ] = ( ffitname, ) + tuple( outcome )
+
+      if next_index not in done:
+        time.sleep( 0.005 )
+      while next_index in done:
+        yield done.pop( next_index )
+        next_index = next_index + 1
+  finally:
+    # the caller stopped early: no worker and no block is left behind
+    for ffitname, proc, conn, start, block in running.values():
+      proc.terminate()
+      proc.join()
+      conn.close()
+      remove_block( block )
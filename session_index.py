@@ -0,0 +1,142 @@
+## @package session_index
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Per-run summary from the session and lap messages of a .fit file, without decoding the records. \par
+#
+#  @detail
+#    The device writes the totals of the activity in the session message (and of each lap in the lap messages)
+#    at the end of the file: distance, elapsed and timer time, average and maximum speed, heart rate and
+#    cadence, ascent and descent. fit_scan reads only these messages and jumps over the records, so a summary
+#    costs a walk through the message headers instead of a full decode. The summary has the same keys as
+#    run_record.getSummary(). The quantities the session does not have are taken from the laps:
+#      * MinimumSpeed, MinimumCadence, MinimumHeartRate: the lowest average of a lap;
+#      * FastestKmTime: the fastest lap of at least 1 Km, scaled to 1 Km, else the average pace.
+#    The moving time is the timer time of the device (auto-pause). \par
+#
+
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+from fit_scan import fit_scan
+
+_mile_in_meter = 1609.34 # number of meters in a mile
+
+def _first( fields, names ):
+  '''First of the fields which is recorded, e.g. the enhanced speed before the speed.'''
+  for name in names:
+    if fields.get( name ) is not None:
+      return fields[ name ]
+  return None
+
+def _pace( speed_m_per_s, unit = 1000. ):
+  '''Pace in <timedelta> per Km (or per mile with unit = 1609.34), as run_record does.'''
+  if speed_m_per_s is None or speed_m_per_s <= 0.001:
+    return timedelta(0)
+  nsec = int( unit / speed_m_per_s )
+  return timedelta( minutes = int( nsec / 60 ), seconds = nsec % 60 )
+
+def _weighted( sessions, name, weights ):
+  '''Average of a session field weighted by the timer time, None if no session has it.'''
+  pairs = [ ( fields[ name ], wgt ) for fields, wgt in zip( sessions, weights ) if fields.get( name ) is not None ]
+  if len( pairs ) == 0:
+    return None
+  total = sum( wgt for value, wgt in pairs )
+  if total <= 0:
+    return sum( value for value, wgt in pairs ) / float( len( pairs ) )
+  return sum( value * wgt for value, wgt in pairs ) / total
+
+def session_summary( ffitname, hours_dif = timedelta(hours = -6) ):
+  '''Get the per-run summary of a .fit file from its session and lap messages.
+
+    Parameters:
+    -- ffitname   input file name.fit.
+    -- hours_dif  difference of hours compared to UTC, as for run_record.
+
+    Return an <OrderedDict> with the keys of run_record.getSummary(), the quantities not recorded by the
+    device are None. None if the file has no session message: the records have to be decoded.
+  '''
+  sessions = [ ]
+  laps = [ ]
+  for name, fields in fit_scan( ffitname, check_crc = False ).messages( [ "session", "lap" ] ):
+    if name == "session": sessions.append( fields )
+    else: laps.append( fields )
+  sessions = [ fields for fields in sessions if fields.get( "start_time" ) is not None ]
+  if len( sessions ) == 0:
+    return None
+
+  timer = [ fields.get( "total_timer_time" ) or 0. for fields in sessions ]
+  summary = OrderedDict()
+  summary[ "FileName" ] = ffitname
+  summary[ "UtcOffsetHours" ] = hours_dif.total_seconds() / 3600.
+  start = min( fields[ "start_time" ] for fields in sessions )
+  ends = [ fields.get( "timestamp" ) or fields[ "start_time" ] + timedelta( seconds = fields.get( "total_elapsed_time" ) or 0. )
+           for fields in sessions ]
+  summary[ "StartTime" ] = start + hours_dif
+  summary[ "EndTime" ] = max( ends ) + hours_dif
+  summary[ "TotalTimePassed" ] = max( ends ) - start
+  summary[ "TotalTimeMoving" ] = timedelta( seconds = sum( timer ) )
+
+  distances = [ fields[ "total_distance" ] for fields in sessions if fields.get( "total_distance" ) is not None ]
+  distance = sum( distances ) if len( distances ) > 0 else None
+  summary[ "TotalDistanceMeter" ] = distance
+  summary[ "TotalDistanceKm" ] = distance / 1000. if distance is not None else None
+  summary[ "TotalDistanceMile" ] = distance / _mile_in_meter if distance is not None else None
+
+  altitude = _weighted( sessions, "enhanced_avg_altitude", timer )
+  if altitude is None: altitude = _weighted( sessions, "avg_altitude", timer )
+  ascents = [ fields[ "total_ascent" ] for fields in sessions if fields.get( "total_ascent" ) is not None ]
+  descents = [ fields[ "total_descent" ] for fields in sessions if fields.get( "total_descent" ) is not None ]
+  has_altitude = altitude is not None or len( ascents ) > 0
+  summary[ "AverageAltitude" ] = altitude if has_altitude else None
+  summary[ "AscendMeters" ] = float( sum( ascents ) ) if has_altitude else None
+  summary[ "DescendMeters" ] = float( sum( descents ) ) if has_altitude else None
+
+  #
+  # speed: the average over the timer time, as the average speed of run_record over the moving time
+  #
+  max_speeds = [ _first( fields, [ "enhanced_max_speed", "max_speed" ] ) for fields in sessions ]
+  max_speeds = [ speed for speed in max_speeds if speed is not None ]
+  avg_speed = None
+  if distance is not None and sum( timer ) > 0:
+    avg_speed = distance / sum( timer )
+  elif len( sessions ) == 1:
+    avg_speed = _first( sessions[0], [ "enhanced_avg_speed", "avg_speed" ] )
+  for name in [ "FastestKmTime", "MinimumSpeed", "MaximumSpeed", "AverageSpeed", "MinimumPaceKm", "MaximumPaceKm",
+                "AveragePaceKm", "MinimumPaceMile", "MaximumPaceMile", "AveragePaceMile" ]:
+    summary[ name ] = None
+  if avg_speed is not None and len( max_speeds ) > 0:
+    lap_speeds = [ _first( fields, [ "enhanced_avg_speed", "avg_speed" ] ) for fields in laps ]
+    lap_speeds = [ speed for speed in lap_speeds if speed is not None and speed > 0. ]
+    min_speed = min( lap_speeds ) if len( lap_speeds ) > 0 else avg_speed
+    max_speed = max( max_speeds )
+    km_laps = [ fields[ "total_timer_time" ] * 1000. / fields[ "total_distance" ] for fields in laps
+                if fields.get( "total_distance" ) is not None and fields[ "total_distance" ] >= 1000.
+                and fields.get( "total_timer_time" ) is not None ]
+    summary[ "FastestKmTime" ] = timedelta( seconds = int( min( km_laps ) ) ) if len( km_laps ) > 0 else _pace( avg_speed )
+    summary[ "MinimumSpeed" ] = min_speed
+    summary[ "MaximumSpeed" ] = max_speed
+    summary[ "AverageSpeed" ] = avg_speed
+    summary[ "MinimumPaceKm" ] = _pace( min_speed )
+    summary[ "MaximumPaceKm" ] = _pace( max_speed )
+    summary[ "AveragePaceKm" ] = _pace( avg_speed )
+    summary[ "MinimumPaceMile" ] = _pace( min_speed, _mile_in_meter )
+    summary[ "MaximumPaceMile" ] = _pace( max_speed, _mile_in_meter )
+    summary[ "AveragePaceMile" ] = _pace( avg_speed, _mile_in_meter )
+
+  for measure, lowest in [ ( "Cadence", None ), ( "HeartRate", "min_heart_rate" ) ]:
+    field = "cadence" if measure == "Cadence" else "heart_rate"
+    average = _weighted( sessions, "avg_" + field, timer )
+    maxima = [ fields[ "max_" + field ] for fields in sessions if fields.get( "max_" + field ) is not None ]
+    minima = [ fields[ lowest ] for fields in sessions if lowest is not None and fields.get( lowest ) is not None ]
+    if len( minima ) == 0:
+      minima = [ fields[ "avg_" + field ] for fields in laps if fields.get( "avg_" + field ) ]
+    if average is None or len( maxima ) == 0:
+      summary[ "Minimum" + measure ] = summary[ "Maximum" + measure ] = summary[ "Average" + measure ] = None
+      continue
+    summary[ "Minimum" + measure ] = min( minima ) if len( minima ) > 0 else int( average )
+    summary[ "Maximum" + measure ] = max( maxima )
+    summary[ "Average" + measure ] = int( average )
+
+  logging.info( ' Input ' + ffitname + ' summary taken from %d session(s) and %d lap(s).', len( sessions ), len( laps ) )
+  return summary
@@ -0,0 +1,148 @@
+## @package shared_traces
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Give the decoded traces of a run from a worker process to the parent without pickling them. \par
+#
+#  @detail
+#    A run_record holds about ten python lists of boxed values: sending it back through a pipe costs about as
+#    much as decoding the file. Instead the worker writes the traces as numpy arrays into one block of shared
+#    memory, a file in /dev/shm (python 2 has no multiprocessing.shared_memory), and sends back only a small
+#    header: the summary, the measured list, the mean-maximal curve and the layout of the block. The parent
+#    maps the block and gets the arrays with np.frombuffer, without copying them.
+#
+#    With a cache folder the traces are only needed by the parent in the cache: the worker puts them there
+#    itself (run_cache, in parallel in the workers) and writes no block, so the parent neither copies nor
+#    pickles them. The block is for a cache kept in memory only.
+#
+#    Lifetime of a block: the parent removes the file as soon as it is mapped, so nothing is left behind
+#    even if the job is killed later; the memory itself is given back when the last array viewing it is
+#    deleted (read_sequence calls shared_run.release() once the products of the run are cached). The blocks
+#    of a worker which never reported (crash, timeout) are removed by the parent with remove_block(). \par
+#
+
+import os
+import mmap
+import tempfile
+import numpy as np
+from run_cache import run_cache
+
+_align = 8 # bytes, start of each array in the block
+
+def block_folder():
+  '''Folder of the shared blocks: /dev/shm (memory) if there is one, else the temporary folder.'''
+  if os.path.isdir( "/dev/shm" ) and os.access( "/dev/shm", os.W_OK ):
+    return "/dev/shm"
+  return tempfile.gettempdir()
+
+def block_name( tag ):
+  '''Name of the block of one run, unique for this process and the tag (e.g. the index of the input).'''
+  return os.path.join( block_folder(), "runana_%d_%s.blk" % ( os.getpid(), tag ) )
+
+def write_block( path, arrays ):
+  '''Write the arrays into a new shared block, in the worker.
+
+    Parameters:
+    -- path    name of the block, from block_name().
+    -- arrays  dictionary of name -> 1-D numpy array.
+
+    Return the layout of the block: list of ( name, dtype string, offset in bytes, number of values ).
+  '''
+  layout = [ ]
+  size = 0
+  for name in sorted( arrays ):
+    values = np.ascontiguousarray( arrays[ name ] )
+    layout.append( ( name, values.dtype.str, size, values.size ) )
+    size = size + ( values.nbytes + _align - 1 ) // _align * _align
+  with open( path, "w+b" ) as fp:
+    fp.truncate( max( size, _align ) )
+    block = mmap.mmap( fp.fileno(), max( size, _align ) )
+    for name, dtype, offset, count in layout:
+      values = np.ascontiguousarray( arrays[ name ] )
+      block[ offset:offset + values.nbytes ] = values.tostring()
+    block.close()
+  return layout
+
+def read_block( path, layout ):
+  '''Map a shared block written by write_block(), in the parent, and remove its file.
+
+    Return the dictionary of name -> read-only numpy array viewing the block (no copy).
+  '''
+  with open( path, "rb" ) as fp:
+    block = mmap.mmap( fp.fileno(), 0, access = mmap.ACCESS_READ )
+  # the mapping stays valid without the file, and is freed with the last array using it
+  os.unlink( path )
+  arrays = { }
+  for name, dtype, offset, count in layout:
+    arrays[ name ] = np.frombuffer( block, dtype = np.dtype( dtype ), count = count, offset = offset )
+  return arrays
+
+def remove_block( path ):
+  '''Remove the block of a worker which did not report, if it was written.'''
+  if os.path.exists( path ):
+    os.unlink( path )
+
+def share_run( rrd, path, cache_dir = None ):
+  '''Give the traces of a run_record to the parent, in the worker: put into the run_cache of cache_dir, or
+    written into a shared block if cache_dir is None.
+
+    Return the header to send to the parent: a small dictionary of the summary quantities and the layout
+    (None if the traces are in the cache).
+  '''
+  header = { "summary": rrd.getSummary(), "measures": rrd.getListMeasures(),
+             "mean_max": rrd.getMeanMaxSpeedList(), "route": rrd.getRoute(), "block": None, "layout": None }
+  if cache_dir is not None:
+    run_cache( cache_dir ).put( rrd.getFileName(), "traces", rrd.getTraces() )
+  else:
+    header[ "block" ] = path
+    header[ "layout" ] = write_block( path, rrd.getTraces() )
+  return header
+
+class shared_run:
+  '''Document for class shared_run
+
+    Purpose: the decoded run given back by a worker process. It has the getters of run_record used by
+    read_sequence, and the traces are views of the shared block (see run_record.getTraces()).
+  '''
+
+  def __init__(self, header ):
+    '''Constructor of class shared_run.
+      Parameter header: the dictionary made by share_run() in the worker. The block is mapped and removed.
+    '''
+    self._summary = header[ "summary" ]
+    self._measures = header[ "measures" ]
+    self._mean_max = header[ "mean_max" ]
+    self._route = header[ "route" ]
+    self._traces = None
+    if header[ "block" ] is not None:
+      self._traces = read_block( header[ "block" ], header[ "layout" ] )
+
+  def getFileName( self ):
+    return self._summary[ "FileName" ]
+
+  def getSummary( self ):
+    return self._summary
+
+  def getListMeasures( self ):
+    return self._measures
+
+  def getTotalDistanceKm( self ):
+    return self._summary[ "TotalDistanceKm" ] or 0.
+
+  def getAverageSpeed( self ):
+    return self._summary[ "AverageSpeed" ] or 0.
+
+  def getMeanMaxSpeedList( self ):
+    return self._mean_max
+
+  def getRoute( self ):
+    return self._route
+
+  def getTraces( self ):
+    '''Get the traces as read-only numpy arrays viewing the shared block, None if the worker put them in the
+      cache or after release().'''
+    return self._traces
+
+  def release( self ):
+    '''Drop the references of this run to the shared block, which is freed when no other array views it.'''
+    self._traces = None
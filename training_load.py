@@ -0,0 +1,272 @@
+## @package training_load
+#  @author Jie Yu (jie.yu@cern.ch)
+#  @date October 1, 2018
+#
+#  @brief Training load over the run history: a stress score per run, and the acute (fatigue) and chronic
+#         (fitness) loads of each day. \par
+#
+#  @detail
+#    * Stress score of a run: Banister's TRIMP from the heart rate reserve if the heart rate is recorded, else
+#      a pace score of 100 per hour at the threshold speed (e.g. the best 1 hour speed), growing with the
+#      square of the speed as the heart rate based scores do.
+#    * The loads of each calendar day are summed. The acute and the chronic loads are exponentially weighted
+#      means of the daily loads, with time constants of 7 and 42 days:
+#        x[d] = a * x[d-1] + ( 1 - a ) * load[d],  a = exp( -1 / days )
+#      The recurrence is solved for a block of days at once: x[d] = a^(d+1) * ( x[-1] + ( 1 - a ) * cumsum(
+#      load[j] / a^(j+1) ) ), with blocks short enough that a^-n keeps the precision.
+#    * The state (the score of each run, the daily loads and curves) is kept in a JSON file. A new run only
+#      updates the curves from its day on, starting from the kept value of the day before. \par
+#
+
+import os
+import json
+import logging
+import datetime
+import numpy as np
+from resample import resample
+
+acute_days = 7.
+chronic_days = 42.
+_max_growth = 1e4 # largest a^-n in one block of the recurrence
+
+def trimp( traces, rest_hr = 60., max_hr = 190., max_gap = 10. ):
+  '''Banister's training impulse of a run: sum over the minutes of hrr * 0.64 * exp( 1.92 * hrr ), with hrr
+    the fraction of the heart rate reserve. The pauses longer than max_gap seconds are left out.
+
+    Return: the TRIMP, None without heart rate.
+  '''
+  if traces is None or "time" not in traces or "heart_rate" not in traces:
+    return None
+  heart = resample( traces[ "time" ], { "heart_rate": traces[ "heart_rate" ] }, 1., max_gap, "nan" )[ "heart_rate" ]
+  heart = heart[ np.isfinite( heart ) & ( heart > 0. ) ]
+  if heart.size == 0:
+    return None
+  hrr = np.clip( ( heart - rest_hr ) / float( max_hr - rest_hr ), 0., 1. )
+  return float( np.sum( hrr * 0.64 * np.exp( 1.92 * hrr ) ) / 60. )
+
+def pace_score( traces, threshold_speed, max_gap = 10. ):
+  '''Pace based stress score of a run: 100 for one hour at the threshold speed (m/s), from the 1 second
+    speed squared. The pauses longer than max_gap seconds are left out.
+
+    Return: the score, None without speed.
+  '''
+  if traces is None or "time" not in traces or "speed" not in traces or not threshold_speed:
+    return None
+  speed = resample( traces[ "time" ], { "speed": traces[ "speed" ] }, 1., max_gap, "nan" )[ "speed" ]
+  speed = speed[ np.isfinite( speed ) ]
+  if speed.size == 0:
+    return None
+  return float( np.sum( ( speed / threshold_speed ) ** 2 ) / 3600. * 100. )
+
+def stress_score( traces, summary = None, rest_hr = 60., max_hr = 190., threshold_speed = None ):
+  '''Stress score of a run: TRIMP if the heart rate is recorded, else the pace score.
+
+    Parameters:
+    -- traces           run_record.getTraces(), None if not decoded (e.g. index mode).
+    -- summary          run_record.getSummary(), used without traces: the averages over the moving time.
+    -- rest_hr, max_hr  heart rate at rest and maximum heart rate of the athlete.
+    -- threshold_speed  speed in m/s held for about one hour, for the pace score.
+
+    Return: the score, None if it can not be calculated.
+  '''
+  if traces is not None:
+    score = trimp( traces, rest_hr, max_hr )
+    if score is None:
+      score = pace_score( traces, threshold_speed )
+    return score
+  if summary is None or summary.get( "TotalTimeMoving" ) is None:
+    return None
+  minutes = summary[ "TotalTimeMoving" ].total_seconds() / 60.
+  if summary.get( "AverageHeartRate" ):
+    hrr = min( max( ( summary[ "AverageHeartRate" ] - rest_hr ) / float( max_hr - rest_hr ), 0. ), 1. )
+    return float( minutes * hrr * 0.64 * np.exp( 1.92 * hrr ) )
+  if summary.get( "AverageSpeed" ) and threshold_speed:
+    return minutes / 60. * ( summary[ "AverageSpeed" ] / threshold_speed ) ** 2 * 100.
+  return None
+
+def ewma_days( loads, days, start = 0. ):
+  '''Exponentially weighted mean of daily loads, x[d] = a * x[d-1] + ( 1 - a ) * load[d] with a = exp( -1 / days ).
+
+    Parameters:
+    -- loads  array of the load of each day.
+    -- days   time constant in days.
+    -- start  value of the day before the first one.
+
+    Return: numpy array of the value of each day.
+  '''
+  loads = np.asarray( loads, dtype = float )
+  decay = np.exp( -1. / days )
+  block = max( 1, int( np.log( _max_growth ) * days ) )
+  out = np.empty( loads.size )
+  last = float( start )
+  for begin in range( 0, loads.size, block ):
+    chunk = loads[ begin:begin + block ]
+    powers = decay ** np.arange( 1, chunk.size + 1 )
+    out[ begin:begin + chunk.size ] = powers * ( last + ( 1. - decay ) * np.cumsum( chunk / powers ) )
+    last = out[ begin + chunk.size - 1 ]
+  return out
+
+class training_load:
+  '''Document for class training_load
+
+    Purpose: keep the stress score of each run and the daily acute and chronic loads, updated run by run.
+    Example:
+      load = training_load( "out/training_load.json" )
+      load.addRun( "a.fit", start_time, score )
+      load.update()
+      load.save()
+      days, acute, chronic = load.getDays(), load.getAcuteLoad(), load.getChronicLoad()
+  '''
+
+  def __init__(self, state_name = None, acute = acute_days, chronic = chronic_days, rest_hr = 60., max_hr = 190. ):
+    '''Constructor of class training_load.
+      Parameter state_name: the JSON file of the state, read if found. None: only kept in memory.
+      Parameter acute, chronic: the time constants in days. A state with other time constants is ignored.
+      Parameter rest_hr, max_hr: the heart rates the scores are made with. A state with others is ignored.
+    '''
+    self._state_name = state_name
+    self._acute_days = acute
+    self._chronic_days = chronic
+    self._rest_hr = rest_hr
+    self._max_hr = max_hr
+    # file name -> [ day (ISO format), score, file stamp, source of the summary, threshold speed of a pace score ]
+    self._runs = { }
+    self._first_day = None
+    self._loads = np.zeros( 0 )
+    self._acute = np.zeros( 0 )
+    self._chronic = np.zeros( 0 )
+    self._changed_from = None # first day whose curves are out of date
+    if state_name is not None and os.path.isfile( state_name ):
+      self._read()
+
+  def _read(self):
+    try:
+      with open( self._state_name ) as fp:
+        state = json.load( fp )
+    except ValueError:
+      logging.warning( ' Training load ' + self._state_name + ' is broken. Start from scratch. ')
+      return None
+    if state.get( "acute_days" ) != self._acute_days or state.get( "chronic_days" ) != self._chronic_days:
+      logging.warning( ' Training load ' + self._state_name + ' has other time constants. Start from scratch. ')
+      return None
+    if state.get( "rest_hr" ) != self._rest_hr or state.get( "max_hr" ) != self._max_hr:
+      logging.warning( ' Training load ' + self._state_name + ' has other heart rates. Start from scratch. ')
+      return None
+    self._runs = state[ "runs" ]
+    if state[ "first_day" ] is not None:
+      self._first_day = datetime.datetime.strptime( state[ "first_day" ], "%Y-%m-%d" ).date()
+    self._loads = np.array( state[ "loads" ], dtype = float )
+    self._acute = np.array( state[ "acute" ], dtype = float )
+    self._chronic = np.array( state[ "chronic" ], dtype = float )
+
+  def save(self):
+    '''Write the state to its JSON file, through a temporary file.'''
+    if self._state_name is None:
+      return None
+    self.update()
+    state = { "acute_days": self._acute_days, "chronic_days": self._chronic_days,
+              "rest_hr": self._rest_hr, "max_hr": self._max_hr, "runs": self._runs,
+              "first_day": None if self._first_day is None else self._first_day.isoformat(),
+              "loads": self._loads.tolist(), "acute": self._acute.tolist(), "chronic": self._chronic.tolist() }
+    with open( self._state_name + ".tmp", "w" ) as fp:
+      json.dump( state, fp )
+    os.rename( self._state_name + ".tmp", self._state_name )
+
+  def hasRun(self, ffitname, stamp = None, source = None, threshold_speed = None ):
+    '''Whether the score of the run is already in the state and still holds.
+
+      Parameters:
+      -- stamp            run_cache.file_stamp of the file, None: not checked.
+      -- source           source of the summary of the run (read_sequence.getSources()), None: not checked.
+      -- threshold_speed  current threshold speed: a pace score made with another one is out of date.
+    '''
+    if ffitname not in self._runs:
+      return False
+    day, score, kept_stamp, kept_source, kept_threshold = self._runs[ ffitname ]
+    if stamp is not None and kept_stamp != list( stamp ):
+      return False
+    if source is not None and kept_source != source:
+      return False
+    return kept_threshold is None or kept_threshold == threshold_speed
+
+  def getRuns(self):
+    ''' Return the file names of the runs scored in the state '''
+    return list( self._runs )
+
+  def _index(self, day ):
+    '''Index of the day in the daily arrays, which are extended (with no load) to hold it.'''
+    if self._first_day is None:
+      self._first_day = day
+    if day < self._first_day:
+      before = ( self._first_day - day ).days
+      self._loads = np.concatenate( ( np.zeros( before ), self._loads ) )
+      self._acute = np.concatenate( ( np.zeros( before ), self._acute ) )
+      self._chronic = np.concatenate( ( np.zeros( before ), self._chronic ) )
+      if self._changed_from is not None: self._changed_from += before
+      self._first_day = day
+    idx = ( day - self._first_day ).days
+    changed = idx
+    if idx >= self._loads.size:
+      # the days without run in between also get their curves
+      changed = min( idx, self._acute.size )
+      self._loads = np.concatenate( ( self._loads, np.zeros( idx + 1 - self._loads.size ) ) )
+    self._changed_from = changed if self._changed_from is None else min( self._changed_from, changed )
+    return idx
+
+  def addRun(self, ffitname, start_time, score, stamp = None, source = None, threshold_speed = None ):
+    '''Add the score of a run started at start_time (<datetime>), replacing the one kept for the same file.
+      Parameter stamp, source: see hasRun(). Parameter threshold_speed: the one of a pace score, None for TRIMP.
+    '''
+    if score is None or start_time is None:
+      return None
+    self.removeRun( ffitname )
+    day = start_time.date()
+    idx = self._index( day ) # before using self._loads, which it may extend
+    self._loads[ idx ] += score
+    self._runs[ ffitname ] = [ day.isoformat(), score, None if stamp is None else list( stamp ), source, threshold_speed ]
+
+  def removeRun(self, ffitname ):
+    '''Take the score of the run out of the daily loads, e.g. when its file is modified.'''
+    if ffitname not in self._runs:
+      return None
+    day, score = self._runs.pop( ffitname )[ :2 ]
+    idx = self._index( datetime.datetime.strptime( day, "%Y-%m-%d" ).date() )
+    self._loads[ idx ] = max( self._loads[ idx ] - score, 0. )
+
+  def update(self):
+    '''Calculate the curves from the first changed day on, from the values of the day before.'''
+    if self._changed_from is None:
+      return None
+    start = self._changed_from
+    acute_start = self._acute[ start - 1 ] if start > 0 else 0.
+    chronic_start = self._chronic[ start - 1 ] if start > 0 else 0.
+    self._acute = np.concatenate( ( self._acute[ :start ],
+                                    ewma_days( self._loads[ start: ], self._acute_days, acute_start ) ) )
+    self._chronic = np.concatenate( ( self._chronic[ :start ],
+                                      ewma_days( self._loads[ start: ], self._chronic_days, chronic_start ) ) )
+    self._changed_from = None
+
+  def getDays(self):
+    ''' Return the list of the days (<date>) of the curves, from the first run to the last one '''
+    if self._first_day is None:
+      return [ ]
+    return [ self._first_day + datetime.timedelta( days = idx ) for idx in range( self._loads.size ) ]
+
+  def getDailyLoad(self):
+    ''' Return the array of the summed stress score of each day '''
+    return self._loads
+
+  def getAcuteLoad(self):
+    ''' Return the array of the acute load (fatigue) of each day '''
+    self.update()
+    return self._acute
+
+  def getChronicLoad(self):
+    ''' Return the array of the chronic load (fitness) of each day '''
+    self.update()
+    return self._chronic
+
+  def getBalance(self):
+    ''' Return the array of chronic - acute load (form) of each day '''
+    self.update()
+    return self._chronic - self._acute